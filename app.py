@@ -2,13 +2,31 @@ import os
 import logging
 from flask import Flask, render_template, request, jsonify, send_file
 from werkzeug.utils import secure_filename
-from video_merger import VideoGenerator
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+from video_merger import VideoGenerator, render_variant, WATERMARK_PATH
 import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 import traceback
 import re
+import json
 import shutil
-from models import db, VideoMaterial, MusicMaterial, GeneratedVideo
+from models import db, VideoMaterial, MusicMaterial, GeneratedVideo, ensure_columns
+from media_index import MediaIndex, probe_media, file_signature, VIDEO_EXTENSIONS
+from tts_cache import NarrationCache
+from mezzanine import MezzanineCache
+from pcm_cache import PCMCache
+from tts_engine import create_tts_engine, mp3_duration
+from loudness import analyze_loudness, bgm_gain, DEFAULT_BGM_GAIN
+from jobs import JobManager, current_job, is_valid_job_id
+from workspace import JobWorkspace, prune_workspaces
+from render_plan import PLAN_VERSION, build_render_plan, build_timeline, variant_key, request_key, derive_seed, estimate_word_timings, estimate_duration, ESTIMATED_CHARS_PER_SECOND, SELECTION_MARGIN
+from segmentation import segment_word_timings
+from render_cache import RenderCache
+from endboard_cache import DEFAULT_ENDBOARD_PATH
+from ffmpeg_backend import RENDITION_FITS
 import random
 from urllib.parse import quote, unquote
 
@@ -28,6 +46,22 @@ app.config['VIDEO_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'videos')
 app.config['BGM_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'bgm')
 app.config['OUTPUT_FOLDER'] = 'output'
 app.config['VIDEO_LIBRARY_FOLDER'] = 'video_library'
+app.config['TTS_CACHE_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'tts_cache')
+app.config['TTS_CACHE_MAX_BYTES'] = 2 * 1024 ** 3  # 配音缓存上限 2GB
+app.config['BGM_CACHE_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'bgm_cache')
+app.config['MEZZANINE_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'mezzanine')
+app.config['MEZZANINE_MAX_BYTES'] = 20 * 1024 ** 3  # 素材中间文件缓存上限 20GB
+app.config['TTS_ENGINE'] = os.environ.get('TTS_ENGINE', 'edge')  # 语音合成引擎：edge 或 stub（本地测试）
+app.config['RENDER_WORKERS'] = int(os.environ.get('RENDER_WORKERS', 2))  # 后台渲染线程数
+app.config['VARIANT_WORKERS'] = int(os.environ.get('VARIANT_WORKERS', min(os.cpu_count() or 1, 4)))  # 并行渲染变体的进程数
+app.config['ENCODE_THREADS'] = int(os.environ.get('ENCODE_THREADS', 8))  # ffmpeg 编码线程总预算
+app.config['RENDER_CACHE_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'render_cache')
+app.config['RENDER_CACHE_MAX_BYTES'] = 50 * 1024 ** 3  # 渲染成品缓存上限 50GB
+app.config['RENDER_CACHE_MAX_AGE'] = 30 * 24 * 3600  # 30 天未被复用的成品淘汰
+app.config['JOB_WORKSPACE_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'jobs')
+app.config['JOB_WORKSPACE_MAX_AGE'] = 7 * 24 * 3600  # 失败任务的工作目录保留 7 天，供重试
+app.config['STREAM_THRESHOLD'] = int(os.environ.get('STREAM_THRESHOLD', 600))  # 语音超过该秒数时按窗口流式渲染
+app.config['STREAM_WINDOW'] = int(os.environ.get('STREAM_WINDOW', 60))  # 流式渲染每个窗口的秒数
 
 # 全局进度跟踪变量
 process_status = {
@@ -39,6 +73,36 @@ process_status = {
 # 初始化数据库
 db.init_app(app)
 
+# 配音缓存：相同文本、语音和语速的请求直接复用已合成的音频
+narration_cache = NarrationCache(app.config['TTS_CACHE_FOLDER'], app.config['TTS_CACHE_MAX_BYTES'])
+
+# 素材中间文件缓存：上传后在后台转码为统一尺寸和帧率，渲染时直接读取
+mezzanine_cache = MezzanineCache(app.config['MEZZANINE_FOLDER'], max_bytes=app.config['MEZZANINE_MAX_BYTES'])
+
+# 背景音乐解码缓存：上传时预先解码为 PCM，混音时内存映射读取
+bgm_pcm_cache = PCMCache(app.config['BGM_CACHE_FOLDER'])
+
+# 渲染成品缓存：渲染计划相同的请求直接返回已有的视频
+render_cache = RenderCache(app.config['RENDER_CACHE_FOLDER'], app.config['RENDER_CACHE_MAX_BYTES'], app.config['RENDER_CACHE_MAX_AGE'])
+
+# 后台生成任务队列，每个任务独立记录进度、结果和错误
+job_manager = JobManager(max_workers=app.config['RENDER_WORKERS'])
+
+# 渲染视频变体的进程池（首次使用时创建）
+_variant_pool = None
+_variant_pool_lock = threading.Lock()
+
+def get_variant_pool():
+    """获取共享的变体渲染进程池（使用 spawn，避免在多线程进程中 fork）"""
+    global _variant_pool
+    with _variant_pool_lock:
+        if _variant_pool is None:
+            _variant_pool = ProcessPoolExecutor(
+                max_workers=app.config['VARIANT_WORKERS'],
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _variant_pool
+
 # 确保必要的目录存在
 for folder in [app.config['UPLOAD_FOLDER'], app.config['VIDEO_FOLDER'], app.config['BGM_FOLDER'], app.config['OUTPUT_FOLDER']]:
     os.makedirs(folder, exist_ok=True)
@@ -56,10 +120,140 @@ for category in ['male', 'modern_sweet', 'modern_urban', 'ancient']:
 # 允许的文件类型
 ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv'}
 ALLOWED_AUDIO_EXTENSIONS = {'mp3', 'wav', 'ogg'}
+RENDER_ENGINES = {'moviepy', 'ffmpeg'}
+SUBTITLE_MODES = {'sprite', 'ass'}
+# 输出分辨率的宽高上限
+MAX_RESOLUTION = 3840
+# 输出规格未指定码率时使用的视频码率
+DEFAULT_RENDITION_BITRATE = '3000k'
 
 def allowed_file(filename, allowed_extensions):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
+def index_video_file(filepath, filename=None):
+    """探测视频元数据并写入 VideoMaterial（已存在记录时更新）"""
+    material = VideoMaterial.query.filter_by(filepath=filepath).first()
+    if material is None:
+        material = VideoMaterial(filename=filename or os.path.basename(filepath), filepath=filepath)
+        db.session.add(material)
+    material.update_from_probe(probe_media(filepath))
+    db.session.commit()
+    if not material.is_valid:
+        logger.warning(f"视频文件无效: {filepath}")
+    else:
+        mezzanine_cache.schedule(filepath)
+    return material
+
+def analyze_music_file(filepath, filename=None):
+    """分析背景音乐的响度并写入 MusicMaterial（已存在记录时更新）"""
+    material = MusicMaterial.query.filter_by(filepath=filepath).first()
+    if material is None:
+        material = MusicMaterial(filename=filename or os.path.basename(filepath), filepath=filepath)
+        db.session.add(material)
+    info = analyze_loudness(filepath)
+    material.size, material.mtime = file_signature(filepath)
+    material.update_from_loudness(info, bgm_gain(info['loudness'], info['peak']))
+    db.session.commit()
+    logger.info(f"背景音乐响度: {filepath} {info['loudness']} LUFS，峰值 {info['peak']} dBTP，增益 {material.gain:.3f}")
+    return material
+
+def get_bgm_gain(filepath, analyze=True):
+    """读取背景音乐预先计算的增益；没有记录或文件已变化时补做一次分析
+
+    analyze=False 时不做分析（请求线程中不解码音频），没有有效记录时使用默认音量。
+    """
+    try:
+        material = MusicMaterial.query.filter_by(filepath=filepath).first()
+        if (material is None or material.gain is None or
+                (material.size, material.mtime) != file_signature(filepath)):
+            if not analyze:
+                return DEFAULT_BGM_GAIN
+            material = analyze_music_file(filepath)
+        return material.gain
+    except Exception as e:
+        logger.warning(f"读取背景音乐增益失败 {filepath}: {str(e)}，使用默认音量")
+        return DEFAULT_BGM_GAIN
+
+# 同一时间只有一个线程同步素材库索引
+library_index_lock = threading.Lock()
+library_sync_pending = threading.Event()
+
+def load_video_library_index():
+    """同步视频素材库目录与数据库索引，返回内存中的 MediaIndex
+
+    只对新增或大小/修改时间变化的文件调用 ffprobe，其余文件仅做 stat。
+    """
+    with library_index_lock:
+        return _sync_video_library_index()
+
+def schedule_library_sync():
+    """在后台线程中同步素材库索引（已有待执行的同步时跳过）"""
+    if library_sync_pending.is_set():
+        return
+    library_sync_pending.set()
+
+    def run():
+        try:
+            with app.app_context():
+                load_video_library_index()
+        except Exception as e:
+            logger.warning(f"同步视频素材库索引失败: {str(e)}")
+        finally:
+            library_sync_pending.clear()
+
+    threading.Thread(target=run, daemon=True).start()
+
+def _sync_video_library_index():
+    folder = app.config['VIDEO_LIBRARY_FOLDER']
+    files = {os.path.join(folder, f) for f in os.listdir(folder)
+             if f.lower().endswith(VIDEO_EXTENSIONS)}
+
+    materials = {}
+    for material in VideoMaterial.query.all():
+        if os.path.dirname(material.filepath) != folder:
+            continue
+        if material.filepath not in files:
+            # 文件已被删除，移除索引
+            db.session.delete(material)
+            continue
+        materials[material.filepath] = material
+
+    for filepath in sorted(files):
+        material = materials.get(filepath)
+        if material is not None and (material.size, material.mtime) == file_signature(filepath):
+            continue
+        if material is None:
+            material = VideoMaterial(filename=os.path.basename(filepath), filepath=filepath)
+            db.session.add(material)
+            materials[filepath] = material
+        logger.info(f"更新视频索引: {filepath}")
+        material.update_from_probe(probe_media(filepath))
+        if material.is_valid:
+            mezzanine_cache.schedule(filepath)
+
+    db.session.commit()
+    return MediaIndex.from_materials(materials.values())
+
+def stored_video_library_index():
+    """只读取数据库中已有的视频索引，不探测新增或变化的文件（供请求线程中的预览和缓存查询使用）
+
+    文件已删除或大小/修改时间变化的记录不计入；目录中有未入库的文件时在后台同步索引，
+    生成任务开始时也会由 load_video_library_index 同步。
+    """
+    folder = app.config['VIDEO_LIBRARY_FOLDER']
+    files = {os.path.join(folder, f) for f in os.listdir(folder)
+             if f.lower().endswith(VIDEO_EXTENSIONS)}
+    materials = []
+    for material in VideoMaterial.query.all():
+        if material.filepath not in files:
+            continue
+        if (material.size, material.mtime) != file_signature(material.filepath):
+            continue
+        materials.append(material)
+    if len(materials) < len(files):
+        schedule_library_sync()
+    return MediaIndex.from_materials(materials)
+
 def preprocess_text(text):
     """预处理文本，移除HTML标签和特殊字符"""
     # 移除HTML标签
@@ -131,7 +325,9 @@ def upload_video():
         
         if file and allowed_file(file.filename, {'mp4', 'avi', 'mov', 'mkv'}):
             filename = secure_filename(file.filename)
-            file.save(os.path.join(app.config['VIDEO_LIBRARY_FOLDER'], filename))
+            filepath = os.path.join(app.config['VIDEO_LIBRARY_FOLDER'], filename)
+            file.save(filepath)
+            index_video_file(filepath, filename)
             return jsonify({'message': '视频上传成功'})
         else:
             return jsonify({'error': '不支持的文件类型'}), 400
@@ -146,6 +342,9 @@ def delete_video(filename):
         file_path = os.path.join(app.config['VIDEO_LIBRARY_FOLDER'], filename)
         if os.path.exists(file_path):
             os.remove(file_path)
+            mezzanine_cache.discard(file_path)
+            VideoMaterial.query.filter_by(filepath=file_path).delete()
+            db.session.commit()
             return jsonify({'message': '视频删除成功'})
         else:
             return jsonify({'error': '文件不存在'}), 404
@@ -188,8 +387,12 @@ def upload_material():
             filepath=filepath,
             size=os.path.getsize(filepath)
         )
+        if material_type == 'video':
+            material.update_from_probe(probe_media(filepath))
         db.session.add(material)
         db.session.commit()
+        if material_type == 'video' and material.is_valid:
+            mezzanine_cache.schedule(filepath)
         
         return jsonify({
             'message': '文件上传成功',
@@ -224,161 +427,559 @@ def get_materials():
 
 @app.route('/process_progress', methods=['GET'])
 def get_progress():
-    """获取当前处理进度"""
-    global process_status
+    """获取处理进度（指定 job_id 时返回该任务，否则返回最近一次更新的进度）"""
+    job_id = request.args.get('job_id')
+    if job_id:
+        job = job_manager.get(job_id)
+        if job is None:
+            return jsonify({'error': '任务不存在'}), 404
+        return jsonify(dict(job.to_dict(), task_id=job.id))
     return jsonify(process_status)
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查询生成任务的进度、结果和错误信息"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/retry', methods=['POST'])
+def retry_job(job_id):
+    """重试失败的任务：沿用原任务 ID 和工作目录，从最后完成的阶段继续"""
+    try:
+        if not is_valid_job_id(job_id):
+            return jsonify({'error': '无效的任务 ID'}), 400
+        job = job_manager.get(job_id)
+        if job is not None and job.status in ('queued', 'running'):
+            return jsonify({'error': '任务仍在执行中'}), 409
+        if job is not None and job.status == 'completed':
+            return jsonify({'error': '任务已完成，无需重试'}), 409
+
+        # 服务重启后内存中没有任务记录，从工作目录的清单恢复参数
+        params = job.params if job is not None else None
+        if params is None:
+            workspace = JobWorkspace(app.config['JOB_WORKSPACE_FOLDER'], job_id)
+            params = workspace.params
+        if params is None:
+            return jsonify({'error': '任务不存在或工作目录已清理'}), 404
+
+        job = job_manager.submit(run_generate_job, params, job_id=job_id)
+        return jsonify({
+            'message': '任务已重新提交',
+            'job_id': job.id,
+            'status_url': f'/jobs/{job.id}'
+        }), 202
+    except Exception as e:
+        logger.error(f"重试任务失败: {str(e)}")
+        return jsonify({'error': f'重试任务失败: {str(e)}'}), 500
+
 def update_progress(progress, stage):
-    """更新处理进度"""
-    global process_status
-    process_status['progress'] = progress
-    process_status['stage'] = stage
+    """更新处理进度（在任务线程中调用时写入当前任务）"""
+    job = current_job()
+    if job is not None:
+        job_manager.update(job, progress, stage)
+        process_status.update({'progress': progress, 'stage': stage, 'task_id': job.id})
+    else:
+        process_status['progress'] = progress
+        process_status['stage'] = stage
     logger.info(f"进度更新: {progress}%, 阶段: {stage}")
 
+def parse_resolution(value):
+    """解析 "宽x高" 形式的分辨率，返回 [宽, 高]，无效时抛出 ValueError"""
+    match = re.fullmatch(r'(\d+)x(\d+)', str(value).strip())
+    # H.264 的 yuv420p 要求宽高均为偶数
+    if not match or any(int(v) % 2 or not 0 < int(v) <= MAX_RESOLUTION for v in match.groups()):
+        raise ValueError(f'不支持的分辨率: {value}')
+    return [int(match.group(1)), int(match.group(2))]
+
+def parse_renditions(value):
+    """解析输出规格列表（JSON），如 [{"name": "hd", "size": "1080x1920", "bitrate": "4000k", "fit": "pad"}]
+
+    name 默认取分辨率，bitrate 默认 3000k，fit 为 crop（裁切）、pad（加黑边）或 stretch（拉伸），默认 pad。
+    """
+    try:
+        items = json.loads(value)
+    except ValueError:
+        raise ValueError('输出规格必须是 JSON 列表')
+    if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+        raise ValueError('输出规格必须是非空的 JSON 列表')
+
+    renditions = []
+    for item in items:
+        size = parse_resolution(item.get('size', ''))
+        name = str(item.get('name') or f"{size[0]}x{size[1]}")
+        if not re.fullmatch(r'[\w.-]+', name):
+            raise ValueError(f'输出规格名称无效: {name}')
+        bitrate = str(item.get('bitrate') or DEFAULT_RENDITION_BITRATE)
+        if not re.fullmatch(r'\d+[kM]?', bitrate):
+            raise ValueError(f'不支持的码率: {bitrate}')
+        fit = item.get('fit', 'pad')
+        if fit not in RENDITION_FITS:
+            raise ValueError(f'不支持的适配方式: {fit}')
+        renditions.append({'name': name, 'size': size, 'bitrate': bitrate, 'fit': fit})
+
+    if len({rendition['name'] for rendition in renditions}) != len(renditions):
+        raise ValueError('输出规格名称重复')
+    return renditions
+
+def parse_generate_params(form):
+    """解析并校验生成请求的表单参数，参数无效时抛出 ValueError"""
+    text = form.get('text')
+    voice = form.get('voice')
+    video_count = int(form.get('video_count', 1))
+    novel_type = form.get('novel_type', 'male')  # 获取小说类型
+    subtitle_length = int(form.get('subtitle_length', 12))  # 获取字幕长度，默认为12
+    font = form.get('font', 'STHeiti')  # 获取字体参数
+    render_engine = form.get('render_engine', 'moviepy')  # 渲染引擎：moviepy 或 ffmpeg
+    subtitle_mode = form.get('subtitle_mode', 'sprite')  # 字幕方式：sprite 或 ass
+    segments = int(form.get('segments', 1))  # 单个视频分段并行渲染的段数
+    resolution = form.get('resolution')  # 输出分辨率，如 1080x1920，不指定时取第一个素材的尺寸
+    renditions = form.get('renditions')  # 输出规格列表（JSON），一次合成后同时输出多个分辨率和码率
+    seed = form.get('seed')  # 选片随机种子，不指定时由请求参数推导
+
+    if not text:
+        raise ValueError('请提供文本内容')
+
+    if video_count < 1:
+        raise ValueError('视频数量必须大于等于1')
+
+    if render_engine not in RENDER_ENGINES:
+        raise ValueError(f'不支持的渲染引擎: {render_engine}')
+
+    if subtitle_mode not in SUBTITLE_MODES:
+        raise ValueError(f'不支持的字幕方式: {subtitle_mode}')
+
+    if segments < 1:
+        raise ValueError('分段数必须大于等于1')
+
+    resolution = parse_resolution(resolution) if resolution else None
+    renditions = parse_renditions(renditions) if renditions else None
+    if renditions and resolution is None:
+        # 画面按最大的输出规格合成一次，再缩放到其余规格
+        resolution = max((rendition['size'] for rendition in renditions), key=lambda size: size[0] * size[1])
+
+    # 根据小说类型选择对应的音乐素材目录
+    bgm_category_path = os.path.join(app.config['BGM_FOLDER'], novel_type)
+
+    # 获取分类目录下的所有音乐文件（排序后选择结果与目录遍历顺序无关）
+    bgm_files = []
+    if os.path.exists(bgm_category_path):
+        bgm_files = sorted(f for f in os.listdir(bgm_category_path)
+                           if f.lower().endswith(tuple(ALLOWED_AUDIO_EXTENSIONS)))
+
+    # 检查是否有可用的背景音乐
+    if not bgm_files:
+        logger.warning(f"未找到'{novel_type}'类型的背景音乐，请先上传")
+        raise ValueError(f"未找到'{novel_type}'类型的背景音乐，请先上传")
+
+    params = {
+        'text': text,
+        'voice': voice,
+        'video_count': video_count,
+        'novel_type': novel_type,
+        'subtitle_length': subtitle_length,
+        'font': font,
+        'render_engine': render_engine,
+        'subtitle_mode': subtitle_mode,
+        'segments': segments,
+        'resolution': resolution,
+        'renditions': renditions,
+        'bgm_category_path': bgm_category_path,
+        'bgm_files': bgm_files,
+    }
+    params['seed'] = int(seed) if seed else derive_seed(params)
+    return params
+
 @app.route('/generate', methods=['POST'])
 def generate():
-    """生成视频接口"""
+    """生成视频接口：校验参数后提交后台任务，立即返回任务 ID"""
     try:
-        # 重置进度
-        global process_status
-        process_status = {
-            'progress': 0,
-            'stage': '准备中...',
-            'task_id': datetime.now().strftime("%Y%m%d%H%M%S")
-        }
-        
-        text = request.form.get('text')
-        voice = request.form.get('voice')
-        video_count = int(request.form.get('video_count', 1))
-        novel_type = request.form.get('novel_type', 'male')  # 获取小说类型
-        subtitle_length = int(request.form.get('subtitle_length', 12))  # 获取字幕长度，默认为12
-        font = request.form.get('font', 'STHeiti')  # 获取字体参数
-        
-        if not text:
-            return jsonify({'error': '请提供文本内容'}), 400
-        
-        if video_count < 1:
-            return jsonify({'error': '视频数量必须大于等于1'}), 400
-            
-        update_progress(5, "正在初始化...")
-            
-        # 创建临时目录
-        temp_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'temp')
-        os.makedirs(temp_dir, exist_ok=True)
-        
-        # 生成语音文件名
-        narration_path = os.path.join(temp_dir, "narration.mp3")
-        
-        # 生成输出文件名
-        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-        output_files = []
-        
-        update_progress(10, "正在分析文本...")
-        
-        # 根据小说类型选择对应的音乐素材目录
-        bgm_category_path = os.path.join(app.config['BGM_FOLDER'], novel_type)
-        
-        # 获取分类目录下的所有音乐文件
-        bgm_files = []
-        if os.path.exists(bgm_category_path):
-            bgm_files = [f for f in os.listdir(bgm_category_path) 
-                      if f.lower().endswith(tuple(ALLOWED_AUDIO_EXTENSIONS))]
-        
-        # 检查是否有可用的背景音乐
-        if not bgm_files:
-            logger.warning(f"未找到'{novel_type}'类型的背景音乐，请先上传")
-            return jsonify({'error': f"未找到'{novel_type}'类型的背景音乐，请先上传"}), 400
-        
-        update_progress(15, "正在生成语音...")
-        
-        # 一次性生成语音和字幕
-        first_generator = VideoGenerator(os.path.join(os.getcwd(), app.config['VIDEO_LIBRARY_FOLDER']), "", subtitle_length=subtitle_length, font=font)  # 添加字体参数
-        
-        # 生成语音和字幕
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(first_generator.text_to_speech(text, voice, narration_path))
-        subtitle_timings = first_generator.subtitle_timings
-        
-        update_progress(30, "语音生成完成，正在处理字幕...")
-
-        # 为每个请求的视频生成不同的素材组合
-        total_videos = video_count
-        for i in range(video_count):
-            current_video = i + 1
-            progress_percent = 30 + (i / total_videos) * 60  # 从30%到90%的进度
-            update_progress(
-                int(progress_percent), 
-                f"正在生成视频 {current_video}/{total_videos}..."
-            )
-            
-            output_file = os.path.join(app.config['OUTPUT_FOLDER'], f"{timestamp}-{i+1}.mp4")
-            
-            # 随机选择一个背景音乐文件
-            random_bgm = random.choice(bgm_files)
-            bgm_path = os.path.join(bgm_category_path, random_bgm)
-            logger.info(f"选择的背景音乐: {bgm_path}")
-            
-            # 生成视频
-            generator = VideoGenerator(os.path.join(os.getcwd(), app.config['VIDEO_LIBRARY_FOLDER']), bgm_path, subtitle_length=subtitle_length, font=font)  # 添加字体参数
-            generator.subtitle_timings = subtitle_timings  # 使用已生成的字幕时间戳
-            
-            update_progress(
-                int(progress_percent + 10), 
-                f"视频 {current_video}/{total_videos}: 正在选择视频素材..."
-            )
-            
-            # 生成最终视频
-            random_video_paths = generator.get_random_videos(3)  # 随机选择3个视频
-            
-            update_progress(
-                int(progress_percent + 20), 
-                f"视频 {current_video}/{total_videos}: 正在合成视频..."
-            )
-            
-            loop.run_until_complete(generator.create_final_video_with_existing_audio(
-                random_video_paths, 
-                narration_path, 
-                output_file
-            ))
-            
-            output_files.append(os.path.basename(output_file))
-        
-        # 关闭事件循环
-        loop.close()
-        
-        update_progress(95, "正在清理临时文件...")
-        
-        # 清理临时文件
         try:
-            # 删除临时文件
-            if os.path.exists(narration_path):
-                os.remove(narration_path)
-            
-            # 删除临时目录中的所有文件
-            if os.path.exists(temp_dir):
-                for file in os.listdir(temp_dir):
-                    file_path = os.path.join(temp_dir, file)
-                    if os.path.isfile(file_path):
-                        os.remove(file_path)
-                # 删除临时目录
+            params = parse_generate_params(request.form)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        # 相同请求之前的成品仍在，或所有变体的渲染计划都已有成品时直接返回，不再合成语音和渲染；
+        # 这里只读取已有的索引和增益，素材探测和响度分析在生成任务中进行
+        keys = render_cache.recall(request_key(params))
+        if keys is None or not all(render_cache.peek(key) for key in keys):
+            media_index = stored_video_library_index()
+            keys = None
+            if media_index.valid_entries():
+                plan = build_generation_plan(params, media_index, analyze=False, touch=False)
+                keys = [variant_key(plan, i) for i in range(params['video_count'])]
+        if keys is not None and all(render_cache.peek(key) for key in keys):
+            results = [render_cache.get(key) for key in keys]
+            if all(results):
+                job = job_manager.record(params, generation_result(results, cached=len(results)))
+                return jsonify(dict(job.result, job_id=job.id, status_url=f'/jobs/{job.id}')), 200
+
+        job = job_manager.submit(run_generate_job, params)
+
+        return jsonify({
+            'message': '任务已提交',
+            'job_id': job.id,
+            'status_url': f'/jobs/{job.id}'
+        }), 202
+    except Exception as e:
+        logger.error(f"提交生成任务失败: {str(e)}")
+        return jsonify({'error': f'生成视频失败: {str(e)}'}), 500
+
+@app.route('/plan', methods=['POST'])
+def plan_generation():
+    """预览渲染计划（不合成语音、不解码任何素材）：参数与 /generate 相同，返回每个变体的完整时间线
+
+    配音缓存中已有该文本的语音时使用真实时长和字幕时间戳，否则按固定语速估算。
+    只使用已入库的素材索引和背景音乐增益：尚未索引的素材不参与选片，尚未分析的背景音乐按默认音量。
+    """
+    try:
+        try:
+            params = parse_generate_params(request.form)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        media_index = stored_video_library_index()
+        if not media_index.valid_entries() and library_sync_pending.is_set():
+            return jsonify({'error': '素材库索引正在同步，请稍后重试'}), 503
+        plan = build_generation_plan(params, media_index, analyze=False, touch=False)
+
+        generator = VideoGenerator(os.path.join(os.getcwd(), app.config['VIDEO_LIBRARY_FOLDER']), "",
+                                   subtitle_length=params['subtitle_length'], tts_cache=narration_cache,
+                                   tts_engine=create_tts_engine(app.config['TTS_ENGINE']))
+        cached_narration = narration_cache.lookup(generator.narration_cache_key(params['text'], params['voice']))
+        if cached_narration is not None:
+            audio_path, word_timings = cached_narration
+            narration = {'duration': mp3_duration(audio_path), 'estimated': False}
+        else:
+            word_timings = estimate_word_timings(params['text'].strip(), ESTIMATED_CHARS_PER_SECOND)
+            narration = {'duration': word_timings[-1]['end'] if word_timings else 0.0, 'estimated': True}
+        subtitle_timings = segment_word_timings(word_timings, params['subtitle_length'])
+
+        timelines = build_variant_timelines(plan, narration['duration'], subtitle_timings, media_index)
+        variants = []
+        for i, variant in enumerate(plan['variants']):
+            key = variant_key(plan, i)
+            variants.append(dict(variant, key=key, cached=render_cache.peek(key), timeline=timelines[i]))
+
+        return jsonify({
+            'seed': plan['seed'],
+            'version': plan['version'],
+            'params': plan['params'],
+            'assets': plan['assets'],
+            'narration': narration,
+            'variants': variants,
+        })
+    except Exception as e:
+        logger.error(f"生成渲染计划失败: {str(e)}")
+        return jsonify({'error': f'生成渲染计划失败: {str(e)}'}), 500
+
+def build_generation_plan(params, media_index, analyze=True, touch=True):
+    """按任务参数和种子确定每个变体的背景音乐和素材（相同参数、种子、素材库和使用记录得到相同的计划）
+
+    语音尚未合成，按文本长度估算时长，为每个变体选择刚好覆盖语音的素材。
+    analyze: 背景音乐没有有效的响度记录时是否补做分析（见 get_bgm_gain）
+    touch: 是否更新所用中间文件的最近使用时间，预览和缓存查询不渲染，传 False
+    """
+    generator = VideoGenerator(os.path.join(os.getcwd(), app.config['VIDEO_LIBRARY_FOLDER']), "", media_index=media_index)
+    duration = estimate_duration(params['text']) * SELECTION_MARGIN
+    return build_render_plan(
+        params['seed'],
+        dict(params,
+             tts_engine=app.config['TTS_ENGINE'],
+             stream_threshold=app.config['STREAM_THRESHOLD'],
+             stream_window=app.config['STREAM_WINDOW']),
+        params['video_count'],
+        params['bgm_category_path'],
+        params['bgm_files'],
+        select_clips=lambda rng: generator.select_videos(duration, rng=rng),
+        gain_for=lambda path: get_bgm_gain(path, analyze=analyze),
+        resolve_sources=lambda paths: resolve_clip_sources(paths, media_index, params['resolution'], touch=touch),
+        assets=[WATERMARK_PATH, DEFAULT_ENDBOARD_PATH]
+    )
+
+def resolve_clip_sources(clip_paths, media_index, video_size=None, touch=True):
+    """确定变体的输出尺寸和渲染实际读取的文件，返回 (尺寸, 文件路径列表)
+
+    video_size: 输出分辨率，不指定时取第一个素材（源文件）的尺寸，与中间文件是否已转码无关；
+    中间文件与输出尺寸一致时素材改用中间文件（缩放方式相同，只省去解码时的缩放和帧率转换）；
+    touch: 是否更新中间文件的最近使用时间（见 MezzanineCache.resolve）
+    """
+    size = video_size
+    if size is None:
+        first = media_index.get(clip_paths[0]) or {}
+        size = (first.get('width'), first.get('height'))
+    if tuple(size) != mezzanine_cache.size:
+        return list(size), list(clip_paths)
+    return list(size), [mezzanine_cache.resolve(path, media_index, touch=touch) for path in clip_paths]
+
+def build_variant_timelines(plan, narration_duration, subtitle_timings, media_index):
+    """按计划中记录的输出尺寸和实际读取的文件为每个变体生成时间线"""
+    watermark_path = os.path.join(os.getcwd(), WATERMARK_PATH)
+    endboard_path = os.path.join(os.getcwd(), DEFAULT_ENDBOARD_PATH)
+    timelines = []
+    for variant in plan['variants']:
+        size = variant['size']
+        clips = []
+        for clip, source_file in zip(variant['clips'], variant['sources']):
+            path = source_file['path']
+            source = media_index.get(clip['path']) or {}
+            # 中间文件的元数据在选片时登记；从工作目录恢复计划时索引中没有，时长与源文件相同
+            entry = media_index.get(path) or source
+            clips.append({'id': source.get('id', clip['path']), 'path': path, 'duration': entry.get('duration')})
+        timelines.append(build_timeline(
+            variant, clips, size, narration_duration, subtitle_timings,
+            watermark_path=watermark_path if os.path.exists(watermark_path) else None,
+            endboard_path=endboard_path if os.path.exists(endboard_path) else None
+        ))
+    return timelines
+
+def record_clip_usage(paths):
+    """累加素材的使用次数并更新最后使用时间，选片时优先使用次数少、近期未用的素材"""
+    counts = {}
+    for path in paths:
+        counts[os.path.abspath(path)] = counts.get(os.path.abspath(path), 0) + 1
+    now = datetime.utcnow()
+    for material in VideoMaterial.query.all():
+        count = counts.get(os.path.abspath(material.filepath))
+        if count:
+            material.use_count = (material.use_count or 0) + count
+            material.last_used = now
+    db.session.commit()
+
+def generation_result(results, cached=0):
+    """把各变体的 (成品路径, 字幕路径, 输出规格文件) 汇总为任务结果"""
+    output_files = []
+    subtitle_files = {}
+    rendition_files = {}
+    for output_file, subtitle_paths, renditions in results:
+        output_files.append(os.path.basename(output_file))
+        # 在视频旁导出的 SRT/ASS 字幕文件，供 /download 下载
+        subtitle_files[os.path.basename(output_file)] = [
+            os.path.basename(path) for path in subtitle_paths
+        ]
+        if renditions:
+            rendition_files[os.path.basename(output_file)] = {
+                name: os.path.basename(path) for name, path in renditions.items()
+            }
+    return {
+        'message': f'成功生成 {len(output_files)} 个视频',
+        'files': output_files,
+        'subtitle_files': subtitle_files,
+        'rendition_files': rendition_files,
+        'cached': cached
+    }
+
+def run_generate_job(job):
+    """在后台工作线程中执行生成任务"""
+    with app.app_context():
+        try:
+            return _generate_videos(job.id, **job.params)
+        except Exception as e:
+            logger.error(f"生成视频失败: {str(e)}")
+            update_progress(-1, f"处理失败: {str(e)}")
+            raise
+
+def _generate_videos(job_id, text, voice, video_count, novel_type, subtitle_length, font,
+                     render_engine, subtitle_mode, segments, bgm_category_path, bgm_files, seed=None,
+                     resolution=None, renditions=None):
+    """按渲染计划生成语音、字幕并渲染全部视频变体
+
+    各阶段（选片、语音和字幕、每个变体的渲染）完成后写入任务工作目录的清单，
+    任务失败后通过 /jobs/<job_id>/retry 重试时跳过已完成的阶段；
+    渲染计划与之前某次请求相同的变体直接复用渲染缓存中的成品。
+    """
+    update_progress(5, "正在初始化...")
+
+    # 每个任务独立的工作目录，失败时保留以便重试
+    workspace = JobWorkspace(app.config['JOB_WORKSPACE_FOLDER'], job_id)
+    job = current_job()
+    params = job.params if job is not None else {
+        'text': text, 'voice': voice, 'video_count': video_count, 'novel_type': novel_type,
+        'subtitle_length': subtitle_length, 'font': font, 'render_engine': render_engine,
+        'subtitle_mode': subtitle_mode, 'segments': segments, 'resolution': resolution,
+        'renditions': renditions, 'bgm_category_path': bgm_category_path, 'bgm_files': bgm_files,
+    }
+    if seed is None:
+        seed = derive_seed(params)
+    params = dict(params, seed=seed)
+    if workspace.params is None:
+        workspace.save_params(params)
+
+    narration_path = workspace.path("narration.mp3")
+
+    update_progress(10, "正在选择素材...")
+
+    # 加载视频素材索引，选片时无需再打开视频文件
+    media_index = load_video_library_index()
+
+    selection = workspace.stage('selection')
+    if selection is not None:
+        # 计划格式已变化，或选中的素材、中间文件、背景音乐已被删除时重新选片
+        plan = selection['plan']
+        chosen_files = [variant['bgm']['path'] for variant in plan['variants']]
+        if plan.get('version') == PLAN_VERSION:
+            chosen_files += [clip['path'] for variant in plan['variants']
+                             for clip in variant['clips'] + variant['sources']]
+        if plan.get('version') != PLAN_VERSION or not all(os.path.exists(path) for path in chosen_files):
+            logger.warning(f"任务 {job_id} 选中的素材已不存在，重新选片")
+            selection = None
+        else:
+            logger.info(f"已恢复任务 {job_id} 的渲染计划")
+    if selection is None:
+        plan = build_generation_plan(params, media_index)
+        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        selection = {
+            'plan': plan,
+            'output_paths': [
+                os.path.join(app.config['OUTPUT_FOLDER'], f"{timestamp}-{job_id[:6]}-{i+1}.mp4")
+                for i in range(video_count)
+            ],
+        }
+        workspace.complete('selection', selection)
+    plan = selection['plan']
+    keys = [variant_key(plan, i) for i in range(video_count)]
+
+    # 已渲染完成（成品和字幕文件都在）或渲染缓存中已有成品的变体直接复用
+    total_videos = video_count
+    results = [None] * total_videos
+    pending = []
+    cached = 0
+    for i in range(total_videos):
+        rendered = workspace.stage(f'render_{i}', files=[selection['output_paths'][i]])
+        if rendered is not None:
+            rendered_files = rendered['subtitle_paths'] + list(rendered.get('renditions', {}).values())
+            if all(os.path.exists(path) for path in rendered_files):
+                results[i] = (rendered['output_path'], rendered['subtitle_paths'], rendered.get('renditions', {}))
+                continue
+        hit = render_cache.get(keys[i])
+        if hit is not None:
+            results[i] = hit
+            cached += 1
+            workspace.complete(f'render_{i}', {'output_path': hit[0], 'subtitle_paths': hit[1],
+                                               'renditions': hit[2]})
+            continue
+        pending.append(i)
+    done = total_videos - len(pending)
+    if done:
+        logger.info(f"任务 {job_id} 已有 {done}/{total_videos} 个视频完成，继续渲染其余视频")
+
+    if pending:
+        narration = workspace.stage('narration', files=[narration_path])
+        if narration is not None:
+            subtitle_timings = narration['subtitle_timings']
+            update_progress(30, "已恢复语音和字幕，跳过语音生成...")
+        else:
+            update_progress(15, "正在生成语音...")
+
+            # 一次性生成语音和字幕
+            first_generator = VideoGenerator(os.path.join(os.getcwd(), app.config['VIDEO_LIBRARY_FOLDER']), "", subtitle_length=subtitle_length, font=font, tts_cache=narration_cache, tts_engine=create_tts_engine(app.config['TTS_ENGINE']))  # 添加字体参数
+
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(first_generator.text_to_speech(text, voice, narration_path))
+            finally:
+                # 关闭事件循环
+                loop.close()
+            subtitle_timings = first_generator.subtitle_timings
+            workspace.complete('narration', {'subtitle_timings': subtitle_timings})
+
+            update_progress(30, "语音生成完成，正在处理字幕...")
+
+        workers = min(app.config['VARIANT_WORKERS'], len(pending))
+        # 多个变体并行时平分编码线程预算
+        threads = max(1, app.config['ENCODE_THREADS'] // max(workers, 1))
+
+        # 由计划和实际语音时长生成时间线，渲染时按时间线组装画面和音轨
+        narration_duration = ffmpeg_parse_infos(narration_path)['duration']
+        timelines = build_variant_timelines(plan, narration_duration, subtitle_timings, media_index)
+
+        variants = {}
+        for i in pending:
+            planned = plan['variants'][i]
+            variants[i] = {
+                'video_library_path': os.path.join(os.getcwd(), app.config['VIDEO_LIBRARY_FOLDER']),
+                'bgm_path': planned['bgm']['path'],
+                'video_paths': [segment['path'] for segment in timelines[i]['segments']],
+                'timeline': timelines[i],
+                'narration_path': narration_path,
+                'output_path': selection['output_paths'][i],
+                'subtitle_timings': subtitle_timings,  # 使用已生成的字幕时间戳
+                'subtitle_length': subtitle_length,
+                'font': font,
+                'media_index': media_index,
+                'render_engine': render_engine,
+                'subtitle_mode': subtitle_mode,
+                'threads': threads,
+                'segments': segments,
+                'bgm_gain': planned['bgm_gain'],
+                'stream_threshold': app.config['STREAM_THRESHOLD'],
+                'stream_window': app.config['STREAM_WINDOW'],
+                'renditions': renditions,
+            }
+
+        def record(i, result):
+            results[i] = result
+            workspace.complete(f'render_{i}', {'output_path': result[0], 'subtitle_paths': list(result[1]),
+                                               'renditions': result[2]})
+            render_cache.put(keys[i], result[0], result[1], renditions=result[2])
+
+        update_progress(35, f"正在合成 {len(pending)} 个视频（并行 {workers} 个）...")
+
+        if workers > 1:
+            pool = get_variant_pool()
+            futures = {pool.submit(render_variant, variants[i]): i for i in pending}
+            # 等全部变体结束后再抛出失败，已完成的变体都会记入清单
+            error = None
+            for future in as_completed(futures):
                 try:
-                    os.rmdir(temp_dir)
+                    record(futures[future], future.result())
                 except Exception as e:
-                    logger.warning(f"删除临时目录失败: {str(e)}")
+                    logger.error(f"视频 {futures[future] + 1} 渲染失败: {str(e)}")
+                    error = error or e
+                    continue
+                done += 1
+                update_progress(
+                    int(35 + done / total_videos * 55),  # 从35%到90%的进度
+                    f"已完成 {done}/{total_videos} 个视频..."
+                )
+            if error is not None:
+                raise error
+        else:
+            for i in pending:
+                update_progress(
+                    int(35 + done / total_videos * 55),
+                    f"正在生成视频 {i + 1}/{total_videos}..."
+                )
+                record(i, render_variant(variants[i]))
+                done += 1
+
+    update_progress(95, "正在清理临时文件...")
+
+    # 记录本请求的成品，以及新渲染的变体用到的素材
+    render_cache.remember(request_key(params), keys)
+    if pending:
+        try:
+            record_clip_usage([clip['path'] for i in pending for clip in plan['variants'][i]['clips']])
         except Exception as e:
-            logger.warning(f"清理临时文件失败: {str(e)}")
-        
-        update_progress(100, "处理完成!")
-        
-        return jsonify({
-            'message': f'成功生成 {len(output_files)} 个视频',
-            'files': output_files
-        })
+            logger.warning(f"记录素材使用次数失败: {str(e)}")
+
+    # 全部完成后才删除工作目录；失败时保留中间产物供重试
+    workspace.cleanup()
+    try:
+        prune_workspaces(app.config['JOB_WORKSPACE_FOLDER'], app.config['JOB_WORKSPACE_MAX_AGE'])
     except Exception as e:
-        logger.error(f"生成视频失败: {str(e)}")
-        update_progress(-1, f"处理失败: {str(e)}")
-        return jsonify({'error': f'生成视频失败: {str(e)}'}), 500
+        logger.warning(f"清理过期任务工作目录失败: {str(e)}")
+
+    update_progress(100, "处理完成!")
+
+    return generation_result(results, cached=cached)
+
+@app.route('/render_cache/stats', methods=['GET'])
+def render_cache_stats():
+    """渲染缓存的条目数、占用空间和命中率"""
+    return jsonify(render_cache.stats())
 
 def select_bgm_by_type(novel_type):
     """根据小说类型选择合适的背景音乐"""
@@ -412,7 +1013,7 @@ def select_bgm_by_type(novel_type):
 
 @app.route('/download/<filename>')
 def download_file(filename):
-    """下载生成的视频"""
+    """下载生成的视频及其 SRT/ASS 字幕文件"""
     try:
         file_path = os.path.join(app.config['OUTPUT_FOLDER'], filename)
         if os.path.exists(file_path):
@@ -439,6 +1040,8 @@ def delete_material(material_id):
         # 删除文件
         if os.path.exists(material.filepath):
             os.remove(material.filepath)
+        if material_type == 'video':
+            mezzanine_cache.discard(material.filepath)
         
         # 删除数据库记录
         db.session.delete(material)
@@ -471,7 +1074,18 @@ def upload_music():
             category_path = os.path.join(app.config['BGM_FOLDER'], category)
             os.makedirs(category_path, exist_ok=True)
             
-            music_file.save(os.path.join(category_path, filename))
+            music_path = os.path.join(category_path, filename)
+            music_file.save(music_path)
+
+            # 预先解码并分析响度，渲染时直接读取 PCM 缓存和增益
+            try:
+                bgm_pcm_cache.warm(music_path)
+            except Exception as e:
+                logger.warning(f"背景音乐预解码失败 {music_path}: {str(e)}")
+            try:
+                analyze_music_file(music_path, music_file.filename)
+            except Exception as e:
+                logger.warning(f"背景音乐响度分析失败 {music_path}: {str(e)}")
             return jsonify({'message': '音乐上传成功'})
         else:
             return jsonify({'error': '不支持的文件类型'}), 400
@@ -489,6 +1103,9 @@ def delete_music(category, filename):
         file_path = os.path.join(app.config['BGM_FOLDER'], category, filename)
         if os.path.exists(file_path):
             os.remove(file_path)
+            bgm_pcm_cache.discard(file_path)
+            MusicMaterial.query.filter_by(filepath=file_path).delete()
+            db.session.commit()
             return jsonify({'message': '音乐删除成功'})
         else:
             return jsonify({'error': '文件不存在'}), 404
@@ -500,6 +1117,9 @@ if __name__ == '__main__':
     try:
         with app.app_context():
             db.create_all()
+            ensure_columns()
+        # 启动时在后台同步素材库索引，预览接口只读取已入库的素材
+        schedule_library_sync()
         app.run(host='0.0.0.0', port=5001, debug=True)
     except Exception as e:
         logger.error(f'启动应用时出错: {str(e)}')
@@ -0,0 +1,174 @@
+import os
+import wave
+import logging
+import tempfile
+import subprocess
+
+import numpy as np
+from moviepy.config import get_setting
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+
+
+def decode_pcm(path, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+    """用 ffmpeg 一次性把音频解码为 float32 PCM，返回形状为 (采样数, 声道数) 的数组"""
+    result = subprocess.run(
+        [get_setting("FFMPEG_BINARY"), '-v', 'error', '-i', path,
+         '-vn', '-f', 'f32le', '-acodec', 'pcm_f32le',
+         '-ar', str(sample_rate), '-ac', str(channels), '-'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    if result.returncode != 0:
+        raise Exception(f"音频解码失败 {path}: {result.stderr.decode('utf-8', errors='ignore')[-1000:]}")
+    return np.frombuffer(result.stdout, dtype=np.float32).reshape(-1, channels)
+
+
+def loop_to_length(pcm, nsamples, offset=0):
+    """按取模下标循环音频到指定采样数（代替多段音频拼接），offset 为起始采样位置"""
+    if len(pcm) == 0:
+        return np.zeros((nsamples, pcm.shape[1]), dtype=np.float32)
+    if offset + nsamples <= len(pcm):
+        return pcm[offset:offset + nsamples]
+    return pcm.take(np.arange(offset, offset + nsamples) % len(pcm), axis=0)
+
+
+def duck_envelope(voice, sample_rate=SAMPLE_RATE, depth=0.5, threshold=0.02, window=0.05):
+    """根据人声的短时 RMS 生成背景音乐的增益包络（侧链压缩）
+
+    depth: 人声出现时背景音乐最多衰减的比例；threshold: 视为有人声的 RMS 电平。
+    """
+    hop = max(1, int(sample_rate * window))
+    nwindows = -(-len(voice) // hop)
+    mono = voice.mean(axis=1)
+    padded = np.zeros(nwindows * hop, dtype=np.float32)
+    padded[:len(mono)] = mono
+    rms = np.sqrt(np.mean(padded.reshape(nwindows, hop) ** 2, axis=1))
+    gains = 1.0 - depth * np.clip(rms / threshold, 0.0, 1.0)
+    # 在窗口中心之间线性插值，避免增益阶跃产生爆音
+    centers = (np.arange(nwindows) + 0.5) * hop
+    return np.interp(np.arange(len(voice)), centers, gains).astype(np.float32)
+
+
+def mix_narration(narration, bgm, bgm_gain=0.3, duck_depth=0.0, sample_rate=SAMPLE_RATE, offset=0):
+    """把背景音乐循环到语音时长并按增益混入，返回混音后的 PCM
+
+    offset: narration 在整条音轨中的起始采样位置，分块混音时保证背景音乐连续
+    """
+    looped = loop_to_length(bgm, len(narration), offset)
+    if duck_depth > 0:
+        gain = bgm_gain * duck_envelope(narration, sample_rate, depth=duck_depth)[:, None]
+    else:
+        gain = np.float32(bgm_gain)
+    mixed = narration + looped * gain
+    np.clip(mixed, -1.0, 1.0, out=mixed)
+    return mixed
+
+
+def write_wav(pcm, path, sample_rate=SAMPLE_RATE):
+    """把 float32 PCM 写成 16 位 WAV 文件"""
+    samples = (pcm * 32767.0).astype('<i2')
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(pcm.shape[1])
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(samples.tobytes())
+    return path
+
+
+class MixedTrack:
+    """混音后的临时 WAV 文件，close() 时删除，可与剪辑一起放入待关闭的资源列表"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def close(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def iter_pcm_blocks(path, block_samples, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+    """流式解码音频，按固定采样数逐块产出 float32 PCM（最后一块可能更短）
+
+    解码到结尾后 ffmpeg 返回非零退出码时抛出异常，不把损坏或无法读取的文件当作静音。
+    """
+    # 错误输出写入临时文件，读取 stdout 时不会因 stderr 管道写满而阻塞
+    stderr = tempfile.TemporaryFile()
+    process = subprocess.Popen(
+        [get_setting("FFMPEG_BINARY"), '-v', 'error', '-i', path,
+         '-vn', '-f', 'f32le', '-acodec', 'pcm_f32le',
+         '-ar', str(sample_rate), '-ac', str(channels), '-'],
+        stdout=subprocess.PIPE, stderr=stderr
+    )
+    block_bytes = block_samples * channels * 4
+    try:
+        while True:
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+            yield np.frombuffer(data, dtype=np.float32).reshape(-1, channels)
+        if process.wait() != 0:
+            stderr.seek(0)
+            raise Exception(f"音频解码失败 {path}: {stderr.read().decode('utf-8', errors='ignore')[-1000:]}")
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            # 调用方提前停止读取
+            process.kill()
+        process.wait()
+        stderr.close()
+
+
+def mix_to_wav(narration_path, bgm_path, duration, workdir=None, bgm_gain=0.3, duck_depth=0.0,
+               sample_rate=SAMPLE_RATE, pcm_cache=None, block_seconds=60, bgm_offset=0.0):
+    """解码语音和背景音乐，混音后写入临时 WAV，返回 MixedTrack
+
+    语音按 block_seconds 分块流式解码、混音并追加写入，内存占用与语音时长无关。
+    pcm_cache: 背景音乐解码缓存（PCMCache），提供时直接内存映射已解码的 PCM
+    bgm_offset: 背景音乐从第几秒开始播放
+    """
+    if pcm_cache is not None:
+        bgm = pcm_cache.load(bgm_path)
+    else:
+        bgm = decode_pcm(bgm_path, sample_rate)
+
+    nsamples = int(round(duration * sample_rate))
+    block_samples = int(block_seconds * sample_rate)
+    offset_samples = int(round(bgm_offset * sample_rate))
+
+    fd, path = tempfile.mkstemp(prefix='mix_', suffix='.wav', dir=workdir)
+    os.close(fd)
+    try:
+        with wave.open(path, 'wb') as f:
+            f.setnchannels(CHANNELS)
+            f.setsampwidth(2)
+            f.setframerate(sample_rate)
+
+            def write_block(narration, position):
+                mixed = mix_narration(narration, bgm, bgm_gain, duck_depth, sample_rate,
+                                      offset=offset_samples + position)
+                f.writeframes((mixed * 32767.0).astype('<i2').tobytes())
+
+            # 语音按给定时长截取，不足部分补静音
+            position = 0
+            for block in iter_pcm_blocks(narration_path, block_samples, sample_rate):
+                block = block[:nsamples - position]
+                if len(block):
+                    write_block(block, position)
+                    position += len(block)
+                if position >= nsamples:
+                    break
+            while position < nsamples:
+                silence = np.zeros((min(block_samples, nsamples - position), CHANNELS), dtype=np.float32)
+                write_block(silence, position)
+                position += len(silence)
+    except Exception:
+        os.remove(path)
+        raise
+
+    logger.info(f"混音完成: {path}，时长 {nsamples / sample_rate:.2f}秒")
+    return MixedTrack(path)
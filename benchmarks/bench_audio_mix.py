@@ -0,0 +1,65 @@
+"""音频阶段耗时基准：moviepy 音频剪辑链与 NumPy 混音对比（默认 30 分钟语音）
+
+用法: python benchmarks/bench_audio_mix.py 背景音乐文件 [语音分钟数]
+语音用合成的噪声代替，两种方式都输出 AAC 音轨。
+"""
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from moviepy.editor import AudioFileClip, CompositeAudioClip, concatenate_audioclips
+from audio_mixer import mix_to_wav, write_wav, SAMPLE_RATE
+from ffmpeg_backend import run_ffmpeg, ffmpeg_binary, AUDIO_ENCODE_ARGS
+
+
+def legacy_mix(narration_path, bgm_path, output_path):
+    """原 moviepy 路径（CompositeAudioClip）的音频处理链"""
+    narration = AudioFileClip(narration_path)
+    bgm = AudioFileClip(bgm_path).volumex(0.3)
+    if bgm.duration < narration.duration:
+        repeat_times = int(narration.duration / bgm.duration) + 1
+        bgm = concatenate_audioclips([bgm] * repeat_times)
+    bgm = bgm.subclip(0, narration.duration)
+    CompositeAudioClip([narration, bgm]).write_audiofile(output_path, fps=SAMPLE_RATE, codec='aac', logger=None)
+    narration.close()
+
+
+def numpy_mix(narration_path, bgm_path, output_path, workdir):
+    duration = AudioFileClip(narration_path).duration
+    start = time.perf_counter()
+    track = mix_to_wav(narration_path, bgm_path, duration, workdir=workdir)
+    mixed = time.perf_counter() - start
+    # 渲染时混音结果作为音频文件直接交给 ffmpeg 编码
+    run_ffmpeg([ffmpeg_binary(), '-y', '-loglevel', 'error', '-i', track.path] + AUDIO_ENCODE_ARGS + [output_path])
+    track.close()
+    return mixed
+
+
+def main():
+    bgm_path = sys.argv[1]
+    minutes = float(sys.argv[2]) if len(sys.argv) > 2 else 30
+
+    with tempfile.TemporaryDirectory() as workdir:
+        rng = np.random.default_rng(0)
+        narration = (rng.standard_normal((int(minutes * 60 * SAMPLE_RATE), 2)) * 0.1).astype(np.float32)
+        narration_path = write_wav(narration, os.path.join(workdir, 'narration.wav'))
+        del narration
+
+        start = time.perf_counter()
+        legacy_mix(narration_path, bgm_path, os.path.join(workdir, 'legacy.m4a'))
+        legacy = time.perf_counter() - start
+        print(f"moviepy 剪辑链: {legacy:.2f}s")
+
+        start = time.perf_counter()
+        mixed = numpy_mix(narration_path, bgm_path, os.path.join(workdir, 'numpy.m4a'), workdir)
+        total = time.perf_counter() - start
+        print(f"NumPy 混音: {total:.2f}s（其中解码+混音+写 WAV {mixed:.2f}s），加速 {legacy / total:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""分块并发语音合成基准：用本地假引擎模拟网络延迟，对比串行与并发合成的耗时，并校验时间戳拼接
+
+用法: python benchmarks/bench_chunked_tts.py [文本字数]
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import video_merger
+from video_merger import VideoGenerator
+from tts_engine import StubTTSEngine, mp3_duration
+
+CHARS = '天地玄黄宇宙洪荒日月盈昃辰宿列张寒来暑往秋收冬藏闰余成岁律吕调阳云腾致雨露结为霜'
+# 假引擎：每次请求 0.3 秒固定延迟，外加每字 0.2 毫秒
+LATENCY = 0.3
+LATENCY_PER_CHAR = 0.0002
+
+
+def make_text(total_chars, rng):
+    sentences = []
+    count = 0
+    while count < total_chars:
+        sentence = ''.join(rng.choice(CHARS) for _ in range(rng.randint(8, 40))) + rng.choice('。！？')
+        sentences.append(sentence)
+        count += len(sentence)
+    return ''.join(sentences)
+
+
+def run(text, concurrency, workdir):
+    video_merger.TTS_CONCURRENCY = concurrency
+    engine = StubTTSEngine(chars_per_second=50, latency=LATENCY, latency_per_char=LATENCY_PER_CHAR)
+    generator = VideoGenerator(workdir, '', tts_engine=engine)
+    output_path = os.path.join(workdir, f'narration_{concurrency}.mp3')
+    start = time.perf_counter()
+    word_timings = asyncio.run(generator.synthesize_speech(text, 'stub', '+0%', output_path))
+    return time.perf_counter() - start, word_timings, output_path
+
+
+def main():
+    total_chars = int(sys.argv[1]) if len(sys.argv) > 1 else 30000
+    text = make_text(total_chars, random.Random(0))
+    chunks = VideoGenerator('', '').split_text_into_chunks(text)
+    print(f"文本 {len(text)} 字，切分为 {len(chunks)} 块")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for concurrency in (1, 4, 8):
+            elapsed, word_timings, output_path = run(text, concurrency, workdir)
+            duration = mp3_duration(output_path)
+            # 时间戳必须单调，且最后一个字落在音频末尾附近
+            starts = [timing["start"] for timing in word_timings]
+            assert starts == sorted(starts), "时间戳不单调"
+            assert abs(word_timings[-1]["end"] - duration) < 0.1, "时间戳与音频时长不一致"
+            print(f"并发 {concurrency}: {elapsed:.2f}s，{len(word_timings)} 个词，"
+                  f"音频 {duration:.2f}s，末字结束于 {word_timings[-1]['end']:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""合成器微基准：每帧叠加水印和字幕的开销，CompositeVideoClip 与原地整数合成器对比
+
+用法: python benchmarks/bench_compositor.py [帧数]
+分别在 720p 和 1080p 下，用随机底图、uploads/watermarks 中的水印和一条字幕测量每帧耗时，
+并输出两种方式合成结果的最大像素差。
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from moviepy.editor import CompositeVideoClip, ImageClip
+from compositor import Compositor, WatermarkCache
+from subtitles import SubtitleTrackClip
+from video_merger import WATERMARK_PATH
+
+SIZES = [('720p', (720, 1280)), ('1080p', (1080, 1920))]
+SUBTITLE_TIMINGS = [{'text': '这是一条用于测试合成开销的字幕', 'start': 0.0, 'end': 3600.0}]
+
+
+def composite_video_clip(base_frame, size, duration):
+    """原实现：底图、全画面水印和字幕轨道交给 CompositeVideoClip"""
+    base = ImageClip(base_frame).set_duration(duration)
+    watermark = ImageClip(WATERMARK_PATH).set_duration(duration).resize(size).set_position(('center', 'center'))
+    subtitles = SubtitleTrackClip(SUBTITLE_TIMINGS, size, duration)
+    clip = CompositeVideoClip([base, watermark, subtitles])
+    return lambda frame, t: clip.get_frame(t).astype(np.uint8)
+
+
+def in_place_compositor(base_frame, size, duration):
+    subtitles = SubtitleTrackClip(SUBTITLE_TIMINGS, size, duration)
+    compositor = Compositor(size, watermark=WatermarkCache().load(WATERMARK_PATH, size), subtitles=subtitles)
+
+    def run(frame, t):
+        np.copyto(frame, base_frame)
+        return compositor.composite(frame, t)
+    return run
+
+
+def measure(make, base_frame, size, frames):
+    run = make(base_frame, size, frames)
+    frame = np.empty_like(base_frame)
+    result = run(frame, 0.0)  # 预热：字幕贴图和水印只在首次使用时生成
+    start = time.perf_counter()
+    for i in range(frames):
+        result = run(frame, float(i))
+    return (time.perf_counter() - start) / frames * 1000, result.copy()
+
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    rng = np.random.default_rng(0)
+    for name, size in SIZES:
+        base_frame = rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+        old_ms, old = measure(composite_video_clip, base_frame, size, frames)
+        new_ms, new = measure(in_place_compositor, base_frame, size, frames)
+        diff = int(np.abs(old.astype(np.int16) - new).max())
+        print(f"{name:>6}: CompositeVideoClip {old_ms:7.2f} ms/帧，原地合成 {new_ms:6.2f} ms/帧"
+              f"（{old_ms / new_ms:5.1f}x），最大像素差 {diff}")
+
+
+if __name__ == '__main__':
+    main()
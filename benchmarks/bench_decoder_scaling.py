@@ -0,0 +1,56 @@
+"""解码端缩放基准：逐帧读取素材并缩放到目标尺寸，对比 VideoFileClip + resize 与 ffmpeg 解码时缩放
+
+用法: python benchmarks/bench_decoder_scaling.py [宽x高] [秒数] [素材路径]
+默认把 video_library 中的第一个素材缩放到 720x1280，按 25fps 读取 10 秒。
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from moviepy.editor import VideoFileClip
+from video_reader import ScaledVideoClip
+
+VIDEO_LIBRARY = 'video_library'
+FPS = 25
+
+
+def first_video(folder):
+    for root, _, files in os.walk(folder):
+        for f in sorted(files):
+            if f.lower().endswith(('.mp4', '.mov')):
+                return os.path.join(root, f)
+
+
+def read_frames(clip, duration):
+    start = time.perf_counter()
+    last = None
+    for t in np.arange(0, min(duration, clip.duration), 1.0 / FPS):
+        last = clip.get_frame(t)
+    return time.perf_counter() - start, last
+
+
+def main():
+    args = sys.argv[1:]
+    size = tuple(int(v) for v in args[0].split('x')) if args else (720, 1280)
+    duration = float(args[1]) if len(args) > 1 else 10.0
+    path = args[2] if len(args) > 2 else first_video(VIDEO_LIBRARY)
+
+    source = VideoFileClip(path, audio=False)
+    print(f"素材: {path}，{source.size[0]}x{source.size[1]} {source.fps}fps -> {size[0]}x{size[1]} {FPS}fps")
+    resized = source.resize(width=size[0], height=size[1]) if tuple(source.size) != size else source
+    elapsed, frame = read_frames(resized, duration)
+    print(f"VideoFileClip + resize: {elapsed:6.2f}s，画面 {frame.shape[1]}x{frame.shape[0]}")
+    source.close()
+
+    scaled = ScaledVideoClip(path, size=size, fps=FPS)
+    elapsed, frame = read_frames(scaled, duration)
+    print(f"解码时缩放:             {elapsed:6.2f}s，画面 {frame.shape[1]}x{frame.shape[0]}")
+    scaled.close()
+
+
+if __name__ == '__main__':
+    main()
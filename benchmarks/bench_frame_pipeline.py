@@ -0,0 +1,97 @@
+"""帧流水线基准：同一段画面分别用 moviepy 的 write_videofile（逐帧串行）和三级帧流水线编码
+
+用法: python benchmarks/bench_frame_pipeline.py [秒数] [素材路径 ...]
+默认取 video_library 中的前 3 个素材渲染 20 秒，带水印和字幕，输出耗时、各阶段队列等待时间
+以及两种方式输出画面的最大像素差。
+"""
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from moviepy.editor import VideoFileClip, CompositeVideoClip, ImageClip
+from video_merger import VideoGenerator, VIDEO_WRITE_OPTIONS, WATERMARK_PATH
+
+VIDEO_LIBRARY = 'video_library'
+
+
+def find_videos(folder):
+    paths = []
+    for root, _, files in os.walk(folder):
+        paths.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(('.mp4', '.mov')))
+    return paths
+
+
+def make_generator(duration):
+    generator = VideoGenerator(VIDEO_LIBRARY, '')
+    generator.subtitle_timings = [
+        {'text': f'第 {i + 1} 条测试字幕', 'start': i * 2.0, 'end': i * 2.0 + 1.8}
+        for i in range(int(duration // 2))
+    ]
+    return generator
+
+
+def render_serial(generator, segments, size, duration, path):
+    """原实现：底层画面、全画面水印和字幕轨道交给 CompositeVideoClip，由 write_videofile 逐帧串行编码"""
+    base, resources = generator.compose_base(segments, size, 0, duration)
+    watermark = ImageClip(WATERMARK_PATH).set_duration(duration).resize(size).set_position(('center', 'center'))
+    window = CompositeVideoClip([base, watermark, generator.create_subtitle_layer(size, duration)])
+    try:
+        window.write_videofile(path, audio=False, threads=generator.threads, logger=None, **VIDEO_WRITE_OPTIONS)
+    finally:
+        window.close()
+        for clip in resources:
+            clip.close()
+
+
+def render_pipelined(generator, segments, size, duration, path):
+    return generator.write_window(segments, size, 0, duration, path)
+
+
+def max_frame_diff(path_a, path_b):
+    a, b = VideoFileClip(path_a, audio=False), VideoFileClip(path_b, audio=False)
+    try:
+        diff = 0
+        for frame_a, frame_b in zip(a.iter_frames(), b.iter_frames()):
+            diff = max(diff, int(np.abs(frame_a.astype(np.int16) - frame_b).max()))
+        return diff
+    finally:
+        a.close()
+        b.close()
+
+
+def main():
+    args = sys.argv[1:]
+    duration = float(args[0]) if args else 20.0
+    video_paths = args[1:] or find_videos(VIDEO_LIBRARY)[:3]
+
+    generator = make_generator(duration)
+    size, segments = generator.plan_timeline(video_paths, duration)
+    print(f"素材: {len(video_paths)} 个，尺寸 {size}，时长 {duration} 秒")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        serial_path = os.path.join(workdir, 'serial.mp4')
+        pipelined_path = os.path.join(workdir, 'pipelined.mp4')
+
+        start = time.perf_counter()
+        render_serial(generator, segments, size, duration, serial_path)
+        serial = time.perf_counter() - start
+        print(f"逐帧串行: {serial:.2f}s")
+
+        start = time.perf_counter()
+        stats = render_pipelined(generator, segments, size, duration, pipelined_path)
+        pipelined = time.perf_counter() - start
+        print(f"三级流水线: {pipelined:.2f}s（加速 {serial / pipelined:.2f}x）")
+        for name, stage in stats.items():
+            print(f"  {name:>9}: 处理 {stage['busy']:.2f}s，等待输入 {stage['wait_in']:.2f}s，"
+                  f"等待输出 {stage['wait_out']:.2f}s")
+
+        print(f"画面最大像素差: {max_frame_diff(serial_path, pipelined_path)}")
+
+
+if __name__ == '__main__':
+    main()
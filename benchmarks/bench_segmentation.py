@@ -0,0 +1,167 @@
+"""字幕分段基准：合成 1 万 / 10 万 / 100 万字的 WordBoundary 序列，对比原分段逻辑与线性实现
+
+用法: python benchmarks/bench_segmentation.py [字幕长度]
+先在随机序列上校验两种实现输出完全一致，再按规模分别计时；
+最后一项是连续的纯标点词（段落一直不断句），原实现在这种输入上是平方复杂度。
+"""
+import os
+import re
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from segmentation import segment_word_timings
+
+SIZES = (10_000, 100_000, 1_000_000)
+CHARS = '的一是不了人我在有他这中大来上个国到说们为子和你地出道也时年得就那要下以生会自着去之过家学对可里后小么心多天而能好都然没日于起还发成事只作当想看文无开手十用主行方又如前所本见经头面公同三已老从动两长知民样现分将外但身些与高意进把法此实回二理美点月明其种声全工己话儿者向情部正名定女问力机给等几很业最间新什打便位因重被走电四第门相次东政海口使教西再平真听世气信北少关并内加化由却代军产入先山五太水万市眼体别处总才场师书比住员九笑性通目华报立马命张活难神数件安表原车白应路期叫死常提感金何更反合放做系计或司利受光王果亲界及今京务制解各任至清物台象记边共风战干接它许八特觉望直服毛林题建南度统色字请交爱让认算论百吃义科怎元社术结六功指思非流每青管夫连远资队跟带花快条院变联言权往展该领传近留红治决周保达办运武半候七必城父强步完革深区即求品士转量空甚众技轻程告江语英基派满式李息写呢识极令黄德收脸钱党倒未持取设始版双历越史商千片容研像找友孩站广改议形委早房音火际则首单据导影失拿网香似斯专石若兵弟谁校读志飞观争究包组造落视济喜离虽坏兴切支居'
+PUNCTUATION = '，。！？、："'
+
+
+def legacy_segment(word_timings, subtitle_length):
+    """原 text_to_speech 中的分段逻辑（对照用）"""
+    processed_timing_data = []
+    current_segment = ""
+    segment_start = None
+    buffer = ""
+    buffer_start = None
+
+    min_segment_length = max(subtitle_length // 3, 4)
+
+    for i, word in enumerate(word_timings):
+        if buffer:
+            buffer += word["text"]
+            if len(re.sub(r'[，。！？、："""]', '', buffer)) >= min_segment_length:
+                current_segment = buffer
+                segment_start = buffer_start
+                buffer = ""
+                buffer_start = None
+        else:
+            current_segment += word["text"]
+            if segment_start is None:
+                segment_start = word["start"]
+
+        is_end_punctuation = any(p in word["text"] for p in "。！？")
+        is_last_word = i == len(word_timings) - 1
+        current_length = len(re.sub(r'[，。！？、："""]', '', current_segment))
+
+        if (current_length >= subtitle_length or
+            (is_end_punctuation and current_length >= min_segment_length) or
+            is_last_word):
+
+            clean_segment = re.sub(r'[，。！？、："""]', '', current_segment)
+
+            if len(clean_segment) > subtitle_length:
+                for j in range(0, len(clean_segment), subtitle_length):
+                    sub_segment = clean_segment[j:j+subtitle_length]
+                    if len(sub_segment) < min_segment_length and j + subtitle_length < len(clean_segment):
+                        continue
+
+                    sub_length = len(sub_segment)
+                    total_length = len(clean_segment)
+                    total_duration = word["end"] - segment_start
+                    sub_duration = (total_duration * sub_length) / total_length
+
+                    sub_start = segment_start + (j / len(clean_segment)) * total_duration
+                    sub_end = sub_start + sub_duration
+
+                    processed_timing_data.append({
+                        "text": sub_segment,
+                        "start": sub_start,
+                        "end": sub_end - 0.1
+                    })
+            else:
+                if len(clean_segment) < min_segment_length and not is_last_word:
+                    buffer = current_segment
+                    buffer_start = segment_start
+                else:
+                    processed_timing_data.append({
+                        "text": clean_segment,
+                        "start": segment_start,
+                        "end": word["end"] - 0.1
+                    })
+
+            if not buffer:
+                current_segment = ""
+                segment_start = None
+
+    if buffer:
+        clean_buffer = re.sub(r'[，。！？、："""]', '', buffer)
+        if clean_buffer:
+            processed_timing_data.append({
+                "text": clean_buffer,
+                "start": buffer_start,
+                "end": word_timings[-1]["end"] - 0.1
+            })
+
+    return processed_timing_data
+
+
+def make_word_timings(total_chars, rng, punctuation_rate=0.15, odd_tokens=False):
+    """生成总字数约为 total_chars 的逐词时间戳（edge-tts WordBoundary 格式）"""
+    timings = []
+    t = 0.0
+    chars = 0
+    while chars < total_chars:
+        if odd_tokens and rng.random() < 0.05:
+            # 只有标点或为空的词，用于覆盖边界情况
+            text = rng.choice(['', '，', '。', '！？', '""', '、：'])
+        else:
+            text = ''.join(rng.choice(CHARS) for _ in range(rng.randint(1, 4)))
+            if rng.random() < punctuation_rate:
+                text += rng.choice(PUNCTUATION)
+        duration = 0.05 + 0.2 * len(text)
+        timings.append({"text": text, "start": t, "end": t + duration})
+        t += duration + rng.random() * 0.1
+        chars += len(text)
+    return timings
+
+
+def check_equivalence(rounds=300):
+    """随机序列（含各种字幕长度和异常词）上校验两种实现输出一致"""
+    rng = random.Random(0)
+    for _ in range(rounds):
+        timings = make_word_timings(rng.randint(1, 400), rng,
+                                    punctuation_rate=rng.random(), odd_tokens=True)
+        subtitle_length = rng.randint(1, 20)
+        if legacy_segment(timings, subtitle_length) != segment_word_timings(timings, subtitle_length):
+            raise AssertionError(f"输出不一致: subtitle_length={subtitle_length}")
+    print(f"一致性校验通过（{rounds} 组随机序列）")
+
+
+def main():
+    subtitle_length = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    check_equivalence()
+
+    rng = random.Random(1)
+    for size in SIZES:
+        timings = make_word_timings(size, rng)
+
+        start = time.perf_counter()
+        fast = segment_word_timings(timings, subtitle_length)
+        fast_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        legacy = legacy_segment(timings, subtitle_length)
+        legacy_elapsed = time.perf_counter() - start
+
+        assert legacy == fast
+        print(f"{size:>9} 字 / {len(timings):>7} 词: 原实现 {legacy_elapsed:.3f}s, "
+              f"线性实现 {fast_elapsed:.3f}s, {len(fast)} 条字幕")
+
+    count = 10_000
+    timings = [{"text": "，", "start": i * 0.1, "end": i * 0.1 + 0.05} for i in range(count)]
+    timings.append({"text": "好", "start": count * 0.1, "end": count * 0.1 + 0.1})
+    start = time.perf_counter()
+    fast = segment_word_timings(timings, subtitle_length)
+    fast_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    legacy = legacy_segment(timings, subtitle_length)
+    legacy_elapsed = time.perf_counter() - start
+    assert legacy == fast
+    print(f"{count:>9} 个连续标点词: 原实现 {legacy_elapsed:.3f}s, 线性实现 {fast_elapsed:.3f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""流式渲染内存基准：生成指定时长的静音语音，在独立子进程中测量峰值内存（RSS）
+
+用法: python benchmarks/bench_streaming_render.py [--render] [分钟 ...]
+默认测量 5 / 30 / 120 分钟语音的混音：整段解码（原实现）与分块流式混音的峰值内存对比。
+加 --render 时再用 video_library 中的素材做窗口流式渲染（耗时与视频时长成正比，适合用较短的时长）。
+"""
+import os
+import sys
+import time
+import resource
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from moviepy.config import get_setting
+from audio_mixer import decode_pcm, mix_narration, write_wav, mix_to_wav
+
+BGM_DIR = os.path.join('uploads', 'bgm')
+VIDEO_LIBRARY = 'video_library'
+
+
+def make_narration(minutes, path):
+    """生成与 edge-tts 相同格式（24kHz 单声道 48kbps）的静音语音"""
+    os.system(f'"{get_setting("FFMPEG_BINARY")}" -y -loglevel error -f lavfi -i anullsrc=r=24000:cl=mono '
+              f'-t {minutes * 60} -c:a libmp3lame -b:a 48k "{path}"')
+
+
+def find_files(folder, extensions):
+    paths = []
+    for root, _, files in os.walk(folder):
+        paths.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(extensions))
+    return paths
+
+
+def peak_rss_mb():
+    # Linux 下 ru_maxrss 单位为 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def mix_whole(narration_path, bgm_path, duration, workdir):
+    """原实现：整段解码语音后一次混音"""
+    narration = decode_pcm(narration_path)
+    mixed = mix_narration(narration, decode_pcm(bgm_path))
+    write_wav(mixed, os.path.join(workdir, 'whole.wav'))
+
+
+def mix_streaming(narration_path, bgm_path, duration, workdir):
+    mix_to_wav(narration_path, bgm_path, duration, workdir=workdir).close()
+
+
+def render_streaming(narration_path, bgm_path, duration, workdir):
+    from video_merger import VideoGenerator
+    video_paths = find_files(VIDEO_LIBRARY, ('.mp4', '.mov'))[:3]
+    generator = VideoGenerator(VIDEO_LIBRARY, bgm_path, stream_window=10)
+    generator.render_streaming(video_paths, narration_path, os.path.join(workdir, 'streamed.mp4'))
+
+
+def measure(target, narration_path, bgm_path, duration, workdir, queue):
+    start = time.perf_counter()
+    target(narration_path, bgm_path, duration, workdir)
+    queue.put((time.perf_counter() - start, peak_rss_mb()))
+
+
+def run_isolated(target, *args):
+    """在新进程中运行，保证各次测量的峰值内存互不影响"""
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=measure, args=(target, *args, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    args = sys.argv[1:]
+    render = '--render' in args
+    minutes_list = [float(arg) for arg in args if arg != '--render'] or [5, 30, 120]
+    bgm_path = find_files(BGM_DIR, ('.mp3', '.wav'))[0]
+
+    targets = [('整段混音', mix_whole), ('流式混音', mix_streaming)]
+    if render:
+        targets.append(('流式渲染', render_streaming))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for minutes in minutes_list:
+            narration_path = os.path.join(workdir, f'narration_{minutes}.mp3')
+            make_narration(minutes, narration_path)
+            for name, target in targets:
+                elapsed, rss = run_isolated(target, narration_path, bgm_path, minutes * 60, workdir)
+                print(f"{minutes:>6} 分钟 {name}: {elapsed:7.2f}s，峰值内存 {rss:8.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
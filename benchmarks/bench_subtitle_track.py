@@ -0,0 +1,54 @@
+"""字幕轨道逐帧开销基准：字幕条数从 10 增加到 2000 时，每帧耗时应保持不变
+
+用法: python benchmarks/bench_subtitle_track.py [字体路径]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from subtitles import SubtitleTrackClip, SubtitleRenderer, DEFAULT_FONT_PATH
+
+VIDEO_SIZE = (1280, 720)
+FPS = 25
+SECONDS_PER_LINE = 2.0
+FRAMES = 500
+WINDOWS = 5
+
+
+def make_timings(count):
+    return [{
+        "text": f"第{i}句字幕内容示例",
+        "start": i * SECONDS_PER_LINE,
+        "end": (i + 1) * SECONDS_PER_LINE - 0.1,
+    } for i in range(count)]
+
+
+def bench(count, font_path):
+    duration = count * SECONDS_PER_LINE
+    track = SubtitleTrackClip(make_timings(count), VIDEO_SIZE, duration,
+                              renderer=SubtitleRenderer(), font_path=font_path)
+    # 在时间线的开头、中间和结尾各按 25fps 连续写若干帧，模拟 write_videofile 的顺序取帧
+    window = FRAMES // WINDOWS
+    frames = 0
+    start = time.perf_counter()
+    for w in range(WINDOWS):
+        window_start = (duration - window / FPS) * w / (WINDOWS - 1)
+        for n in range(window):
+            t = window_start + n / FPS
+            track.get_frame(t)
+            track.mask.get_frame(t)
+            frames += 1
+    elapsed = time.perf_counter() - start
+    return elapsed / frames * 1000
+
+
+def main():
+    font_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_FONT_PATH
+    for count in (10, 100, 500, 2000):
+        print(f"{count:>5} 条字幕: {bench(count, font_path):.3f} ms/帧")
+
+
+if __name__ == '__main__':
+    main()
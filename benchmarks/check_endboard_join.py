@@ -0,0 +1,79 @@
+"""尾板拼接检查：把预编码尾板追加到不同音频编码的主视频之后，解码拼接结果比较尾板段的音量
+
+用法: python benchmarks/check_endboard_join.py [尾板视频] [宽x高]
+默认使用 uploads/endboards/1.mp4 和 720x1280。主视频用测试画面和正弦波生成，音轨分别编码为
+AAC（与尾板一致，流复制拼接）和 PCM（不一致，重新编码拼接）。拼接结果中尾板段的 RMS 应与
+尾板本身一致，流复制时如果按主视频的参数解码尾板，尾板段会变成满幅噪声。
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+import ffmpeg_backend
+from audio_mixer import decode_pcm, SAMPLE_RATE
+from endboard_cache import EndboardCache, append_segment, DEFAULT_ENDBOARD_PATH
+
+MAIN_DURATION = 3.0
+# 尾板段与尾板本身的 RMS 之比允许的范围（AAC 重新编码和拼接边界带来的少量偏差）
+RMS_RATIO_RANGE = (0.8, 1.25)
+
+
+def make_main(path, size, audio_args):
+    """生成带 440Hz 正弦波音轨的测试主视频"""
+    width, height = size
+    ffmpeg_backend.run_ffmpeg([
+        ffmpeg_backend.ffmpeg_binary(), '-y', '-hide_banner', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f"testsrc2=size={width}x{height}:rate={ffmpeg_backend.OUTPUT_FPS}",
+        '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=44100',
+        '-t', str(MAIN_DURATION), '-ac', '2',
+        *ffmpeg_backend.VIDEO_ENCODE_ARGS,
+        *audio_args,
+        path
+    ])
+
+
+def rms(pcm):
+    return float(np.sqrt(np.mean(pcm ** 2))) if len(pcm) else 0.0
+
+
+def main():
+    args = sys.argv[1:]
+    endboard_path = args[0] if args else DEFAULT_ENDBOARD_PATH
+    size = tuple(int(v) for v in args[1].split('x')) if len(args) > 1 else (720, 1280)
+
+    workdir = tempfile.mkdtemp(prefix='endboard_check_')
+    failed = False
+    try:
+        segment_path = EndboardCache(os.path.join(workdir, 'cache')).get(endboard_path, size)
+        endboard = decode_pcm(segment_path)
+        print(f"尾板 {endboard_path}: {len(endboard) / SAMPLE_RATE:.2f}秒，RMS {rms(endboard):.3f}")
+
+        for name, audio_args in [('aac', ffmpeg_backend.AUDIO_ENCODE_ARGS),
+                                 ('pcm', ['-c:a', 'pcm_s16le', '-ar', '44100'])]:
+            main_path = os.path.join(workdir, f"main_{name}.{'mp4' if name == 'aac' else 'mov'}")
+            output_path = os.path.join(workdir, f"joined_{name}.mp4")
+            make_main(main_path, size, audio_args)
+            append_segment(main_path, segment_path, output_path)
+
+            # 解码拼接结果，取主视频之后的部分（跳过边界附近 0.1 秒）
+            joined = decode_pcm(output_path)
+            tail = joined[int((MAIN_DURATION + 0.1) * SAMPLE_RATE):]
+            ratio = rms(tail) / max(rms(endboard[int(0.1 * SAMPLE_RATE):]), 1e-9)
+            ok = RMS_RATIO_RANGE[0] <= ratio <= RMS_RATIO_RANGE[1]
+            failed = failed or not ok
+            print(f"主视频音轨 {name}: 拼接后 {ffmpeg_parse_infos(output_path)['duration']:.2f}秒，"
+                  f"尾板段 RMS {rms(tail):.3f}，峰值 {float(np.abs(tail).max()):.3f}，"
+                  f"与尾板之比 {ratio:.2f} {'通过' if ok else '失败'}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+# 水印按此行数切成水平条带，每条只混合自身不透明像素的包围盒
+BAND_HEIGHT = 32
+
+
+class Overlay:
+    """预乘 alpha 的 RGBA 贴图，只保留不透明像素的包围盒（按水平条带切分）
+
+    每个条带保存 rgb * alpha + 128 和 255 - alpha（uint16），混合时
+    dst = (dst * (255 - alpha) + rgb * alpha) / 255 全部在整数域原地完成。
+    """
+
+    def __init__(self, rgba, position=(0, 0), frame_size=None, band_height=BAND_HEIGHT):
+        x, y = position
+        # 裁剪超出画面的部分
+        if frame_size is not None:
+            width, height = frame_size
+            x0, y0 = max(x, 0), max(y, 0)
+            x1 = min(x + rgba.shape[1], width)
+            y1 = min(y + rgba.shape[0], height)
+            rgba = rgba[y0 - y:max(y1 - y, y0 - y), x0 - x:max(x1 - x, x0 - x)]
+            x, y = x0, y0
+
+        self.bands = []
+        alpha = rgba[:, :, 3]
+        for top in range(0, rgba.shape[0], band_height):
+            band_alpha = alpha[top:top + band_height]
+            rows = np.flatnonzero(band_alpha.any(axis=1))
+            if len(rows) == 0:
+                continue
+            cols = np.flatnonzero(band_alpha.any(axis=0))
+            r0, r1 = top + rows[0], top + rows[-1] + 1
+            c0, c1 = cols[0], cols[-1] + 1
+            a = alpha[r0:r1, c0:c1, None].astype(np.uint16)
+            color = rgba[r0:r1, c0:c1, :3].astype(np.uint16) * a + 128
+            self.bands.append((y + r0, y + r1, x + c0, x + c1, color, 255 - a))
+
+    @property
+    def pixels(self):
+        return sum(color.shape[0] * color.shape[1] for _, _, _, _, color, _ in self.bands)
+
+    def blend(self, frame, scratch):
+        """把贴图原地混合到 uint8 帧上；scratch 是至少与帧同样大小的两块 uint16 缓冲区"""
+        product, shifted = scratch
+        for y0, y1, x0, x1, color, inverse in self.bands:
+            h, w = y1 - y0, x1 - x0
+            dst = frame[y0:y1, x0:x1]
+            acc = product[:h, :w]
+            tmp = shifted[:h, :w]
+            np.multiply(dst, inverse, out=acc)
+            np.add(acc, color, out=acc)
+            # 整数除以 255 并四舍五入：(x + (x >> 8)) >> 8，x 已含 +128
+            np.right_shift(acc, 8, out=tmp)
+            np.add(acc, tmp, out=acc)
+            np.right_shift(acc, 8, out=acc)
+            np.copyto(dst, acc, casting='unsafe')
+
+
+class WatermarkCache:
+    """按 (文件, 修改时间, 输出尺寸) 缓存缩放并预乘后的水印，同一尺寸只计算一次"""
+
+    def __init__(self, max_entries=8):
+        self.max_entries = max_entries
+        self._overlays = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, path, size):
+        key = (os.path.abspath(path), os.path.getmtime(path), tuple(size))
+        with self._lock:
+            overlay = self._overlays.get(key)
+            if overlay is not None:
+                self._overlays.move_to_end(key)
+                return overlay
+
+        # 水印覆盖整个画面：缩放到输出尺寸（PIL 对 RGBA 按预乘 alpha 插值）
+        image = Image.open(path).convert("RGBA").resize(tuple(size), Image.LANCZOS)
+        overlay = Overlay(np.array(image))
+
+        with self._lock:
+            self._overlays[key] = overlay
+            while len(self._overlays) > self.max_entries:
+                self._overlays.popitem(last=False)
+        return overlay
+
+
+default_watermark_cache = WatermarkCache()
+
+
+class Compositor:
+    """在 uint8 帧缓冲区上原地叠加水印和当前字幕，代替逐帧分配浮点数组的 CompositeVideoClip
+
+    watermark: Overlay；subtitles: 提供 overlay_at(t) 的字幕轨道（SubtitleTrackClip）。
+    """
+
+    def __init__(self, size, watermark=None, subtitles=None):
+        width, height = size
+        self.watermark = watermark
+        self.subtitles = subtitles
+        self._scratch = (np.empty((height, width, 3), dtype=np.uint16),
+                         np.empty((height, width, 3), dtype=np.uint16))
+
+    def composite(self, frame, t):
+        """把 t 时刻的水印和字幕混合到 frame 上并返回 frame"""
+        if self.watermark is not None:
+            self.watermark.blend(frame, self._scratch)
+        if self.subtitles is not None:
+            overlay = self.subtitles.overlay_at(t)
+            if overlay is not None:
+                overlay.blend(frame, self._scratch)
+        return frame
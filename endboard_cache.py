@@ -0,0 +1,134 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+import ffmpeg_backend
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENDBOARD_PATH = os.path.join('uploads', 'endboards', '1.mp4')
+
+
+class EndboardCache:
+    """尾板预编码缓存：每种 (分辨率, 帧率, 编码参数) 只编码一次
+
+    预编码的尾板与主视频使用相同的编码参数，成片时用 concat 分离器流复制追加在主视频之后，
+    渲染时间只花在每个变体独有的主体部分上。
+    """
+
+    def __init__(self, cache_dir, fps=ffmpeg_backend.OUTPUT_FPS):
+        self.cache_dir = cache_dir
+        self.fps = fps
+        self._lock = threading.Lock()
+
+    def make_key(self, endboard_path, video_size):
+        """由尾板文件签名、输出尺寸和编码参数生成缓存键"""
+        stat = os.stat(endboard_path)
+        payload = json.dumps({
+            'path': os.path.abspath(endboard_path),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'video_size': list(video_size),
+            'fps': self.fps,
+            'video_args': ffmpeg_backend.VIDEO_ENCODE_ARGS,
+            'audio_args': ffmpeg_backend.AUDIO_ENCODE_ARGS,
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, endboard_path, video_size):
+        """返回指定输出尺寸的预编码尾板路径，缓存不存在时先编码"""
+        key = self.make_key(endboard_path, video_size)
+        output_path = os.path.join(self.cache_dir, f"{key}.mp4")
+        if os.path.exists(output_path):
+            return output_path
+
+        with self._lock:
+            if os.path.exists(output_path):
+                return output_path
+            os.makedirs(self.cache_dir, exist_ok=True)
+            logger.info(f"预编码尾板: {endboard_path} -> {video_size[0]}x{video_size[1]}")
+            # 多个渲染进程可能同时编码同一尾板，各自写临时文件后原子替换
+            tmp_path = os.path.join(self.cache_dir, f"{key}.{os.getpid()}.tmp.mp4")
+            try:
+                ffmpeg_backend.run_ffmpeg(self.build_command(endboard_path, video_size, tmp_path))
+                os.replace(tmp_path, output_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return output_path
+
+    def build_command(self, endboard_path, video_size, output_path):
+        width, height = video_size
+        infos = ffmpeg_parse_infos(endboard_path)
+        command = [ffmpeg_backend.ffmpeg_binary(), '-y', '-hide_banner', '-loglevel', 'error',
+                   '-i', endboard_path]
+        if infos.get('audio_found'):
+            audio_filter = f"[0:a]{ffmpeg_backend.AUDIO_FORMAT}[a]"
+        else:
+            # 尾板没有音轨时补一段静音，保证与主视频的音轨能直接拼接
+            audio_filter = f"anullsrc=r=44100:cl=stereo,atrim=duration={infos['duration']:.3f}[a]"
+        command.extend([
+            '-filter_complex',
+            f"[0:v]scale={width}:{height},setsar=1,fps={self.fps},format=yuv420p[v];{audio_filter}",
+            '-map', '[v]', '-map', '[a]',
+        ])
+        command.extend(ffmpeg_backend.VIDEO_ENCODE_ARGS)
+        command.extend(ffmpeg_backend.AUDIO_ENCODE_ARGS)
+        command.append(output_path)
+        return command
+
+
+def append_segment(main_path, segment_path, output_path):
+    """把预编码片段追加到主视频之后
+
+    两部分的编码参数一致时用 concat 分离器流复制；不一致时（concat 分离器会按主视频的参数解码尾板，
+    音轨变成噪声）改用 concat 滤镜重新编码。
+    """
+    main_params = ffmpeg_backend.stream_params(main_path)
+    segment_params = ffmpeg_backend.stream_params(segment_path)
+    if main_params != segment_params:
+        logger.warning(f"主视频与尾板的编码参数不一致（{main_params} / {segment_params}），重新编码拼接")
+        return concat_reencode(main_path, segment_path, output_path, main_params['video'][2:])
+
+    list_path = f"{output_path}.concat.txt"
+    with open(list_path, 'w', encoding='utf-8') as f:
+        f.write(f"file '{os.path.abspath(main_path)}'\n")
+        f.write(f"file '{os.path.abspath(segment_path)}'\n")
+    try:
+        ffmpeg_backend.run_ffmpeg([
+            ffmpeg_backend.ffmpeg_binary(), '-y', '-hide_banner', '-loglevel', 'error',
+            '-f', 'concat', '-safe', '0', '-i', list_path,
+            '-map', '0:v', '-map', '0:a',
+            '-c', 'copy',
+            '-movflags', '+faststart',
+            output_path
+        ])
+    finally:
+        os.remove(list_path)
+    return output_path
+
+
+def concat_reencode(main_path, segment_path, output_path, video_size):
+    """用 concat 滤镜解码两部分后重新编码拼接，尾板缩放到主视频尺寸"""
+    width, height = video_size
+    ffmpeg_backend.run_ffmpeg([
+        ffmpeg_backend.ffmpeg_binary(), '-y', '-hide_banner', '-loglevel', 'error',
+        '-i', main_path, '-i', segment_path,
+        '-filter_complex',
+        f"[0:v]fps={ffmpeg_backend.OUTPUT_FPS},setsar=1,format=yuv420p[v0];"
+        f"[1:v]scale={width}:{height},fps={ffmpeg_backend.OUTPUT_FPS},setsar=1,format=yuv420p[v1];"
+        f"[0:a]{ffmpeg_backend.AUDIO_FORMAT}[a0];[1:a]{ffmpeg_backend.AUDIO_FORMAT}[a1];"
+        "[v0][a0][v1][a1]concat=n=2:v=1:a=1[v][a]",
+        '-map', '[v]', '-map', '[a]',
+        *ffmpeg_backend.VIDEO_ENCODE_ARGS,
+        *ffmpeg_backend.AUDIO_ENCODE_ARGS,
+        output_path
+    ])
+    return output_path
+
+
+default_endboard_cache = EndboardCache(os.path.join('uploads', 'endboard_cache'))
@@ -0,0 +1,317 @@
+import os
+import re
+import logging
+import tempfile
+import subprocess
+
+from PIL import Image
+from moviepy.config import get_setting
+
+from subtitles import default_renderer, write_ass, DEFAULT_FONT_PATH
+
+logger = logging.getLogger(__name__)
+
+# 与 moviepy 路径 write_videofile 保持一致的编码参数
+OUTPUT_FPS = 25
+VIDEO_ENCODE_ARGS = [
+    '-c:v', 'libx264',
+    '-preset', 'ultrafast',
+    '-b:v', '3000k',
+    '-pix_fmt', 'yuv420p',
+    '-tune', 'zerolatency',
+    '-movflags', '+faststart',
+    '-bf', '0',
+    '-g', '25',
+    '-sc_threshold', '0',
+]
+AUDIO_ENCODE_ARGS = ['-c:a', 'aac', '-ar', '44100', '-ac', '2']
+AUDIO_FORMAT = 'aresample=44100,aformat=sample_fmts=fltp:channel_layouts=stereo'
+
+# `ffmpeg -i` 的流信息行；编码名称包含 profile（如 "h264 (High)"），不含 "(avc1 / 0x...)" 这类封装标签
+VIDEO_STREAM_RE = re.compile(r'Stream #\d+:\d+.*?: Video: (.+?)(?: \(\w+ / 0x[0-9a-fA-F]+\))?, (\w+).*?, (\d+)x(\d+)')
+AUDIO_STREAM_RE = re.compile(r'Stream #\d+:\d+.*?: Audio: (.+?)(?: \(\w+ / 0x[0-9a-fA-F]+\))?, (\d+) Hz, ([^,]+), (\w+)')
+
+# 输出规格适配画面比例的方式：crop 缩放填满后居中裁剪，pad 缩放放入后补黑边，stretch 直接拉伸
+RENDITION_FITS = ('crop', 'pad', 'stretch')
+
+
+def video_encode_args(bitrate=None):
+    """视频编码参数，可替换码率"""
+    args = list(VIDEO_ENCODE_ARGS)
+    if bitrate:
+        args[args.index('-b:v') + 1] = bitrate
+    return args
+
+
+def fit_filter(size, fit='pad'):
+    """把画面适配到输出规格尺寸的滤镜"""
+    width, height = size
+    if fit == 'crop':
+        return f"scale={width}:{height}:force_original_aspect_ratio=increase,crop={width}:{height}"
+    if fit == 'pad':
+        return (f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+                f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2")
+    return f"scale={width}:{height}"
+
+
+def ffmpeg_binary():
+    return get_setting("FFMPEG_BINARY")
+
+
+def escape_filter_path(path):
+    """转义滤镜参数中的路径：先按选项值转义，再按 filtergraph 转义"""
+    path = os.path.abspath(path).replace('\\', '/')
+    for char in ("\\", ":", "'"):
+        path = path.replace(char, "\\" + char)
+    for char in ("\\", "'", "[", "]", ",", ";"):
+        path = path.replace(char, "\\" + char)
+    return path
+
+
+def write_subtitle_sequence(subtitle_timings, video_size, duration, workdir,
+                            renderer=None, font_path=DEFAULT_FONT_PATH, font_size=45):
+    """把字幕写成整帧透明 PNG 序列和 concat 列表，作为 ffmpeg 的单个输入叠加
+
+    字幕之间的空隙使用同一张透明图片，每条字幕只写一张 PNG。
+    """
+    renderer = renderer or default_renderer
+    width, height = video_size
+
+    blank_path = os.path.join(workdir, 'sub_blank.png')
+    Image.new("RGBA", (width, height), (0, 0, 0, 0)).save(blank_path)
+
+    entries = []
+    cursor = 0.0
+    timings = sorted(
+        (timing for timing in subtitle_timings if timing["end"] > timing["start"]),
+        key=lambda timing: timing["start"]
+    )
+    for i, timing in enumerate(timings):
+        start = max(timing["start"], cursor)
+        end = min(timing["end"], duration)
+        if end <= start:
+            continue
+        if start > cursor:
+            entries.append((blank_path, start - cursor))
+
+        sprite, position = renderer.layout(timing["text"].strip(), video_size, font_path, font_size)
+        frame = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+        frame.paste(Image.fromarray(sprite), position)
+        frame_path = os.path.join(workdir, f'sub_{i:05d}.png')
+        frame.save(frame_path)
+
+        entries.append((frame_path, end - start))
+        cursor = end
+
+    if cursor < duration:
+        entries.append((blank_path, duration - cursor))
+
+    list_path = os.path.join(workdir, 'subtitles.txt')
+    with open(list_path, 'w', encoding='utf-8') as f:
+        f.write('ffconcat version 1.0\n')
+        for path, entry_duration in entries:
+            f.write(f"file '{os.path.abspath(path)}'\nduration {entry_duration:.3f}\n")
+        # concat 分离器会忽略最后一项的时长，重复最后一张图片以保证时长完整
+        f.write(f"file '{os.path.abspath(entries[-1][0])}'\n")
+    return list_path
+
+
+class FFmpegTimeline:
+    """把一次渲染的时间线编译成单条 ffmpeg 命令（filter_complex）"""
+
+    def __init__(self, video_size, fps=OUTPUT_FPS):
+        self.video_size = video_size
+        self.fps = fps
+        self.inputs = []
+        self.filters = []
+
+    def add_input(self, path, *options):
+        self.inputs.append(list(options) + ['-i', path])
+        return len(self.inputs) - 1
+
+    def add_filter(self, graph):
+        self.filters.append(graph)
+
+    def normalize_video(self, index, label):
+        """缩放到目标尺寸并统一帧率和像素格式"""
+        width, height = self.video_size
+        self.add_filter(
+            f"[{index}:v]scale={width}:{height},setsar=1,fps={self.fps},format=yuv420p[{label}]"
+        )
+
+    def split_renditions(self, video_label, audio_label, renditions):
+        """把合成好的画面和音轨分给每个输出规格：split/asplit 后各自缩放、裁剪或补边
+
+        renditions: [{'path', 'size', 'bitrate', 'fit'}, ...]；返回 build_outputs 使用的输出列表
+        """
+        count = len(renditions)
+        self.add_filter(f"[{video_label}]split={count}" + ''.join(f"[src{i}]" for i in range(count)))
+        self.add_filter(f"[{audio_label}]asplit={count}" + ''.join(f"[r{i}a]" for i in range(count)))
+        outputs = []
+        for i, rendition in enumerate(renditions):
+            self.add_filter(
+                f"[src{i}]{fit_filter(rendition['size'], rendition.get('fit', 'pad'))},"
+                f"setsar=1,format=yuv420p[r{i}v]"
+            )
+            outputs.append((rendition['path'], f"r{i}v", f"r{i}a", rendition.get('bitrate')))
+        return outputs
+
+    def build(self, output_path, video_label, audio_label, threads=8):
+        return self.build_outputs([(output_path, video_label, audio_label, None)], threads=threads)
+
+    def build_outputs(self, outputs, threads=8):
+        """outputs: [(输出路径, 视频标签, 音频标签, 码率), ...]，所有输出在同一次编码中写出"""
+        # 多线程执行滤镜图时，水印和字幕序列同时存在会偶发 "Invalid data found"，
+        # 滤镜图单线程执行，编码仍使用 threads 个线程
+        command = [ffmpeg_binary(), '-y', '-hide_banner', '-loglevel', 'error',
+                   '-filter_complex_threads', '1']
+        for input_args in self.inputs:
+            command.extend(input_args)
+        command.extend(['-filter_complex', ';'.join(self.filters)])
+        for output_path, video_label, audio_label, bitrate in outputs:
+            command.extend(['-map', f'[{video_label}]', '-map', f'[{audio_label}]'])
+            command.extend(video_encode_args(bitrate))
+            command.extend(AUDIO_ENCODE_ARGS)
+            command.extend(['-threads', str(threads), output_path])
+        return command
+
+
+def build_render_command(segments, video_size, narration_path, narration_duration, bgm_path,
+                         output_path, subtitle_list_path=None, watermark_path=None,
+                         bgm_volume=0.3, threads=8, ass_path=None, fonts_dir=None,
+                         bgm_offset=0.0, renditions=None):
+    """生成与 moviepy 合成路径等价的 ffmpeg 命令（不含尾板，尾板由 endboard_cache 预编码后追加）
+
+    segments: 时间线片段 [(素材路径, 入点, 出点), ...]，按顺序拼接后截取到语音时长
+    renditions: 输出规格列表，提供时画面按 video_size 合成一次，再在同一次编码中写出每个规格（不写 output_path）
+    """
+    timeline = FFmpegTimeline(video_size)
+
+    # 视频素材：只读取片段用到的区间，统一尺寸后拼接，截取到语音时长
+    segment_labels = []
+    for i, (path, t_in, t_out) in enumerate(segments):
+        index = timeline.add_input(path, '-ss', f'{t_in:.3f}', '-t', f'{t_out - t_in:.3f}')
+        timeline.normalize_video(index, f'seg{i}')
+        segment_labels.append(f'[seg{i}]')
+    timeline.add_filter(
+        f"{''.join(segment_labels)}concat=n={len(segment_labels)}:v=1:a=0,"
+        f"trim=duration={narration_duration:.3f},setpts=PTS-STARTPTS[base]"
+    )
+    video_label = 'base'
+
+    # 水印：缩放到画面大小后居中叠加
+    if watermark_path:
+        index = timeline.add_input(watermark_path)
+        width, height = video_size
+        timeline.add_filter(f"[{index}:v]scale={width}:{height},format=rgba[wm]")
+        timeline.add_filter(f"[{video_label}][wm]overlay=0:0:eof_action=repeat[wmv]")
+        video_label = 'wmv'
+
+    # 字幕：PNG 序列作为一个输入叠加在最上层
+    if subtitle_list_path:
+        index = timeline.add_input(subtitle_list_path, '-f', 'concat', '-safe', '0')
+        timeline.add_filter(f"[{index}:v]format=rgba[subs]")
+        timeline.add_filter(f"[{video_label}][subs]overlay=0:0:eof_action=pass,format=yuv420p[main]")
+        video_label = 'main'
+
+    # ASS 字幕：由 libass 直接烧录，不需要逐条生成图片
+    if ass_path:
+        subtitles_filter = f"subtitles=filename={escape_filter_path(ass_path)}"
+        if fonts_dir:
+            subtitles_filter += f":fontsdir={escape_filter_path(fonts_dir)}"
+        timeline.add_filter(f"[{video_label}]{subtitles_filter}[assv]")
+        video_label = 'assv'
+
+    # 音频：语音 + 循环的背景音乐（按固定音量）混音
+    narration_index = timeline.add_input(narration_path)
+    bgm_options = ['-stream_loop', '-1']
+    if bgm_offset:
+        bgm_options += ['-ss', f'{bgm_offset:.3f}']
+    bgm_index = timeline.add_input(bgm_path, *bgm_options)
+    timeline.add_filter(f"[{narration_index}:a]{AUDIO_FORMAT}[narr]")
+    timeline.add_filter(
+        f"[{bgm_index}:a]{AUDIO_FORMAT},atrim=duration={narration_duration:.3f},"
+        f"volume={bgm_volume}[bgm]"
+    )
+    timeline.add_filter(
+        f"[narr][bgm]amix=inputs=2:duration=longest:normalize=0,"
+        f"atrim=duration={narration_duration:.3f},apad=whole_dur={narration_duration:.3f}[mix]"
+    )
+    audio_label = 'mix'
+
+    if renditions:
+        return timeline.build_outputs(timeline.split_renditions(video_label, audio_label, renditions),
+                                      threads=threads)
+    return timeline.build(output_path, video_label, audio_label, threads=threads)
+
+
+def build_rendition_command(input_path, video_size, renditions, threads=8):
+    """把已合成的视频一次解码，在同一次编码中写出每个输出规格"""
+    timeline = FFmpegTimeline(video_size)
+    index = timeline.add_input(input_path)
+    outputs = timeline.split_renditions(f"{index}:v", f"{index}:a", renditions)
+    return timeline.build_outputs(outputs, threads=threads)
+
+
+def stream_params(path):
+    """读取 `ffmpeg -i` 打印的流信息
+
+    返回 {'video': (编码, 像素格式, 宽, 高), 'audio': (编码, 采样率, 声道, 采样格式)}；
+    concat 分离器按第一个文件的参数解码所有片段，流复制拼接前用它确认各部分参数一致。
+    """
+    result = subprocess.run([ffmpeg_binary(), '-hide_banner', '-i', path],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    params = {}
+    for line in result.stderr.decode('utf-8', errors='ignore').splitlines():
+        video = VIDEO_STREAM_RE.search(line)
+        if video and 'video' not in params:
+            params['video'] = (video.group(1), video.group(2), int(video.group(3)), int(video.group(4)))
+        audio = AUDIO_STREAM_RE.search(line)
+        if audio and 'audio' not in params:
+            params['audio'] = (audio.group(1), int(audio.group(2)), audio.group(3), audio.group(4))
+    return params
+
+
+def run_ffmpeg(command):
+    """执行 ffmpeg 命令，失败时抛出包含错误输出的异常"""
+    logger.info(f"执行 ffmpeg 命令: {' '.join(command)}")
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise Exception(f"ffmpeg 执行失败: {result.stderr.decode('utf-8', errors='ignore')[-2000:]}")
+
+
+def render_timeline(segments, video_size, narration_path, narration_duration, bgm_path,
+                    output_path, subtitle_timings, watermark_path=None,
+                    font_path=DEFAULT_FONT_PATH, font_size=45, renderer=None, threads=8,
+                    subtitle_mode='sprite', bgm_volume=0.3, bgm_offset=0.0, renditions=None):
+    """用单条 ffmpeg 命令完成拼接、缩放、水印、字幕和混音
+
+    subtitle_mode: sprite 叠加 PIL 渲染的字幕图片序列，ass 通过 libass 烧录 ASS 字幕
+    renditions: 输出规格列表（见 build_render_command）
+    """
+    with tempfile.TemporaryDirectory(prefix='ffmpeg_render_') as workdir:
+        subtitle_list_path = None
+        ass_path = None
+        if subtitle_timings and subtitle_mode == 'ass':
+            ass_path = write_ass(
+                subtitle_timings, os.path.join(workdir, 'subtitles.ass'), video_size,
+                font_path=font_path, font_size=font_size
+            )
+        elif subtitle_timings:
+            subtitle_list_path = write_subtitle_sequence(
+                subtitle_timings, video_size, narration_duration, workdir,
+                renderer=renderer, font_path=font_path, font_size=font_size
+            )
+        command = build_render_command(
+            segments, video_size, narration_path, narration_duration, bgm_path, output_path,
+            subtitle_list_path=subtitle_list_path,
+            watermark_path=watermark_path,
+            bgm_volume=bgm_volume,
+            bgm_offset=bgm_offset,
+            threads=threads,
+            ass_path=ass_path,
+            fonts_dir=os.path.dirname(font_path),
+            renditions=renditions
+        )
+        run_ffmpeg(command)
+    return output_path
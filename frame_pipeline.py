@@ -0,0 +1,237 @@
+import time
+import queue
+import logging
+import threading
+import subprocess
+
+import numpy as np
+from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
+
+import ffmpeg_backend
+
+logger = logging.getLogger(__name__)
+
+# 阶段之间每个队列最多积压的帧数
+QUEUE_SIZE = 4
+
+# 队列等待的轮询间隔，其他阶段出错时据此及时退出
+POLL_INTERVAL = 0.1
+
+
+class PipelineAborted(Exception):
+    """其他阶段出错，当前阶段停止"""
+
+
+class StageStats:
+    """单个阶段的耗时统计：处理帧的时间和在队列上等待的时间"""
+
+    def __init__(self, name):
+        self.name = name
+        self.frames = 0
+        self.busy = 0.0
+        self.wait_in = 0.0
+        self.wait_out = 0.0
+
+    def as_dict(self):
+        return {
+            'frames': self.frames,
+            'busy': round(self.busy, 3),
+            'wait_in': round(self.wait_in, 3),
+            'wait_out': round(self.wait_out, 3),
+        }
+
+
+class RenditionWriter:
+    """把原始帧写入 ffmpeg 管道，画面 split 后在同一次编码中写出每个输出规格
+
+    renditions: [{'path', 'size', 'bitrate', 'fit'}, ...]；audiofile 的音轨同样 asplit 到每个输出。
+    """
+
+    def __init__(self, size, fps, renditions, audiofile, threads=None):
+        timeline = ffmpeg_backend.FFmpegTimeline(size, fps)
+        video = timeline.add_input('-', '-f', 'rawvideo', '-vcodec', 'rawvideo',
+                                   '-s', '%dx%d' % tuple(size), '-pix_fmt', 'rgb24', '-r', '%.02f' % fps)
+        audio = timeline.add_input(audiofile)
+        outputs = timeline.split_renditions(f"{video}:v", f"{audio}:a", renditions)
+        command = timeline.build_outputs(outputs, threads=threads or 8)
+        logger.info(f"多规格编码: {' '.join(command)}")
+        self.proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                     stderr=subprocess.PIPE)
+
+    def write_frame(self, frame):
+        try:
+            # 直接写出连续的帧缓冲区，不复制
+            self.proc.stdin.write(memoryview(frame))
+        except (IOError, ValueError):
+            raise Exception(f"ffmpeg 编码失败: {self._finish()}")
+
+    def _finish(self):
+        if not self.proc.stdin.closed:
+            try:
+                self.proc.stdin.close()
+            except OSError:
+                pass
+        error = self.proc.stderr.read().decode('utf-8', errors='ignore')[-2000:]
+        self.proc.stderr.close()
+        self.proc.wait()
+        return error
+
+    def close(self):
+        if self.proc is None:
+            return
+        error = self._finish()
+        returncode = self.proc.returncode
+        self.proc = None
+        if returncode != 0:
+            raise Exception(f"ffmpeg 编码失败: {error}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self.proc is not None:
+            self.proc.kill()
+            self._finish()
+            self.proc = None
+
+
+class FramePipeline:
+    """解码、合成、编码三个阶段各占一个线程，阶段之间用有界队列传递帧缓冲区
+
+    base: 底层画面（素材拼接），解码线程逐帧读取并复制到缓冲区；
+    composite(frame, t): 合成线程调用，把水印、字幕等叠加到缓冲区上（如 Compositor.composite）；
+    编码线程把缓冲区写入 ffmpeg 管道后归还。帧缓冲区在开始时一次分配、循环复用，
+    解码和编码的子进程在 Python 合成时不再空闲，吞吐量取决于最慢的阶段而不是三者之和。
+    """
+
+    def __init__(self, base, composite, queue_size=QUEUE_SIZE):
+        self.base = base
+        self.composite = composite
+        self.queue_size = queue_size
+        self.stats = [StageStats('decode'), StageStats('composite'), StageStats('encode')]
+        self._abort = threading.Event()
+        self._error = None
+
+    def _get(self, source, stats):
+        start = time.perf_counter()
+        while True:
+            try:
+                item = source.get(timeout=POLL_INTERVAL)
+                break
+            except queue.Empty:
+                if self._abort.is_set():
+                    raise PipelineAborted()
+        stats.wait_in += time.perf_counter() - start
+        return item
+
+    def _put(self, target, item, stats):
+        start = time.perf_counter()
+        while True:
+            try:
+                target.put(item, timeout=POLL_INTERVAL)
+                break
+            except queue.Full:
+                if self._abort.is_set():
+                    raise PipelineAborted()
+        stats.wait_out += time.perf_counter() - start
+
+    def _run_stage(self, stats, body):
+        try:
+            body(stats)
+        except PipelineAborted:
+            pass
+        except Exception as e:
+            logger.error(f"帧流水线 {stats.name} 阶段失败: {str(e)}")
+            if self._error is None:
+                self._error = e
+            self._abort.set()
+
+    def write(self, output_path, fps, codec='libx264', preset='medium', bitrate=None,
+              ffmpeg_params=None, audiofile=None, threads=None, renditions=None):
+        """按 fps 逐帧渲染 base 的整个时长并编码到 output_path，返回各阶段的统计
+
+        renditions: 输出规格列表，提供时改由 RenditionWriter 一次写出全部规格（不写 output_path）
+        """
+        width, height = self.base.size
+        times = np.arange(0, self.base.duration, 1.0 / fps)
+        # 每个队列满载时加上三个阶段各自手中的一帧
+        free = queue.Queue()
+        for _ in range(2 * self.queue_size + 3):
+            free.put(np.empty((height, width, 3), dtype=np.uint8))
+        decoded = queue.Queue(maxsize=self.queue_size)
+        composited = queue.Queue(maxsize=self.queue_size)
+        decode_stats, composite_stats, encode_stats = self.stats
+
+        def decode(stats):
+            for t in times:
+                buffer = self._get(free, stats)
+                start = time.perf_counter()
+                np.copyto(buffer, self.base.get_frame(t), casting='unsafe')
+                stats.busy += time.perf_counter() - start
+                stats.frames += 1
+                self._put(decoded, (t, buffer), stats)
+            self._put(decoded, None, stats)
+
+        def composite(stats):
+            while True:
+                item = self._get(decoded, stats)
+                if item is None:
+                    break
+                t, buffer = item
+                start = time.perf_counter()
+                frame = self.composite(buffer, t)
+                if frame is not buffer:
+                    np.copyto(buffer, frame, casting='unsafe')
+                stats.busy += time.perf_counter() - start
+                stats.frames += 1
+                self._put(composited, buffer, stats)
+            self._put(composited, None, stats)
+
+        def encode(stats, writer):
+            while True:
+                buffer = self._get(composited, stats)
+                if buffer is None:
+                    break
+                start = time.perf_counter()
+                writer.write_frame(buffer)
+                stats.busy += time.perf_counter() - start
+                stats.frames += 1
+                free.put(buffer)
+
+        started = time.perf_counter()
+        if renditions:
+            writer = RenditionWriter((width, height), fps, renditions, audiofile, threads=threads)
+        else:
+            ffmpeg_params = list(ffmpeg_params or [])
+            if audiofile is not None:
+                # moviepy 对 audiofile 使用 -acodec copy，混音后的 WAV 会原样封装为 PCM；
+                # 追加的编码参数在同一输出上后指定、优先生效，音轨编码为 AAC
+                ffmpeg_params.extend(ffmpeg_backend.AUDIO_ENCODE_ARGS)
+            writer = FFMPEG_VideoWriter(output_path, (width, height), fps, codec=codec, preset=preset,
+                                        bitrate=bitrate, audiofile=audiofile, threads=threads,
+                                        ffmpeg_params=ffmpeg_params)
+        with writer:
+            workers = [
+                threading.Thread(target=self._run_stage, args=(decode_stats, decode), daemon=True),
+                threading.Thread(target=self._run_stage, args=(composite_stats, composite), daemon=True),
+            ]
+            for worker in workers:
+                worker.start()
+            # 编码在当前线程进行，写管道时释放 GIL
+            self._run_stage(encode_stats, lambda stats: encode(stats, writer))
+            for worker in workers:
+                worker.join()
+        if self._error is not None:
+            raise self._error
+
+        elapsed = time.perf_counter() - started
+        logger.info(
+            f"帧流水线完成: {len(times)} 帧，耗时 {elapsed:.2f}秒（{len(times) / max(elapsed, 1e-9):.1f} 帧/秒），"
+            + "，".join(
+                f"{stats.name} 处理 {stats.busy:.2f}秒 / 等待输入 {stats.wait_in:.2f}秒 / 等待输出 {stats.wait_out:.2f}秒"
+                for stats in self.stats
+            )
+        )
+        return {stats.name: stats.as_dict() for stats in self.stats}
@@ -1,8 +1,13 @@
 from app import app, db, VideoMaterial, MusicMaterial
+from models import ensure_columns
+from media_index import probe_media
 import os
 
 def init_db():
     with app.app_context():
+        db.create_all()
+        ensure_columns()
+
         # 添加视频素材
         video_dir = os.path.join('uploads', 'videos')
         for filename in os.listdir(video_dir):
@@ -13,6 +18,7 @@ def init_db():
                     filepath=filepath,
                     size=os.path.getsize(filepath)
                 )
+                video.update_from_probe(probe_media(filepath))
                 db.session.add(video)
         
         # 添加音乐素材
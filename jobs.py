@@ -0,0 +1,126 @@
+import re
+import uuid
+import logging
+import threading
+import traceback
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# 任务 ID 的格式（uuid4 的十六进制形式），任务 ID 会用作工作目录名
+JOB_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+# 当前线程正在执行的任务，update_progress 通过它把进度写入对应任务
+_current = threading.local()
+
+
+def is_valid_job_id(job_id):
+    """检查任务 ID 是否为 JobManager 生成的格式"""
+    return isinstance(job_id, str) and JOB_ID_PATTERN.fullmatch(job_id) is not None
+
+
+def current_job():
+    """返回当前工作线程正在执行的任务（不在任务线程中时返回 None）"""
+    return getattr(_current, 'job', None)
+
+
+class Job:
+    """单个生成任务的状态"""
+
+    def __init__(self, job_id, params=None):
+        self.id = job_id
+        self.params = params or {}
+        self.status = 'queued'  # queued / running / completed / failed
+        self.progress = 0
+        self.stage = '排队中...'
+        self.result = None
+        self.error = None
+        self.created_at = datetime.now()
+        self.updated_at = self.created_at
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'progress': self.progress,
+            'stage': self.stage,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'updated_at': self.updated_at.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+
+
+class JobManager:
+    """后台任务队列：提交后立即返回任务 ID，由线程池中的渲染工作线程执行"""
+
+    def __init__(self, max_workers=2, max_finished=200):
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='render-worker')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, func, params=None, job_id=None):
+        """提交任务，func(job) 的返回值作为任务结果；指定 job_id 时以同一 ID 重新执行（用于重试）"""
+        job = Job(job_id or uuid.uuid4().hex, params)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, func)
+        logger.info(f"任务已提交: {job.id}")
+        return job
+
+    def record(self, params, result):
+        """登记无需执行、直接得到结果的任务（如渲染缓存命中），查询方式与普通任务一致"""
+        job = Job(uuid.uuid4().hex, params)
+        job.status = 'completed'
+        job.progress = 100
+        job.stage = '处理完成!'
+        job.result = result
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        logger.info(f"任务已直接完成: {job.id}")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def update(self, job, progress=None, stage=None):
+        with self._lock:
+            if progress is not None:
+                job.progress = progress
+            if stage is not None:
+                job.stage = stage
+            job.updated_at = datetime.now()
+
+    def _run(self, job, func):
+        _current.job = job
+        self.update(job)
+        job.status = 'running'
+        try:
+            result = func(job)
+            with self._lock:
+                job.result = result
+                job.status = 'completed'
+                job.updated_at = datetime.now()
+        except Exception as e:
+            logger.error(f"任务执行失败 {job.id}: {str(e)}")
+            logger.error(traceback.format_exc())
+            with self._lock:
+                job.error = str(e)
+                job.status = 'failed'
+                job.updated_at = datetime.now()
+        finally:
+            _current.job = None
+
+    def _prune(self):
+        """只保留最近的已结束任务，避免内存无限增长"""
+        finished = [job for job in self._jobs.values() if job.status in ('completed', 'failed')]
+        if len(finished) <= self.max_finished:
+            return
+        finished.sort(key=lambda job: job.updated_at)
+        for job in finished[:len(finished) - self.max_finished]:
+            del self._jobs[job.id]
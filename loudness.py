@@ -0,0 +1,47 @@
+import re
+import logging
+import subprocess
+
+from moviepy.config import get_setting
+
+logger = logging.getLogger(__name__)
+
+# 背景音乐的目标响度：常见的 -11 LUFS 左右的曲目乘以原来的固定音量 0.3 约为 -22 LUFS
+BGM_TARGET_LUFS = -22.0
+# 提升安静曲目的音量时，峰值不超过该值
+BGM_MAX_PEAK_DB = -1.0
+# 没有响度数据时使用的固定音量
+DEFAULT_BGM_GAIN = 0.3
+
+
+def analyze_loudness(path):
+    """用 ffmpeg ebur128 滤镜测量整体响度（LUFS）和真峰值（dBTP）"""
+    result = subprocess.run(
+        [get_setting("FFMPEG_BINARY"), '-hide_banner', '-nostats', '-i', path,
+         '-vn', '-af', 'ebur128=peak=true', '-f', 'null', '-'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    output = result.stderr.decode('utf-8', errors='ignore')
+    if result.returncode != 0:
+        raise Exception(f"响度分析失败 {path}: {output[-1000:]}")
+
+    # 只解析最后的汇总部分
+    summary = output[output.rfind('Summary:'):]
+    loudness = re.search(r'I:\s+(-?[\d.]+|-inf) LUFS', summary)
+    peak = re.search(r'Peak:\s+(-?[\d.]+|-inf) dBFS', summary)
+    if not loudness or not peak:
+        raise Exception(f"无法解析响度分析结果: {path}")
+    return {
+        'loudness': float(loudness.group(1)),
+        'peak': float(peak.group(1)),
+    }
+
+
+def bgm_gain(loudness, peak, target=BGM_TARGET_LUFS, max_peak=BGM_MAX_PEAK_DB):
+    """计算把背景音乐调整到目标响度的线性增益，提升音量时受峰值限制"""
+    if loudness is None or loudness == float('-inf'):
+        return DEFAULT_BGM_GAIN
+    gain_db = target - loudness
+    if peak is not None and peak != float('-inf'):
+        gain_db = min(gain_db, max_peak - peak)
+    return 10 ** (gain_db / 20)
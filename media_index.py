@@ -0,0 +1,209 @@
+import os
+import json
+import random
+import logging
+import subprocess
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+
+# 在此时间（秒）内用过的素材降低选中概率，越近降得越多
+RECENT_USE_WINDOW = 24 * 3600
+
+
+def usage_weight(entry, newest=None):
+    """选片权重：使用次数越多、上次使用越接近素材库中最近一次使用，权重越低
+
+    最近使用时间以素材库中最新的 last_used 为基准（而不是当前时间），
+    素材库和使用记录不变时权重不变，选片结果可复现。
+    """
+    weight = 1.0 / (1 + (entry.get('use_count') or 0))
+    last_used = entry.get('last_used')
+    if last_used is not None and newest is not None:
+        age = (newest - last_used).total_seconds()
+        weight *= 0.5 + 0.5 * min(age / RECENT_USE_WINDOW, 1.0)
+    return weight
+
+
+def file_signature(path):
+    """返回文件的 (大小, 修改时间)，用于判断索引是否失效"""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime
+
+
+def _parse_rate(rate):
+    """解析 ffprobe 的帧率字符串，如 '30000/1001'"""
+    try:
+        if '/' in rate:
+            num, den = rate.split('/', 1)
+            return float(num) / float(den) if float(den) else 0.0
+        return float(rate)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def probe_media(path):
+    """使用 ffprobe 读取视频元数据（只读容器头，不启动解码器）"""
+    size, mtime = file_signature(path)
+    info = {
+        'duration': None,
+        'width': None,
+        'height': None,
+        'fps': None,
+        'nframes': None,
+        'codec': None,
+        'is_valid': False,
+        'size': size,
+        'mtime': mtime,
+        'probed_at': datetime.utcnow(),
+    }
+    try:
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+             '-show_entries', 'stream=codec_name,width,height,avg_frame_rate,r_frame_rate,nb_frames,duration'
+             ':format=duration',
+             '-of', 'json', path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=60,
+            check=True
+        )
+        data = json.loads(result.stdout.decode('utf-8') or '{}')
+    except FileNotFoundError:
+        # 未安装 ffprobe 时，退回到 moviepy 自带 ffmpeg 的头信息解析
+        return _probe_with_ffmpeg(path, info)
+    except Exception as e:
+        logger.warning(f"探测视频元数据失败 {path}: {str(e)}")
+        return info
+
+    streams = data.get('streams') or []
+    if not streams:
+        logger.warning(f"视频文件没有视频流: {path}")
+        return info
+
+    stream = streams[0]
+    duration = stream.get('duration') or (data.get('format') or {}).get('duration')
+    fps = _parse_rate(stream.get('avg_frame_rate')) or _parse_rate(stream.get('r_frame_rate'))
+    try:
+        duration = float(duration)
+    except (TypeError, ValueError):
+        duration = None
+
+    nframes = stream.get('nb_frames')
+    try:
+        nframes = int(nframes)
+    except (TypeError, ValueError):
+        # 部分容器（如 mkv）不记录帧数，按时长估算
+        nframes = int(duration * fps) if duration and fps else None
+
+    info.update({
+        'duration': duration,
+        'width': stream.get('width'),
+        'height': stream.get('height'),
+        'fps': fps or None,
+        'nframes': nframes,
+        'codec': stream.get('codec_name'),
+    })
+    info['is_valid'] = bool(
+        duration and duration > 0 and
+        info['width'] and info['height'] and
+        nframes and nframes > 0
+    )
+    return info
+
+
+def _probe_with_ffmpeg(path, info):
+    """用 `ffmpeg -i` 读取头信息（不包含编码名称）"""
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+    try:
+        infos = ffmpeg_parse_infos(path)
+    except Exception as e:
+        logger.warning(f"探测视频元数据失败 {path}: {str(e)}")
+        return info
+
+    if not infos.get('video_found'):
+        logger.warning(f"视频文件没有视频流: {path}")
+        return info
+
+    width, height = infos.get('video_size') or (None, None)
+    info.update({
+        'duration': infos.get('video_duration') or infos.get('duration'),
+        'width': width,
+        'height': height,
+        'fps': infos.get('video_fps'),
+        'nframes': infos.get('video_nframes'),
+    })
+    info['is_valid'] = bool(info['duration'] and width and height and info['nframes'])
+    return info
+
+
+class MediaIndex:
+    """视频素材元数据的内存索引，选片时不再打开任何视频文件"""
+
+    def __init__(self, entries=None):
+        # 绝对路径 -> 元数据字典
+        self.entries = {}
+        for entry in entries or []:
+            self.add(entry)
+
+    @classmethod
+    def from_materials(cls, materials):
+        """由 VideoMaterial 记录构建索引"""
+        return cls(material.to_index_entry() for material in materials)
+
+    def add(self, entry):
+        path = os.path.abspath(entry['filepath'])
+        self.entries[path] = dict(entry, filepath=path)
+
+    def get(self, path):
+        return self.entries.get(os.path.abspath(path))
+
+    def is_stale(self, path):
+        """文件大小或修改时间变化时视为失效"""
+        entry = self.get(path)
+        if entry is None:
+            return True
+        try:
+            size, mtime = file_signature(path)
+        except OSError:
+            return True
+        return entry.get('size') != size or entry.get('mtime') != mtime
+
+    def valid_entries(self, directory=None):
+        """返回有效的视频条目，可按目录过滤"""
+        directory = os.path.abspath(directory) if directory else None
+        return [
+            entry for path, entry in self.entries.items()
+            if entry.get('is_valid') and (directory is None or os.path.dirname(path) == directory)
+        ]
+
+    def sample(self, count, directory=None, rng=random):
+        """随机选择指定数量的有效视频（按路径排序后抽样，相同种子的 rng 结果可复现）"""
+        entries = sorted(self.valid_entries(directory), key=lambda entry: entry['filepath'])
+        if not entries:
+            return []
+        return rng.sample(entries, min(count, len(entries)))
+
+    def select_covering(self, duration, directory=None, rng=random):
+        """按使用情况加权、不放回地选择素材，总时长刚好覆盖 duration 秒即停止
+
+        素材总时长不足时返回全部有效素材（渲染时循环排布）。
+        """
+        entries = sorted(
+            (entry for entry in self.valid_entries(directory) if entry.get('duration')),
+            key=lambda entry: entry['filepath']
+        )
+        newest = max((entry['last_used'] for entry in entries if entry.get('last_used')), default=None)
+        weights = [usage_weight(entry, newest) for entry in entries]
+
+        selected = []
+        total = 0.0
+        while entries and total < duration:
+            i = rng.choices(range(len(entries)), weights=weights)[0]
+            entry = entries.pop(i)
+            weights.pop(i)
+            selected.append(entry)
+            total += entry['duration']
+        return selected
@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from moviepy.config import get_setting
+
+from media_index import probe_media
+
+logger = logging.getLogger(__name__)
+
+# 中间格式：固定分辨率、25fps、yuv420p、短 GOP，渲染时无需再缩放或转换帧率
+MEZZANINE_SIZE = (720, 1280)
+MEZZANINE_FPS = 25
+# 转码方式变化时递增，旧版本的中间文件不再使用
+# 2: 与渲染路径相同，直接缩放到目标尺寸（不再等比放大后裁剪）
+MEZZANINE_VERSION = 2
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """计算文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MezzanineCache:
+    """素材的标准化中间文件缓存：上传时在后台转码，渲染时读取转码结果
+
+    清单记录每个源文件的内容哈希、大小和修改时间，源文件变化后旧的中间文件不再使用；
+    缓存总大小超过上限时按最近使用时间淘汰。
+    """
+
+    def __init__(self, cache_dir, size=MEZZANINE_SIZE, fps=MEZZANINE_FPS, max_bytes=20 * 1024 ** 3, workers=1):
+        self.cache_dir = cache_dir
+        self.size = tuple(size)
+        self.fps = fps
+        self.max_bytes = max_bytes
+        self.manifest_path = os.path.join(cache_dir, 'manifest.json')
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='mezzanine')
+        os.makedirs(cache_dir, exist_ok=True)
+        self._manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self):
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _mezzanine_path(self, source_hash):
+        width, height = self.size
+        return os.path.join(self.cache_dir, f"{source_hash}_{width}x{height}_{self.fps}_v{MEZZANINE_VERSION}.mp4")
+
+    def schedule(self, source_path):
+        """提交后台转码任务（已在队列中或缓存有效时跳过）"""
+        key = os.path.abspath(source_path)
+        with self._lock:
+            if key in self._pending or self._is_fresh(key):
+                return None
+            self._pending.add(key)
+        return self._executor.submit(self._transcode, key)
+
+    def _is_fresh(self, key):
+        entry = self._manifest.get(key)
+        if entry is None or entry.get('version') != MEZZANINE_VERSION or not os.path.exists(entry['path']):
+            return False
+        try:
+            stat = os.stat(key)
+        except OSError:
+            return False
+        return entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime
+
+    def _transcode(self, key):
+        try:
+            stat = os.stat(key)
+            source_hash = file_hash(key)
+            output_path = self._mezzanine_path(source_hash)
+
+            # 相同内容的素材只转码一次
+            if not os.path.exists(output_path):
+                width, height = self.size
+                tmp_path = f"{output_path}.tmp.mp4"
+                command = [
+                    get_setting("FFMPEG_BINARY"), '-y', '-hide_banner', '-loglevel', 'error',
+                    '-i', key,
+                    '-an',
+                    # 与渲染时的解码缩放（ScaledVideoReader）和 ffmpeg 引擎一致，直接缩放到目标尺寸
+                    '-vf', f"scale={width}:{height},setsar=1,fps={self.fps},format=yuv420p",
+                    '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '18',
+                    '-g', str(self.fps), '-keyint_min', str(self.fps), '-sc_threshold', '0', '-bf', '0',
+                    '-movflags', '+faststart',
+                    tmp_path
+                ]
+                result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                if result.returncode != 0:
+                    raise Exception(result.stderr.decode('utf-8', errors='ignore')[-1000:])
+                os.replace(tmp_path, output_path)
+
+            info = probe_media(output_path)
+            info.pop('probed_at', None)
+            with self._lock:
+                previous = self._manifest.get(key)
+                self._manifest[key] = {
+                    'version': MEZZANINE_VERSION,
+                    'hash': source_hash,
+                    'path': output_path,
+                    'size': stat.st_size,
+                    'mtime': stat.st_mtime,
+                    'last_used': time.time(),
+                    'info': info,
+                }
+                if previous is not None and previous['path'] != output_path:
+                    self._remove_unreferenced(previous['path'])
+                self._evict()
+                self._save_manifest()
+            logger.info(f"素材转码完成: {key} -> {output_path}")
+            return output_path
+        except Exception as e:
+            logger.error(f"素材转码失败 {key}: {str(e)}")
+            return None
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def resolve(self, source_path, media_index=None, touch=True):
+        """返回可用的中间文件路径；尚未转码或源文件已变化时返回原文件路径
+
+        传入 media_index 时同时登记中间文件的元数据，渲染时无需再探测。
+        touch: 是否更新最近使用时间（只在内存中更新，清单在转码、淘汰或删除时随之写入）；
+        只预览计划时传 False。
+        """
+        key = os.path.abspath(source_path)
+        with self._lock:
+            if not self._is_fresh(key):
+                return source_path
+            entry = self._manifest[key]
+            if touch:
+                entry['last_used'] = time.time()
+        if media_index is not None and entry.get('info'):
+            media_index.add(dict(entry['info'], filepath=entry['path']))
+        return entry['path']
+
+    def discard(self, source_path):
+        """源文件删除时移除对应的缓存"""
+        key = os.path.abspath(source_path)
+        with self._lock:
+            entry = self._manifest.pop(key, None)
+            if entry is None:
+                return
+            self._remove_unreferenced(entry['path'])
+            self._save_manifest()
+
+    def _remove_unreferenced(self, path):
+        """其他源文件内容相同时保留中间文件，否则删除"""
+        if not any(other['path'] == path for other in self._manifest.values()):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _evict(self):
+        """缓存总大小超过上限时，删除最久未使用的中间文件"""
+        files = {}
+        for key, entry in self._manifest.items():
+            if os.path.exists(entry['path']):
+                last_used = max(files.get(entry['path'], 0), entry['last_used'])
+                files[entry['path']] = last_used
+        total = sum(os.path.getsize(path) for path in files)
+
+        for path, _ in sorted(files.items(), key=lambda item: item[1]):
+            if total <= self.max_bytes:
+                break
+            total -= os.path.getsize(path)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            for key in [key for key, entry in self._manifest.items() if entry['path'] == path]:
+                del self._manifest[key]
+            logger.info(f"淘汰素材中间文件: {path}")
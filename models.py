@@ -1,4 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text
 from datetime import datetime
 
 db = SQLAlchemy()
@@ -13,6 +14,38 @@ class VideoMaterial(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_used = db.Column(db.DateTime)  # 最后使用时间
     use_count = db.Column(db.Integer, default=0)  # 使用次数
+    width = db.Column(db.Integer)  # 视频宽度
+    height = db.Column(db.Integer)  # 视频高度
+    fps = db.Column(db.Float)  # 帧率
+    nframes = db.Column(db.Integer)  # 帧数
+    codec = db.Column(db.String(50))  # 视频编码
+    is_valid = db.Column(db.Boolean, default=False)  # 是否为可读的有效视频
+    mtime = db.Column(db.Float)  # 探测时文件的修改时间，用于判断索引是否失效
+    probed_at = db.Column(db.DateTime)  # 最后探测时间
+
+    def update_from_probe(self, info):
+        """用 media_index.probe_media 的结果更新元数据"""
+        for key in ('duration', 'width', 'height', 'fps', 'nframes', 'codec',
+                    'is_valid', 'size', 'mtime', 'probed_at'):
+            setattr(self, key, info.get(key))
+
+    def to_index_entry(self):
+        """转换为 MediaIndex 使用的元数据字典"""
+        return {
+            'id': self.id,
+            'filepath': self.filepath,
+            'duration': self.duration,
+            'width': self.width,
+            'height': self.height,
+            'fps': self.fps,
+            'nframes': self.nframes,
+            'codec': self.codec,
+            'is_valid': bool(self.is_valid),
+            'size': self.size,
+            'mtime': self.mtime,
+            'use_count': self.use_count or 0,
+            'last_used': self.last_used,
+        }
 
 class MusicMaterial(db.Model):
     """音乐素材模型"""
@@ -24,6 +57,18 @@ class MusicMaterial(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_used = db.Column(db.DateTime)  # 最后使用时间
     use_count = db.Column(db.Integer, default=0)  # 使用次数
+    mtime = db.Column(db.Float)  # 分析时文件的修改时间，用于判断响度数据是否失效
+    loudness = db.Column(db.Float)  # 整体响度（LUFS）
+    peak = db.Column(db.Float)  # 真峰值（dBTP）
+    gain = db.Column(db.Float)  # 混音时使用的线性增益
+    analyzed_at = db.Column(db.DateTime)  # 最后分析时间
+
+    def update_from_loudness(self, info, gain):
+        """用 loudness.analyze_loudness 的结果和计算出的增益更新记录"""
+        self.loudness = info.get('loudness')
+        self.peak = info.get('peak')
+        self.gain = gain
+        self.analyzed_at = datetime.utcnow()
 
 class GeneratedVideo(db.Model):
     """生成的视频记录"""
@@ -34,4 +79,20 @@ class GeneratedVideo(db.Model):
     voice_type = db.Column(db.String(50))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     duration = db.Column(db.Float)  # 视频时长（秒）
-    size = db.Column(db.Integer)     # 文件大小（字节） 
\ No newline at end of file
+    size = db.Column(db.Integer)     # 文件大小（字节）
+
+
+def ensure_columns():
+    """为已存在的数据表补充新增的列（create_all 不会修改旧表）"""
+    inspector = inspect(db.engine)
+    for model in (VideoMaterial, MusicMaterial, GeneratedVideo):
+        table = model.__table__
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
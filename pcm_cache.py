@@ -0,0 +1,90 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+
+import numpy as np
+
+from audio_mixer import decode_pcm, SAMPLE_RATE, CHANNELS
+
+logger = logging.getLogger(__name__)
+
+
+class PCMCache:
+    """背景音乐解码缓存：每个音频文件只解码一次为 float32 PCM，混音时内存映射读取
+
+    缓存文件以源文件绝对路径的哈希命名，旁边的 JSON 记录源文件的大小和修改时间，
+    源文件变化后重新解码并覆盖旧缓存。
+    """
+
+    def __init__(self, cache_dir, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+        self.cache_dir = cache_dir
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self._lock = threading.Lock()
+
+    def _paths(self, source_path):
+        name = hashlib.sha256(os.path.abspath(source_path).encode('utf-8')).hexdigest()
+        base = os.path.join(self.cache_dir, name)
+        return f"{base}.f32", f"{base}.json"
+
+    def _signature(self, source_path):
+        stat = os.stat(source_path)
+        return {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sample_rate': self.sample_rate,
+            'channels': self.channels,
+        }
+
+    def is_fresh(self, source_path):
+        pcm_path, meta_path = self._paths(source_path)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        return os.path.exists(pcm_path) and meta == self._signature(source_path)
+
+    def warm(self, source_path):
+        """确保缓存存在且有效，必要时解码，返回 PCM 缓存文件路径"""
+        pcm_path, meta_path = self._paths(source_path)
+        if self.is_fresh(source_path):
+            return pcm_path
+
+        with self._lock:
+            if self.is_fresh(source_path):
+                return pcm_path
+            os.makedirs(self.cache_dir, exist_ok=True)
+            signature = self._signature(source_path)
+            pcm = decode_pcm(source_path, self.sample_rate, self.channels)
+
+            # 先写临时文件再原子替换，其他进程正在映射的旧文件不受影响
+            tmp_path = f"{pcm_path}.{os.getpid()}.tmp"
+            pcm.tofile(tmp_path)
+            os.replace(tmp_path, pcm_path)
+            tmp_meta = f"{meta_path}.{os.getpid()}.tmp"
+            with open(tmp_meta, 'w', encoding='utf-8') as f:
+                json.dump(signature, f)
+            os.replace(tmp_meta, meta_path)
+            logger.info(f"背景音乐解码缓存完成: {source_path} -> {pcm_path}")
+        return pcm_path
+
+    def load(self, source_path):
+        """返回只读内存映射的 PCM 数组，形状为 (采样数, 声道数)"""
+        pcm_path = self.warm(source_path)
+        if os.path.getsize(pcm_path) == 0:
+            return np.zeros((0, self.channels), dtype=np.float32)
+        return np.memmap(pcm_path, dtype=np.float32, mode='r').reshape(-1, self.channels)
+
+    def discard(self, source_path):
+        """源文件删除时移除对应的缓存"""
+        for path in self._paths(source_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+default_pcm_cache = PCMCache(os.path.join('uploads', 'bgm_cache'))
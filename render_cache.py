@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class RenderCache:
+    """按渲染计划哈希寻址的成品缓存：相同计划的请求直接返回 output 目录中已有的视频
+
+    清单记录每个键对应的成品、各输出规格和字幕文件；总大小超过 max_bytes 或超过 max_age 秒
+    未使用的条目连同其文件一起淘汰。命中和未命中次数随清单持久化。
+    另外记录每个请求渲染出的变体键：选片随素材使用情况变化，重复的请求按记录返回原来的成品。
+    """
+
+    def __init__(self, cache_dir, max_bytes=50 * 1024 ** 3, max_age=30 * 24 * 3600):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.manifest_path = os.path.join(cache_dir, 'manifest.json')
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        manifest.setdefault('entries', {})
+        manifest.setdefault('requests', {})
+        manifest.setdefault('hits', 0)
+        manifest.setdefault('misses', 0)
+        return manifest
+
+    def _save_manifest(self):
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def peek(self, key):
+        """检查是否命中，不更新计数和使用时间"""
+        with self._lock:
+            entry = self._manifest['entries'].get(key)
+            return entry is not None and self._files_exist(entry)
+
+    def get(self, key):
+        """命中时返回 (成品路径, 字幕路径列表, {规格名: 文件路径})，否则返回 None"""
+        with self._lock:
+            entry = self._manifest['entries'].get(key)
+            if entry is not None and not self._files_exist(entry):
+                # 成品已被手动删除
+                del self._manifest['entries'][key]
+                entry = None
+            if entry is None:
+                self._manifest['misses'] += 1
+                self._save_manifest()
+                return None
+            entry['last_used'] = time.time()
+            entry['hits'] = entry.get('hits', 0) + 1
+            self._manifest['hits'] += 1
+            self._save_manifest()
+        logger.info(f"渲染缓存命中: {key}")
+        return entry['output_path'], list(entry['subtitle_paths']), dict(entry.get('renditions', {}))
+
+    def put(self, key, output_path, subtitle_paths, renditions=None):
+        """登记渲染完成的成品，renditions 为 {规格名: 文件路径}"""
+        renditions = dict(renditions or {})
+        files = set([output_path] + list(subtitle_paths) + list(renditions.values()))
+        size = sum(os.path.getsize(path) for path in files if os.path.exists(path))
+        now = time.time()
+        with self._lock:
+            self._manifest['entries'][key] = {
+                'output_path': output_path,
+                'subtitle_paths': list(subtitle_paths),
+                'renditions': renditions,
+                'size': size,
+                'created_at': now,
+                'last_used': now,
+                'hits': 0,
+            }
+            self._evict()
+            self._save_manifest()
+
+    def remember(self, request_key, keys):
+        """记录请求渲染出的变体键"""
+        with self._lock:
+            self._manifest['requests'][request_key] = list(keys)
+            self._save_manifest()
+
+    def recall(self, request_key):
+        """返回请求之前渲染出的变体键，没有记录时返回 None"""
+        with self._lock:
+            keys = self._manifest['requests'].get(request_key)
+            return list(keys) if keys is not None else None
+
+    def stats(self):
+        with self._lock:
+            entries = self._manifest['entries']
+            hits, misses = self._manifest['hits'], self._manifest['misses']
+            return {
+                'entries': len(entries),
+                'bytes': sum(entry['size'] for entry in entries.values()),
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+            }
+
+    @staticmethod
+    def _entry_files(entry):
+        files = [entry['output_path']] + entry['subtitle_paths'] + list(entry.get('renditions', {}).values())
+        return list(dict.fromkeys(files))
+
+    @classmethod
+    def _files_exist(cls, entry):
+        return all(os.path.exists(path) for path in cls._entry_files(entry))
+
+    def _evict(self):
+        """删除过期条目，再按最近使用时间淘汰到容量以内"""
+        entries = self._manifest['entries']
+        now = time.time()
+        expired = [key for key, entry in entries.items() if now - entry['last_used'] > self.max_age]
+        total = sum(entry['size'] for entry in entries.values())
+        for key, entry in sorted(entries.items(), key=lambda item: item[1]['last_used']):
+            if key not in expired and total <= self.max_bytes:
+                continue
+            for path in self._entry_files(entry):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= entry['size']
+            del entries[key]
+            logger.info(f"淘汰渲染缓存: {key}")
+        # 变体已全部淘汰的请求记录不再有用
+        requests = self._manifest['requests']
+        for request_key in [k for k, keys in requests.items() if not any(key in entries for key in keys)]:
+            del requests[request_key]
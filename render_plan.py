@@ -0,0 +1,161 @@
+import os
+import json
+import random
+import hashlib
+
+from media_index import file_signature
+
+# 计划格式或渲染逻辑变化时递增，旧的渲染缓存随之失效
+PLAN_VERSION = 3
+
+# 语音尚未合成时估算时长用的语速（edge-tts 在 +20% 语速下约每秒 5 个汉字）
+ESTIMATED_CHARS_PER_SECOND = 5.0
+
+# 选片时在估算的语音时长上多留的比例，实际语音稍长时也不必循环素材
+SELECTION_MARGIN = 1.15
+
+# 影响成品内容的任务参数，计入渲染缓存键
+RENDER_PARAMS = (
+    'text', 'voice', 'tts_engine', 'subtitle_length', 'font', 'render_engine',
+    'subtitle_mode', 'segments', 'resolution', 'renditions', 'stream_threshold', 'stream_window',
+)
+
+
+def _digest(payload):
+    data = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def derive_seed(params):
+    """未指定种子时由请求参数推导，相同的请求得到相同的选片结果"""
+    return int(_digest(params)[:8], 16)
+
+
+def request_key(params):
+    """整个请求（参数和种子）的键，记录该请求渲染出的变体，重复请求时原样返回"""
+    return _digest({'version': PLAN_VERSION, 'params': params})
+
+
+def fingerprint(path):
+    """文件的路径、大小和修改时间；文件变化后依赖它的缓存结果随之失效"""
+    try:
+        size, mtime = file_signature(path)
+    except OSError:
+        return None
+    return {'path': os.path.abspath(path), 'size': size, 'mtime': mtime}
+
+
+def build_render_plan(seed, params, video_count, bgm_category_path, bgm_files, select_clips, gain_for,
+                      resolve_sources, assets=()):
+    """用带种子的随机数生成器确定每个变体的背景音乐和素材，返回可序列化的渲染计划
+
+    select_clips(rng): 按给定随机数生成器选择素材路径；gain_for(path): 背景音乐的增益；
+    resolve_sources(clip_paths): 返回 (输出尺寸, 渲染实际读取的文件列表)，如已转码的中间文件；
+    assets: 水印、尾板等所有变体共用的文件。
+    """
+    rng = random.Random(seed)
+    variants = []
+    for _ in range(video_count):
+        bgm_path = os.path.join(bgm_category_path, rng.choice(sorted(bgm_files)))
+        clip_paths = select_clips(rng)
+        size, source_paths = resolve_sources(clip_paths)
+        variants.append({
+            'bgm': fingerprint(bgm_path),
+            'bgm_gain': gain_for(bgm_path),
+            'clips': [fingerprint(path) for path in clip_paths],
+            'size': list(size),
+            'sources': [fingerprint(path) for path in source_paths],
+        })
+    return {
+        'version': PLAN_VERSION,
+        'seed': seed,
+        'params': {name: params.get(name) for name in RENDER_PARAMS},
+        'assets': [fingerprint(path) for path in assets if os.path.exists(path)],
+        'variants': variants,
+    }
+
+
+def variant_key(plan, index):
+    """单个变体的内容地址：参数、共用文件、该变体选中的素材、输出尺寸和实际读取的文件都相同时输出相同
+
+    时间线由这些输入和语音决定，时间线本身不计入键（预览时的估算时间线与实际渲染得到相同的键）；
+    素材改用中间文件后读取的文件不同，得到新的键。
+    """
+    variant = plan['variants'][index]
+    return _digest({
+        'version': plan['version'],
+        'params': plan['params'],
+        'assets': plan['assets'],
+        'variant': {name: variant[name] for name in ('bgm', 'bgm_gain', 'clips', 'size', 'sources')},
+    })
+
+
+def layout_clips(clips, duration):
+    """把素材按顺序循环排布到 duration 秒，返回时间线片段列表
+
+    clips: [{'id', 'path', 'duration'}, ...]；每个片段记录素材在成品中的 [start, end) 区间、
+    素材内的入点/出点和所在的循环轮次，最后一个片段截断到 duration。
+    """
+    usable = [clip for clip in clips if clip['duration'] and clip['duration'] > 0]
+    if not usable:
+        raise ValueError("视频素材总时长为0")
+
+    segments = []
+    position = 0.0
+    i = 0
+    while position < duration:
+        clip = usable[i % len(usable)]
+        length = min(clip['duration'], duration - position)
+        segments.append({
+            'clip': clip['id'],
+            'path': clip['path'],
+            'in': 0.0,
+            'out': length,
+            'start': position,
+            'end': position + length,
+            'loop': i // len(usable),
+        })
+        position += length
+        i += 1
+    return segments
+
+
+def estimate_duration(text, chars_per_second=ESTIMATED_CHARS_PER_SECOND):
+    """按固定语速估算语音时长（秒）"""
+    return sum(1 for char in text if not char.isspace()) / chars_per_second
+
+
+def estimate_word_timings(text, chars_per_second):
+    """语音尚未合成时按固定语速估算逐字时间戳（用于预览时间线）"""
+    step = 1 / chars_per_second
+    words = [char for char in text if not char.isspace()]
+    return [
+        {"text": word, "start": i * step, "end": (i + 1) * step}
+        for i, word in enumerate(words)
+    ]
+
+
+def build_timeline(variant, clips, video_size, duration, subtitle_timings, watermark_path=None,
+                   endboard_path=None, bgm_offset=0.0):
+    """由变体的选片结果和语音时长生成完整时间线，渲染时直接按它组装画面和音轨
+
+    clips: 渲染实际读取的素材 [{'id', 'path', 'duration'}, ...]（可能是转码后的中间文件）
+    """
+    segments = layout_clips(clips, duration)
+    return {
+        'size': list(video_size),
+        'duration': duration,
+        'segments': segments,
+        'loops': segments[-1]['loop'] + 1,
+        'bgm': {
+            'path': variant['bgm']['path'],
+            'gain': variant['bgm_gain'],
+            'offset': bgm_offset,
+        },
+        'subtitles': [
+            {"text": timing["text"], "start": timing["start"], "end": timing["end"]}
+            for timing in subtitle_timings
+        ],
+        'watermark': watermark_path,
+        'endboard': endboard_path,
+    }
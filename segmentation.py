@@ -0,0 +1,130 @@
+"""把 edge-tts 的 WordBoundary 时间戳切分为字幕段
+
+逐字累积时只维护非标点字数的计数，不再对整段文本重复执行正则替换，总耗时与输入长度成线性关系。
+输出与原 text_to_speech 中的分段逻辑逐条一致。
+"""
+
+# 显示字幕时移除、且不计入字数的标点
+SUBTITLE_PUNCTUATION = '，。！？、："'
+# 句末标点
+END_PUNCTUATION = '。！？'
+
+_STRIP_TABLE = str.maketrans('', '', SUBTITLE_PUNCTUATION)
+
+
+def strip_punctuation(text):
+    return text.translate(_STRIP_TABLE)
+
+
+def segment_word_timings(word_timings, subtitle_length):
+    """按字幕长度把逐词时间戳合并为字幕段，返回 [{"text", "start", "end"}, ...]
+
+    规则：
+    - 非标点字数达到 subtitle_length，或遇到句末标点且达到最小长度，或到达最后一个词时断句；
+    - 超过 subtitle_length 的段按长度切开，时间按字数比例分配；
+    - 不足最小长度的段放入缓冲区，与后面的词合并。
+    """
+    min_segment_length = max(subtitle_length // 3, 4)
+    result = []
+    if not word_timings:
+        return result
+
+    # 当前段和缓冲区共用一个词列表：进入缓冲状态后，新词只追加到缓冲区，
+    # 当前段保持进入缓冲时的前 stale_parts 个词（与原实现中未更新的 current_segment 一致）
+    parts = []
+    parts_chars = 0         # parts 的原始字符数（含标点）
+    parts_count = 0         # parts 的非标点字数
+    buffered = False
+    stale_parts = 0
+    stale_chars = 0
+    stale_count = 0
+    segment_start = None
+    buffer_start = None
+    last_index = len(word_timings) - 1
+
+    for i, word in enumerate(word_timings):
+        text = word["text"]
+        count = len(strip_punctuation(text))
+
+        if buffered:
+            parts.append(text)
+            parts_chars += len(text)
+            parts_count += count
+            if parts_count >= min_segment_length:
+                # 缓冲区达到最小长度，整体成为当前段
+                buffered = False
+                segment_start = buffer_start
+                buffer_start = None
+        else:
+            parts.append(text)
+            parts_chars += len(text)
+            parts_count += count
+            if segment_start is None:
+                segment_start = word["start"]
+
+        if buffered:
+            current_length = stale_count
+        else:
+            current_length = parts_count
+
+        is_end_punctuation = any(p in text for p in END_PUNCTUATION)
+        is_last_word = i == last_index
+
+        if (current_length >= subtitle_length or
+                (is_end_punctuation and current_length >= min_segment_length) or
+                is_last_word):
+
+            current_parts = parts[:stale_parts] if buffered else parts
+            clean_segment = strip_punctuation(''.join(current_parts))
+
+            if len(clean_segment) > subtitle_length:
+                total_length = len(clean_segment)
+                total_duration = word["end"] - segment_start
+                for j in range(0, total_length, subtitle_length):
+                    sub_segment = clean_segment[j:j + subtitle_length]
+                    if len(sub_segment) < min_segment_length and j + subtitle_length < total_length:
+                        continue
+                    sub_duration = (total_duration * len(sub_segment)) / total_length
+                    sub_start = segment_start + (j / total_length) * total_duration
+                    result.append({
+                        "text": sub_segment,
+                        "start": sub_start,
+                        "end": sub_start + sub_duration - 0.1
+                    })
+            elif len(clean_segment) < min_segment_length and not is_last_word:
+                # 段落太短，放入缓冲区（缓冲区内容替换为当前段）
+                if buffered:
+                    del parts[stale_parts:]
+                    parts_chars = stale_chars
+                    parts_count = stale_count
+                buffer_start = segment_start
+                if parts_chars:
+                    buffered = True
+                    stale_parts = len(parts)
+                    stale_chars = parts_chars
+                    stale_count = parts_count
+            else:
+                result.append({
+                    "text": clean_segment,
+                    "start": segment_start,
+                    "end": word["end"] - 0.1
+                })
+
+            # 没有缓冲内容时开始新的一段
+            if not buffered:
+                parts = []
+                parts_chars = 0
+                parts_count = 0
+                segment_start = None
+
+    # 处理最后的缓冲区内容
+    if buffered:
+        clean_buffer = strip_punctuation(''.join(parts))
+        if clean_buffer:
+            result.append({
+                "text": clean_buffer,
+                "start": buffer_start,
+                "end": word_timings[-1]["end"] - 0.1
+            })
+
+    return result
@@ -0,0 +1,264 @@
+import os
+import bisect
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from moviepy.video.VideoClip import VideoClip
+
+from compositor import Overlay
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts", "msyh.ttc")
+
+# 默认字幕样式：白色文字、黑色描边
+DEFAULT_STYLE = {
+    'fill': (255, 255, 255, 255),
+    'stroke_fill': (0, 0, 0, 255),
+    'stroke_width': 3,
+}
+
+
+@lru_cache(maxsize=16)
+def load_font(font_path, font_size):
+    """加载字体（每个字体文件和字号只从磁盘读取一次）"""
+    return ImageFont.truetype(font_path, font_size)
+
+
+class SubtitleRenderer:
+    """字幕贴图渲染器：贴图裁剪到文字包围盒，并按 (文本, 字体, 字号, 样式) 缓存"""
+
+    def __init__(self, max_bytes=256 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self._sprites = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def render(self, text, font_path=DEFAULT_FONT_PATH, font_size=45, style=None):
+        """返回 (RGBA 贴图, 贴图左上角相对文字绘制原点的偏移, 不含描边的文字宽度)"""
+        style = dict(DEFAULT_STYLE, **(style or {}))
+        key = (text, font_path, font_size, tuple(sorted(style.items())))
+
+        with self._lock:
+            sprite = self._sprites.get(key)
+            if sprite is not None:
+                self._sprites.move_to_end(key)
+                return sprite
+
+        sprite = self._draw(text, font_path, font_size, style)
+
+        with self._lock:
+            if key not in self._sprites:
+                self._sprites[key] = sprite
+                self._bytes += sprite[0].nbytes
+                while self._bytes > self.max_bytes and len(self._sprites) > 1:
+                    _, evicted = self._sprites.popitem(last=False)
+                    self._bytes -= evicted[0].nbytes
+        return sprite
+
+    def _draw(self, text, font_path, font_size, style):
+        font = load_font(font_path, font_size)
+        stroke_width = style['stroke_width']
+
+        measure = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+        text_box = measure.textbbox((0, 0), text, font=font)
+        left, top, right, bottom = measure.textbbox((0, 0), text, font=font, stroke_width=stroke_width)
+
+        # 只分配文字包围盒大小的图片，描边一次绘制完成
+        img = Image.new("RGBA", (max(right - left, 1), max(bottom - top, 1)), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(img)
+        draw.text(
+            (-left, -top),
+            text,
+            font=font,
+            fill=style['fill'],
+            stroke_width=stroke_width,
+            stroke_fill=style['stroke_fill']
+        )
+        return np.array(img), (left, top), text_box[2] - text_box[0]
+
+    def layout(self, text, video_size, font_path=DEFAULT_FONT_PATH, font_size=45, style=None):
+        """渲染贴图并计算其在画面中的位置（水平居中，文字顶部位于画面一半高度）"""
+        sprite, (offset_x, offset_y), text_width = self.render(text, font_path, font_size, style)
+        origin_x = (video_size[0] - text_width) // 2
+        origin_y = int(video_size[1] * 0.5)
+        return sprite, (origin_x + offset_x, origin_y + offset_y)
+
+
+def _sorted_timings(subtitle_timings):
+    """按开始时间排序并去掉时长为零或负数的字幕"""
+    return sorted(
+        (timing for timing in subtitle_timings if timing["end"] > timing["start"]),
+        key=lambda timing: timing["start"]
+    )
+
+
+def format_srt_time(seconds):
+    milliseconds = int(round(max(seconds, 0) * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
+
+
+def format_ass_time(seconds):
+    centiseconds = int(round(max(seconds, 0) * 100))
+    hours, centiseconds = divmod(centiseconds, 360000)
+    minutes, centiseconds = divmod(centiseconds, 6000)
+    seconds, centiseconds = divmod(centiseconds, 100)
+    return f"{hours:d}:{minutes:02d}:{seconds:02d}.{centiseconds:02d}"
+
+
+def _ass_color(rgba):
+    """RGBA 转 ASS 颜色 &HAABBGGRR（ASS 的 alpha 0 表示不透明）"""
+    r, g, b, a = rgba
+    return f"&H{255 - a:02X}{b:02X}{g:02X}{r:02X}"
+
+
+def write_srt(subtitle_timings, path):
+    """导出 SRT 字幕文件"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for i, timing in enumerate(_sorted_timings(subtitle_timings), 1):
+            f.write(f"{i}\n{format_srt_time(timing['start'])} --> {format_srt_time(timing['end'])}\n")
+            f.write(f"{timing['text'].strip()}\n\n")
+    return path
+
+
+def write_ass(subtitle_timings, path, video_size, font_path=DEFAULT_FONT_PATH, font_size=45, style=None):
+    """导出 ASS 字幕文件，字体、描边和位置与 PIL 渲染的字幕一致（水平居中，顶部位于画面一半高度）"""
+    style = dict(DEFAULT_STYLE, **(style or {}))
+    width, height = video_size
+    try:
+        font_name = load_font(font_path, font_size).getname()[0]
+    except OSError:
+        font_name = os.path.splitext(os.path.basename(font_path))[0]
+
+    lines = [
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        f"PlayResX: {width}",
+        f"PlayResY: {height}",
+        "WrapStyle: 2",
+        "ScaledBorderAndShadow: yes",
+        "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, "
+        "Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, "
+        "Alignment, MarginL, MarginR, MarginV, Encoding",
+        f"Style: Default,{font_name},{font_size},{_ass_color(style['fill'])},{_ass_color(style['fill'])},"
+        f"{_ass_color(style['stroke_fill'])},&H00000000,0,0,0,0,100,100,0,0,1,{style['stroke_width']},0,"
+        f"8,0,0,0,1",
+        "",
+        "[Events]",
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+    ]
+    position = f"{{\\an8\\pos({width // 2},{int(height * 0.5)})}}"
+    for timing in _sorted_timings(subtitle_timings):
+        text = timing["text"].strip().replace("{", "(").replace("}", ")").replace("\n", " ")
+        lines.append(
+            f"Dialogue: 0,{format_ass_time(timing['start'])},{format_ass_time(timing['end'])},"
+            f"Default,,0,0,0,,{position}{text}"
+        )
+
+    with open(path, 'w', encoding='utf-8-sig') as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+
+# 进程内共享，/generate 的多个变体复用同一批字幕贴图
+default_renderer = SubtitleRenderer()
+
+
+class SubtitleTrackClip(VideoClip):
+    """单一字幕轨道：按开始时间排序建立区间索引，逐帧二分查找当前字幕
+
+    与把几百个 ImageClip 交给 CompositeVideoClip 不同，每帧的开销与字幕条数无关。
+    字幕在首次显示时才渲染，只保留最近使用的少量整帧图层。
+    """
+
+    def __init__(self, subtitle_timings, size, duration, renderer=None,
+                 font_path=DEFAULT_FONT_PATH, font_size=45, style=None, cache_size=8):
+        timings = _sorted_timings(subtitle_timings)
+        self.timings = timings
+        self.starts = [timing["start"] for timing in timings]
+        self.renderer = renderer or default_renderer
+        self.font_path = font_path
+        self.font_size = font_size
+        self.style = style
+        self.cache_size = cache_size
+        self._layers = OrderedDict()
+        self._overlays = OrderedDict()
+
+        width, height = size
+        self._blank = (np.zeros((height, width, 3), dtype=np.uint8),
+                       np.zeros((height, width), dtype=np.float64))
+
+        VideoClip.__init__(self, make_frame=lambda t: self._layer_at(t)[0], duration=duration)
+        self.mask = VideoClip(make_frame=lambda t: self._layer_at(t)[1], ismask=True, duration=duration)
+
+    def active_index(self, t):
+        """返回 t 时刻正在显示的字幕下标，没有则返回 None"""
+        i = bisect.bisect_right(self.starts, t) - 1
+        if i >= 0 and t < self.timings[i]["end"]:
+            return i
+        return None
+
+    def _layer_at(self, t):
+        i = self.active_index(t)
+        if i is None:
+            return self._blank
+
+        layer = self._layers.get(i)
+        if layer is not None:
+            self._layers.move_to_end(i)
+            return layer
+
+        layer = self._rasterize(self.timings[i]["text"].strip())
+        self._layers[i] = layer
+        if len(self._layers) > self.cache_size:
+            self._layers.popitem(last=False)
+        return layer
+
+    def overlay_at(self, t):
+        """返回 t 时刻字幕的预乘贴图（Overlay，只含文字包围盒），没有字幕时返回 None"""
+        i = self.active_index(t)
+        if i is None:
+            return None
+
+        overlay = self._overlays.get(i)
+        if overlay is not None:
+            self._overlays.move_to_end(i)
+            return overlay
+
+        height, width = self._blank[1].shape
+        sprite, position = self.renderer.layout(
+            self.timings[i]["text"].strip(), (width, height), self.font_path, self.font_size, self.style
+        )
+        overlay = Overlay(sprite, position, frame_size=(width, height))
+        self._overlays[i] = overlay
+        if len(self._overlays) > self.cache_size:
+            self._overlays.popitem(last=False)
+        return overlay
+
+    def _rasterize(self, text):
+        """把字幕贴图放到整帧大小的 RGB 图层和蒙版上"""
+        height, width = self._blank[1].shape
+        sprite, (x, y) = self.renderer.layout(
+            text, (width, height), self.font_path, self.font_size, self.style
+        )
+        frame = np.zeros((height, width, 3), dtype=np.uint8)
+        mask = np.zeros((height, width), dtype=np.float64)
+
+        # 裁剪超出画面的部分
+        x0, y0 = max(x, 0), max(y, 0)
+        x1 = min(x + sprite.shape[1], width)
+        y1 = min(y + sprite.shape[0], height)
+        if x1 > x0 and y1 > y0:
+            region = sprite[y0 - y:y1 - y, x0 - x:x1 - x]
+            frame[y0:y1, x0:x1] = region[:, :, :3]
+            mask[y0:y1, x0:x1] = region[:, :, 3] / 255.0
+        return frame, mask
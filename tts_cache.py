@@ -0,0 +1,97 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class NarrationCache:
+    """按 (文本, 语音, 语速) 内容寻址的配音缓存，超出容量时按最近使用时间淘汰"""
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(text, voice, rate):
+        payload = json.dumps([text, voice, rate], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _paths(self, key):
+        return (os.path.join(self.cache_dir, f"{key}.mp3"),
+                os.path.join(self.cache_dir, f"{key}.json"))
+
+    def lookup(self, key):
+        """只读查询：命中时返回 (缓存音频路径, 逐字时间戳)，不复制文件；未命中返回 None"""
+        audio_path, timings_path = self._paths(key)
+        with self._lock:
+            if not (os.path.exists(audio_path) and os.path.exists(timings_path)):
+                return None
+            try:
+                with open(timings_path, 'r', encoding='utf-8') as f:
+                    return audio_path, json.load(f)
+            except (OSError, ValueError):
+                return None
+
+    def get(self, key, output_path):
+        """命中时把缓存的音频复制到 output_path，并返回逐字时间戳；未命中返回 None"""
+        audio_path, timings_path = self._paths(key)
+        with self._lock:
+            if not (os.path.exists(audio_path) and os.path.exists(timings_path)):
+                return None
+            try:
+                with open(timings_path, 'r', encoding='utf-8') as f:
+                    word_timings = json.load(f)
+                shutil.copyfile(audio_path, output_path)
+            except (OSError, ValueError) as e:
+                logger.warning(f"读取配音缓存失败 {key}: {str(e)}")
+                return None
+            # 更新访问时间，供 LRU 淘汰使用
+            now = time.time()
+            for path in (audio_path, timings_path):
+                os.utime(path, (now, now))
+        logger.info(f"配音缓存命中: {key}")
+        return word_timings
+
+    def put(self, key, audio_path, word_timings):
+        """把生成的音频和逐字时间戳写入缓存"""
+        cached_audio, cached_timings = self._paths(key)
+        with self._lock:
+            tmp_audio = f"{cached_audio}.tmp"
+            tmp_timings = f"{cached_timings}.tmp"
+            shutil.copyfile(audio_path, tmp_audio)
+            with open(tmp_timings, 'w', encoding='utf-8') as f:
+                json.dump(word_timings, f, ensure_ascii=False)
+            os.replace(tmp_audio, cached_audio)
+            os.replace(tmp_timings, cached_timings)
+            self._evict()
+
+    def _evict(self):
+        """总大小超过上限时，删除最久未使用的条目"""
+        entries = {}
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            key, ext = os.path.splitext(name)
+            if ext not in ('.mp3', '.json'):
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, name))
+            size, last_used = entries.get(key, (0, 0))
+            entries[key] = (size + stat.st_size, max(last_used, stat.st_mtime))
+            total += stat.st_size
+
+        for key, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+            if total <= self.max_bytes:
+                break
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+            logger.info(f"淘汰配音缓存: {key}")
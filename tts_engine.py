@@ -0,0 +1,191 @@
+import os
+import asyncio
+import logging
+
+import edge_tts
+from moviepy.config import get_setting
+
+logger = logging.getLogger(__name__)
+
+# edge-tts 的时间单位为 100 纳秒
+TICKS_PER_SECOND = 10000000
+
+# MPEG 音频帧头解析表
+_MP3_BITRATES = {
+    # (版本, 层) -> kbps 列表
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLE_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 2.5: [11025, 12000, 8000]}
+
+
+def mp3_duration(path):
+    """逐帧解析 MP3 帧头，返回精确时长（秒）
+
+    按字节拼接的 MP3 解码后的时长等于各文件帧时长之和，用它计算分块时间戳的偏移量。
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    pos = 0
+    # 跳过 ID3v2 标签
+    if data[:3] == b'ID3' and len(data) >= 10:
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        pos = 10 + size
+
+    duration = 0.0
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF or (data[pos + 1] & 0xE0) != 0xE0:
+            pos += 1
+            continue
+        version_bits = (data[pos + 1] >> 3) & 0x03
+        layer_bits = (data[pos + 1] >> 1) & 0x03
+        bitrate_index = data[pos + 2] >> 4
+        rate_index = (data[pos + 2] >> 2) & 0x03
+        padding = (data[pos + 2] >> 1) & 0x01
+        if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or rate_index == 3:
+            pos += 1
+            continue
+
+        version = {3: 1, 2: 2, 0: 2.5}[version_bits]
+        layer = 4 - layer_bits
+        bitrate = _MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+        sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+
+        if layer == 1:
+            samples = 384
+            frame_length = (12 * bitrate // sample_rate + padding) * 4
+        else:
+            samples = 1152 if (layer == 2 or version == 1) else 576
+            frame_length = samples // 8 * bitrate // sample_rate + padding
+
+        duration += samples / sample_rate
+        pos += frame_length
+    return duration
+
+
+class EdgeTTSEngine:
+    """edge-tts 语音合成：在同一次 stream 中写入音频并收集逐字时间戳"""
+
+    # 配音缓存键的命名空间，不同引擎生成的音频互不复用
+    cache_namespace = ''
+
+    async def synthesize(self, text, voice, rate, output_path):
+        communicate = edge_tts.Communicate(text, voice, rate=rate)
+
+        word_timings = []
+        word_start = 0
+        with open(output_path, "wb") as audio_file:
+            async for chunk in communicate.stream():
+                if chunk["type"] == "audio":
+                    audio_file.write(chunk["data"])
+                elif chunk["type"] == "WordBoundary":
+                    word_timings.append({
+                        "text": chunk["text"],
+                        "start": word_start / TICKS_PER_SECOND,
+                        "end": chunk["offset"] / TICKS_PER_SECOND
+                    })
+                    word_start = chunk["offset"]
+
+        return word_timings
+
+
+class StubTTSEngine:
+    """本地假语音合成：按固定语速生成静音 MP3 和逐字时间戳，供测试和基准使用
+
+    latency: 每次调用模拟的固定延迟（秒），latency_per_char: 按字数增加的延迟，chars_per_second: 模拟语速
+    """
+
+    cache_namespace = 'stub'
+
+    def __init__(self, chars_per_second=5.0, latency=0.0, latency_per_char=0.0):
+        self.chars_per_second = chars_per_second
+        self.latency = latency
+        self.latency_per_char = latency_per_char
+
+    async def synthesize(self, text, voice, rate, output_path):
+        delay = self.latency + self.latency_per_char * len(text)
+        if delay:
+            await asyncio.sleep(delay)
+
+        words = [char for char in text if not char.isspace()]
+        duration = max(len(words), 1) / self.chars_per_second
+        # 与 edge-tts 相同的 24kHz 单声道 48kbps 格式，不写 Xing 头以便按字节拼接
+        command = [
+            get_setting("FFMPEG_BINARY"), '-y', '-loglevel', 'error',
+            '-f', 'lavfi', '-i', 'anullsrc=r=24000:cl=mono',
+            '-t', f'{duration:.3f}',
+            '-c:a', 'libmp3lame', '-b:a', '48k', '-write_xing', '0', '-id3v2_version', '0',
+            '-f', 'mp3', output_path
+        ]
+        process = await asyncio.create_subprocess_exec(
+            *command, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+        )
+        _, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise Exception(f"生成测试语音失败: {stderr.decode('utf-8', errors='ignore')[-500:]}")
+
+        step = 1 / self.chars_per_second
+        return [
+            {"text": word, "start": i * step, "end": (i + 1) * step}
+            for i, word in enumerate(words)
+        ]
+
+
+def create_tts_engine(name='edge', **options):
+    """按名称创建语音合成引擎：edge 或 stub"""
+    if name == 'edge':
+        return EdgeTTSEngine()
+    if name == 'stub':
+        return StubTTSEngine(**options)
+    raise ValueError(f"不支持的语音合成引擎: {name}")
+
+
+async def synthesize_chunks(engine, chunks, voice, rate, output_path, max_concurrency=4, retries=2):
+    """并发合成多个文本块，按顺序拼接音频并平移逐字时间戳
+
+    每块最多重试 retries 次，单块失败不影响已完成的其他块；全部完成后按字节拼接 MP3。
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    chunk_paths = [f"{output_path}.part{i:04d}" for i in range(len(chunks))]
+
+    async def run(index):
+        async with semaphore:
+            for attempt in range(retries + 1):
+                try:
+                    return await engine.synthesize(chunks[index], voice, rate, chunk_paths[index])
+                except Exception as e:
+                    if attempt == retries:
+                        raise
+                    logger.warning(f"第 {index + 1}/{len(chunks)} 块语音合成失败，重试: {str(e)}")
+                    await asyncio.sleep(2 ** attempt)
+
+    try:
+        # 等所有块结束后再处理失败，避免清理临时文件时仍有块在写入
+        results = await asyncio.gather(*(run(i) for i in range(len(chunks))), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+        word_timings = []
+        offset = 0.0
+        with open(output_path, 'wb') as output:
+            for path, timings in zip(chunk_paths, results):
+                for timing in timings:
+                    word_timings.append({
+                        "text": timing["text"],
+                        "start": timing["start"] + offset,
+                        "end": timing["end"] + offset
+                    })
+                with open(path, 'rb') as f:
+                    output.write(f.read())
+                offset += mp3_duration(path)
+        return word_timings
+    finally:
+        for path in chunk_paths:
+            if os.path.exists(path):
+                os.remove(path)
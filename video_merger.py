@@ -1,15 +1,30 @@
 import os
 import random
 import asyncio
-import edge_tts
 from moviepy.editor import VideoFileClip, AudioFileClip, concatenate_videoclips, CompositeVideoClip, CompositeAudioClip, TextClip, ColorClip, concatenate_audioclips, ImageClip
 import logging
-import numpy as np
 import re
 import json
+import gc
+import math
+import shutil
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from moviepy.config import change_settings
-from PIL import Image, ImageDraw, ImageFont
 import os
+from subtitles import default_renderer, SubtitleTrackClip, write_srt, write_ass
+from segmentation import segment_word_timings
+from tts_engine import EdgeTTSEngine, synthesize_chunks
+import ffmpeg_backend
+from audio_mixer import mix_to_wav
+from pcm_cache import default_pcm_cache
+from endboard_cache import default_endboard_cache, append_segment, DEFAULT_ENDBOARD_PATH
+from render_plan import layout_clips
+from frame_pipeline import FramePipeline
+from compositor import Compositor, default_watermark_cache
+from video_reader import ScaledVideoClip
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
 
 # # 新增
 # image = image.resize((w, h), Image.Resampling.LANCZOS)
@@ -30,8 +45,39 @@ else:
 
 logger = logging.getLogger(__name__)
 
+# 输出视频的编码参数（固定 GOP，便于分段渲染后无损拼接）
+OUTPUT_FPS = 25
+GOP_SIZE = 25
+VIDEO_WRITE_OPTIONS = {
+    'codec': 'libx264',
+    'fps': OUTPUT_FPS,
+    'preset': 'ultrafast',
+    'bitrate': '3000k',
+    'ffmpeg_params': [
+        '-tune', 'zerolatency',
+        '-movflags', '+faststart',
+        '-bf', '0',
+        '-g', str(GOP_SIZE),
+        '-sc_threshold', '0'
+    ],
+}
+
+# 水印图片（覆盖整个画面）
+WATERMARK_PATH = os.path.join('uploads', 'watermarks', '20250317-181646.png')
+
+# 长文本按句子切块并发合成：每块的最大字数和同时进行的请求数
+TTS_CHUNK_CHARS = 1500
+TTS_CONCURRENCY = 4
+
+# 配音语速：+20% 相当于1.2倍速
+TTS_RATE = "+20%"
+
+# 语音超过 STREAM_THRESHOLD 秒时按 STREAM_WINDOW 秒的窗口流式渲染，峰值内存与视频总时长无关
+STREAM_THRESHOLD = 600
+STREAM_WINDOW = 60
+
 class VideoGenerator:
-    def __init__(self, video_library_path, bgm_path, subtitle_length=12, font='STHeiti'):
+    def __init__(self, video_library_path, bgm_path, subtitle_length=12, font='STHeiti', media_index=None, tts_cache=None, render_engine='moviepy', subtitle_mode='sprite', threads=8, segments=1, bgm_gain=0.3, tts_engine=None, stream_threshold=STREAM_THRESHOLD, stream_window=STREAM_WINDOW, timeline=None, output_size=None, renditions=None):
         self.video_library_path = video_library_path
         self.bgm_path = bgm_path
         self.video_clips = []
@@ -39,6 +85,22 @@ class VideoGenerator:
         self.subtitle_timings = []
         self.subtitle_length = subtitle_length
         self.font = font  # 添加字体属性
+        self.media_index = media_index  # 视频素材元数据索引（可选）
+        self.tts_cache = tts_cache  # 配音缓存（可选）
+        self.subtitle_renderer = default_renderer  # 字幕贴图渲染器（进程内共享缓存）
+        self.endboard_cache = default_endboard_cache  # 预编码尾板缓存
+        self.pcm_cache = default_pcm_cache  # 背景音乐解码缓存
+        self.render_engine = render_engine  # 渲染引擎：moviepy 或 ffmpeg
+        self.subtitle_mode = subtitle_mode  # 字幕方式：sprite（PIL 贴图）或 ass（libass 烧录）
+        self.threads = threads  # ffmpeg 编码线程数
+        self.segments = segments  # 分段并行渲染的段数，1 表示不分段
+        self.bgm_gain = bgm_gain  # 背景音乐的线性增益（按上传时分析的响度预先计算）
+        self.tts_engine = tts_engine or EdgeTTSEngine()  # 语音合成引擎（可替换为本地测试引擎）
+        self.stream_threshold = stream_threshold  # 超过该时长（秒）的语音改用窗口流式渲染
+        self.stream_window = stream_window  # 流式渲染每个窗口的时长（秒）
+        self.output_size = tuple(output_size) if output_size else None  # 输出分辨率 (宽, 高)，不指定时取第一个素材的尺寸
+        self.renditions = renditions or None  # 输出规格列表 [{'name', 'size', 'bitrate', 'fit'}]，画面合成一次后分发到每个规格
+        self.timeline = timeline  # 渲染计划中的时间线（设置后按它组装画面和音轨，不再自行排布素材）
 
     def split_text_into_segments(self, text):
         """将文本切分成指定长度的段落"""
@@ -48,6 +110,22 @@ class VideoGenerator:
             segments.append(segment)
         return segments
 
+    async def synthesize_speech(self, text, voice, rate, output_path):
+        """合成语音并返回逐字时间戳；长文本按句子切块后并发合成，再拼接音频、平移时间戳"""
+        chunks = self.split_text_into_chunks(text)
+        if len(chunks) <= 1:
+            return await self.tts_engine.synthesize(text, voice, rate, output_path)
+
+        logger.info(f"文本共 {len(text)} 字，切分为 {len(chunks)} 块并发合成")
+        return await synthesize_chunks(
+            self.tts_engine, chunks, voice, rate, output_path, max_concurrency=TTS_CONCURRENCY
+        )
+
+    def narration_cache_key(self, text, voice):
+        """配音缓存键：不同引擎生成的音频按命名空间区分"""
+        namespace = getattr(self.tts_engine, 'cache_namespace', '')
+        return self.tts_cache.make_key(text.strip(), f"{namespace}:{voice}" if namespace else voice, TTS_RATE)
+
     async def text_to_speech(self, text, voice, output_path):
         """将文本转换为语音"""
         try:
@@ -55,108 +133,21 @@ class VideoGenerator:
             original_text = text.strip()
 
             # 设置语音速度为1.2倍
-            communicate = edge_tts.Communicate(original_text, voice, rate="+20%")  # +20% 相当于1.2倍速
-
-            # 收集所有的时间戳
-            word_timings = []
-            current_word = ""
-            word_start = 0
-
-            # 首先收集每个字的时间戳
-            async for chunk in communicate.stream():
-                if chunk["type"] == "WordBoundary":
-                    word_timings.append({
-                        "text": chunk["text"],
-                        "start": word_start / 10000000,
-                        "end": chunk["offset"] / 10000000
-                    })
-                    word_start = chunk["offset"]
-
-            # 保存语音文件
-            await communicate.save(output_path)
+            rate = TTS_RATE
+
+            word_timings = None
+            cache_key = None
+            if self.tts_cache is not None:
+                cache_key = self.narration_cache_key(original_text, voice)
+                word_timings = self.tts_cache.get(cache_key, output_path)
+
+            if word_timings is None:
+                word_timings = await self.synthesize_speech(original_text, voice, rate, output_path)
+                if self.tts_cache is not None:
+                    self.tts_cache.put(cache_key, output_path, word_timings)
 
             # 处理文本，按固定字数分段
-            processed_timing_data = []
-            current_segment = ""
-            segment_start = None
-            buffer = ""  # 用于存储未达到最小长度的文本
-            buffer_start = None  # 缓冲区文本的开始时间
-
-            min_segment_length = max(self.subtitle_length // 3, 4)  # 最小段落长度，至少4个字
-
-            for i, word in enumerate(word_timings):
-                if buffer:
-                    buffer += word["text"]
-                    if len(re.sub(r'[，。！？、："""]', '', buffer)) >= min_segment_length:
-                        current_segment = buffer
-                        segment_start = buffer_start
-                        buffer = ""
-                        buffer_start = None
-                else:
-                    current_segment += word["text"]
-                    if segment_start is None:
-                        segment_start = word["start"]
-
-                # 当累积的文本达到指定长度，或遇到句末标点且当前段落超过最小长度时，或是最后一个字时，就进行分段
-                is_end_punctuation = any(p in word["text"] for p in "。！？")
-                is_last_word = i == len(word_timings) - 1
-                current_length = len(re.sub(r'[，。！？、："""]', '', current_segment))
-
-                if (current_length >= self.subtitle_length or
-                    (is_end_punctuation and current_length >= min_segment_length) or
-                    is_last_word):
-
-                    # 移除标点符号用于显示
-                    clean_segment = re.sub(r'[，。！？、："""]', '', current_segment)
-
-                    # 如果当前段落超过指定长度，需要进一步分段
-                    if len(clean_segment) > self.subtitle_length:
-                        # 按指定长度切分，确保每段至少达到最小长度
-                        for j in range(0, len(clean_segment), self.subtitle_length):
-                            sub_segment = clean_segment[j:j+self.subtitle_length]
-                            if len(sub_segment) < min_segment_length and j + self.subtitle_length < len(clean_segment):
-                                continue  # 跳过过短的片段，将其与下一段合并
-
-                            # 计算这部分文本对应的时间
-                            sub_length = len(sub_segment)
-                            total_length = len(clean_segment)
-                            total_duration = word["end"] - segment_start
-                            sub_duration = (total_duration * sub_length) / total_length
-
-                            sub_start = segment_start + (j / len(clean_segment)) * total_duration
-                            sub_end = sub_start + sub_duration
-
-                            processed_timing_data.append({
-                                "text": sub_segment,
-                                "start": sub_start,
-                                "end": sub_end - 0.1  # 稍微提前结束，避免字幕重叠
-                            })
-                    else:
-                        if len(clean_segment) < min_segment_length and not is_last_word:
-                            # 如果段落太短且不是最后一段，将其存入缓冲区
-                            buffer = current_segment
-                            buffer_start = segment_start
-                        else:
-                            processed_timing_data.append({
-                                "text": clean_segment,
-                                "start": segment_start,
-                                "end": word["end"] - 0.1  # 稍微提前结束，避免字幕重叠
-                            })
-
-                    # 重置当前段落
-                    if not buffer:
-                        current_segment = ""
-                        segment_start = None
-
-            # 处理最后的缓冲区内容（如果有的话）
-            if buffer:
-                clean_buffer = re.sub(r'[，。！？、："""]', '', buffer)
-                if clean_buffer:
-                    processed_timing_data.append({
-                        "text": clean_buffer,
-                        "start": buffer_start,
-                        "end": word_timings[-1]["end"] - 0.1
-                    })
+            processed_timing_data = segment_word_timings(word_timings, self.subtitle_length)
 
             self.subtitle_timings = processed_timing_data
             logger.info(f"语音生成成功: {output_path}")
@@ -197,63 +188,84 @@ class VideoGenerator:
     #         raise
 
     def create_subtitle_clip(self, text, start_time, end_time, video_size):
-        """用 PIL 手动生成带描边的白色字幕 ImageClip"""
+        """用 PIL 生成带描边的白色字幕 ImageClip（贴图裁剪到文字区域并缓存）"""
         try:
             # 字体和大小
             font_size = 45
             font_path = os.path.join(os.path.dirname(__file__), "fonts", "msyh.ttc") # macOS 下 STHeiti 字体路径
-            font = ImageFont.truetype(font_path, font_size)
-
-            # 创建透明背景图片
-            img = Image.new("RGBA", video_size, (0, 0, 0, 0))  # RGBA透明背景
-            draw = ImageDraw.Draw(img)
-
-            # 测量文本尺寸并居中绘制
-            text = text.strip()
-            text_size = draw.textbbox((0, 0), text, font=font)
-            text_width = text_size[2] - text_size[0]
-            text_height = text_size[3] - text_size[1]
-            position = ((video_size[0] - text_width) // 2, int(video_size[1] * 0.5))  # 居中偏下
-
-            # 绘制黑色描边
-            stroke_width = 3  # 描边宽度
-            for dx in range(-stroke_width, stroke_width + 1):
-                for dy in range(-stroke_width, stroke_width + 1):
-                    if dx*dx + dy*dy <= stroke_width*stroke_width:  # 圆形描边
-                        draw.text(
-                            (position[0] + dx, position[1] + dy),
-                            text,
-                            font=font,
-                            fill=(0, 0, 0, 255)  # 黑色描边
-                        )
-
-            # 绘制白色文字
-            draw.text(
-                position,
-                text,
-                font=font,
-                fill=(255, 255, 255, 255)  # 白色文字
-            )
+
+            # 渲染（或从缓存取出）裁剪后的字幕贴图，并计算居中偏下的位置
+            sprite, position = self.subtitle_renderer.layout(text.strip(), video_size, font_path, font_size)
 
             # 转换为 ImageClip
-            np_img = np.array(img)
-            txt_clip = ImageClip(np_img, ismask=False)
+            txt_clip = ImageClip(sprite, ismask=False)
             txt_clip = txt_clip.set_start(start_time).set_duration(end_time - start_time)
-            txt_clip = txt_clip.set_position(('center', 'bottom'))
+            txt_clip = txt_clip.set_position(position)
 
             return txt_clip
         except Exception as e:
             logger.error(f"创建字幕失败: {str(e)}")
             raise
 
-    def split_text_into_sentences(self, text):
-        """将文本分割成句子"""
+    def create_subtitle_layer(self, video_size, duration, subtitle_timings=None):
+        """根据 subtitle_timings 创建字幕轨道剪辑（可传入只属于某个窗口的时间戳）"""
+        font_path = os.path.join(os.path.dirname(__file__), "fonts", "msyh.ttc")
+        if subtitle_timings is None:
+            subtitle_timings = self.subtitle_timings
+        return SubtitleTrackClip(
+            subtitle_timings,
+            video_size,
+            duration,
+            renderer=self.subtitle_renderer,
+            font_path=font_path,
+            font_size=45
+        )
+
+    def export_subtitles(self, video_path, video_size=None):
+        """在视频旁导出同名的 SRT 和 ASS 字幕文件，返回文件路径列表"""
+        try:
+            if video_size is None:
+                video_size = tuple(ffmpeg_parse_infos(video_path)['video_size'])
+            base_path = os.path.splitext(video_path)[0]
+            font_path = os.path.join(os.path.dirname(__file__), "fonts", "msyh.ttc")
+            return [
+                write_srt(self.subtitle_timings, f"{base_path}.srt"),
+                write_ass(self.subtitle_timings, f"{base_path}.ass", video_size, font_path=font_path, font_size=45),
+            ]
+        except Exception as e:
+            logger.error(f"导出字幕文件失败: {str(e)}")
+            raise
+
+    def split_text_into_sentences(self, text, keep_punctuation=False):
+        """将文本分割成句子（keep_punctuation=True 时保留句末标点）"""
         # 使用中文标点符号分割句子
-        sentences = re.split(r'[。！？]', text)
+        if keep_punctuation:
+            sentences = re.split(r'(?<=[。！？])', text)
+        else:
+            sentences = re.split(r'[。！？]', text)
         # 过滤空句子
         sentences = [s.strip() for s in sentences if s.strip()]
         return sentences
 
+    def split_text_into_chunks(self, text, max_chars=TTS_CHUNK_CHARS):
+        """按句子边界把长文本合并成不超过 max_chars 字的块（单句过长时按字数硬切）"""
+        chunks = []
+        current = ""
+        for sentence in self.split_text_into_sentences(text, keep_punctuation=True):
+            while len(sentence) > max_chars:
+                if current:
+                    chunks.append(current)
+                    current = ""
+                chunks.append(sentence[:max_chars])
+                sentence = sentence[max_chars:]
+            if current and len(current) + len(sentence) > max_chars:
+                chunks.append(current)
+                current = ""
+            current += sentence
+        if current:
+            chunks.append(current)
+        return chunks
+
     def process_video(self, video_path, text=None):
         """处理视频：移除原声并调整时长"""
         try:
@@ -325,12 +337,22 @@ class VideoGenerator:
             logger.error(f"生成视频失败: {str(e)}")
             raise
 
-    def get_random_videos(self, count=3):
-        """从视频库中随机获取视频"""
+    def get_random_videos(self, count=3, rng=None):
+        """从视频库中随机获取视频（传入带种子的 rng 时选择结果可复现）"""
+        rng = rng or random
         try:
+            # 有索引时直接在内存中选择，不再逐个打开视频文件
+            if self.media_index is not None:
+                selected = self.media_index.sample(count, directory=self.video_library_path, rng=rng)
+                if not selected:
+                    raise Exception("没有找到有效的视频文件！")
+                selected_videos = [entry['filepath'] for entry in selected]
+                logger.info(f"随机选择的视频: {selected_videos}")
+                return selected_videos
+
             # 获取视频库中的所有视频文件
-            video_files = [f for f in os.listdir(self.video_library_path)
-                          if f.lower().endswith(('.mp4', '.avi', '.mov', '.mkv'))]
+            video_files = sorted(f for f in os.listdir(self.video_library_path)
+                                 if f.lower().endswith(('.mp4', '.avi', '.mov', '.mkv')))
 
             if not video_files:
                 raise Exception("视频库中没有找到视频文件！")
@@ -354,7 +376,7 @@ class VideoGenerator:
                 raise Exception("没有找到有效的视频文件！")
 
             # 随机选择指定数量的视频
-            selected_videos = random.sample(valid_videos, min(count, len(valid_videos)))
+            selected_videos = rng.sample(valid_videos, min(count, len(valid_videos)))
             logger.info(f"随机选择的视频: {selected_videos}")
 
             return [os.path.join(self.video_library_path, video) for video in selected_videos]
@@ -362,6 +384,26 @@ class VideoGenerator:
             logger.error(f"随机选择视频失败: {str(e)}")
             raise
 
+    def select_videos(self, duration, rng=None):
+        """选择总时长刚好覆盖 duration 秒的不重复素材，使用次数少、近期未用的素材优先
+
+        没有素材索引时退回随机选择 3 个素材。
+        """
+        if self.media_index is None:
+            return self.get_random_videos(3, rng=rng)
+        try:
+            selected = self.media_index.select_covering(duration, directory=self.video_library_path,
+                                                        rng=rng or random)
+            if not selected:
+                raise Exception("没有找到有效的视频文件！")
+            selected_videos = [entry['filepath'] for entry in selected]
+            total = sum(entry['duration'] for entry in selected)
+            logger.info(f"按时长选择的视频: {selected_videos}，共 {total:.1f}秒，目标 {duration:.1f}秒")
+            return selected_videos
+        except Exception as e:
+            logger.error(f"按时长选择视频失败: {str(e)}")
+            raise
+
     def resize_video(self, clip, target_size):
         """调整视频尺寸"""
         try:
@@ -373,6 +415,10 @@ class VideoGenerator:
             if clip.size[0] <= 0 or clip.size[1] <= 0:
                 raise Exception("视频尺寸无效")
 
+            # 尺寸已一致（如已转码的中间文件）时不再逐帧缩放
+            if tuple(clip.size) == tuple(target_size):
+                return clip
+
             # 调整视频尺寸
             resized_clip = clip.resize(width=target_size[0], height=target_size[1])
 
@@ -446,22 +492,9 @@ class VideoGenerator:
             # 合并音频
             final_audio = CompositeAudioClip([narration, bgm])
 
-            # 创建字幕剪辑
-            subtitle_clips = []
-            for timing in self.subtitle_timings:
-                subtitle_clip = self.create_subtitle_clip(
-                    timing["text"],
-                    timing["start"],
-                    timing["end"],
-                    final_video.size
-                )
-                subtitle_clips.append(subtitle_clip)
-
-            logger.info(f"创建了 {len(subtitle_clips)} 个字幕剪辑")
-
-            # 创建字幕层，使用交叉淡入淡出效果
-            subtitle_layer = CompositeVideoClip(subtitle_clips, use_bgclip=False)
-            logger.info(f"字幕层创建成功，尺寸: {subtitle_layer.size}")
+            # 创建字幕层（单一字幕轨道，逐帧按区间索引查找当前字幕）
+            subtitle_layer = self.create_subtitle_layer(final_video.size, narration_duration)
+            logger.info(f"字幕层创建成功，共 {len(subtitle_layer.timings)} 条字幕，尺寸: {subtitle_layer.size}")
 
             # 加载水印图片
             watermark_path = os.path.join(os.getcwd(), 'uploads', 'watermarks', '20250317-181646.png')
@@ -511,7 +544,7 @@ class VideoGenerator:
                 audio_codec='aac',
                 fps=25,
                 preset='ultrafast',
-                threads=8,
+                threads=self.threads,
                 bitrate='3000k',
                 ffmpeg_params=[
                     '-tune', 'zerolatency',
@@ -535,162 +568,452 @@ class VideoGenerator:
             logger.error(f"创建最终视频失败: {str(e)}")
             raise
 
-    async def create_final_video_with_existing_audio(self, video_paths, narration_path, output_path):
-        """使用已存在的语音和字幕时间戳创建最终视频"""
-        try:
-            # 验证参数
-            if not video_paths or len(video_paths) == 0:
-                raise ValueError("未提供视频文件路径")
-
-            if not os.path.exists(narration_path):
-                raise ValueError(f"语音文件不存在: {narration_path}")
-
-            if not os.path.exists(self.bgm_path):
-                raise ValueError(f"背景音乐文件不存在: {self.bgm_path}")
-
-            # 加载视频片段
-            video_clips = []
-            for path in video_paths:
-                try:
-                    clip = VideoFileClip(path)
-                    video_clips.append(clip)
-                except Exception as e:
-                    logger.error(f"加载视频片段失败 {path}: {str(e)}")
-                    raise
-
-            # 获取第一个视频的尺寸作为目标尺寸
-            target_size = video_clips[0].size
-            logger.info(f"目标视频尺寸: {target_size}")
-
-            # 调整所有视频片段到相同尺寸
-            video_clips = [self.resize_video(clip, target_size) for clip in video_clips]
+    def get_clip_info(self, path):
+        """读取素材的尺寸和时长，优先使用素材索引"""
+        entry = self.media_index.get(path) if self.media_index is not None else None
+        if entry is not None and entry.get('is_valid') and not self.media_index.is_stale(path):
+            return (entry['width'], entry['height']), entry['duration']
+        infos = ffmpeg_parse_infos(path)
+        return tuple(infos['video_size']), infos['video_duration']
 
-            # 计算每个视频片段的持续时间
-            total_duration = sum(clip.duration for clip in video_clips)
-
-            # 加载语音
-            narration = AudioFileClip(narration_path)
-            narration_duration = narration.duration
+    def render_with_ffmpeg(self, video_paths, narration_path, output_path):
+        """用单条 ffmpeg 命令渲染最终视频（与 moviepy 路径输出一致）"""
+        try:
+            narration_duration = self.get_narration_duration(narration_path)
             logger.info(f"语音时长: {narration_duration}秒")
 
-            # 如果视频总长度超过语音长度，则循环播放视频
-            if total_duration < narration_duration:
-                repeat_times = int(narration_duration / total_duration) + 1
-                video_clips = video_clips * repeat_times
-
-            # 合并视频片段
-            final_video = concatenate_videoclips(video_clips)
-
-            # 截取视频以匹配语音长度
-            final_video = final_video.subclip(0, narration_duration)
-
-            # 加载背景音乐
-            bgm = AudioFileClip(self.bgm_path)
+            # 按时间线截取每个片段用到的区间
+            target_size, segments = self.plan_timeline(video_paths, narration_duration)
+            logger.info(f"目标视频尺寸: {target_size}")
 
-            # 调整背景音乐音量
-            bgm = bgm.volumex(0.3)
+            ffmpeg_backend.render_timeline(
+                [(segment['path'], segment['in'], segment['out']) for segment in segments],
+                target_size,
+                narration_path,
+                narration_duration,
+                self.bgm_path,
+                output_path,
+                self.subtitle_timings,
+                watermark_path=self.get_watermark_path(),
+                font_path=os.path.join(os.path.dirname(__file__), "fonts", "msyh.ttc"),
+                font_size=45,
+                renderer=self.subtitle_renderer,
+                subtitle_mode=self.subtitle_mode,
+                threads=self.threads,
+                bgm_volume=self.bgm_gain,
+                bgm_offset=self.get_bgm_offset(),
+                renditions=self.rendition_outputs(output_path) if self.renditions else None
+            )
+            logger.info(f"ffmpeg 渲染完成: {output_path}")
+            return output_path
+        except Exception as e:
+            logger.error(f"ffmpeg 渲染失败: {str(e)}")
+            raise
 
-            # 循环背景音乐以匹配视频长度
-            if bgm.duration < narration_duration:
-                repeat_times = int(narration_duration / bgm.duration) + 1
-                bgm_clips = [bgm] * repeat_times
-                bgm = concatenate_audioclips(bgm_clips)
+    def mix_audio(self, narration_path):
+        """语音和背景音乐解码为 PCM 后用 NumPy 一次混音，返回临时 WAV 音轨（MixedTrack）"""
+        try:
+            narration_duration = self.get_narration_duration(narration_path)
+            return mix_to_wav(
+                narration_path, self.bgm_path, narration_duration,
+                workdir=os.path.dirname(os.path.abspath(narration_path)),
+                bgm_gain=self.bgm_gain,
+                pcm_cache=self.pcm_cache,
+                bgm_offset=self.get_bgm_offset()
+            )
+        except Exception as e:
+            logger.error(f"混音失败: {str(e)}")
+            raise
 
-            # 截取背景音乐以匹配视频长度
-            bgm = bgm.subclip(0, narration_duration)
+    def get_narration_duration(self, narration_path):
+        """语音时长，有时间线时以渲染计划为准"""
+        if self.timeline is not None:
+            return self.timeline['duration']
+        return ffmpeg_parse_infos(narration_path)['duration']
+
+    def get_watermark_path(self):
+        """返回水印图片路径，文件不存在时返回 None"""
+        if self.timeline is not None:
+            return self.timeline['watermark']
+        watermark_path = os.path.join(os.getcwd(), WATERMARK_PATH)
+        if not os.path.exists(watermark_path):
+            logger.warning(f"水印文件不存在: {watermark_path}，跳过水印添加")
+            return None
+        return watermark_path
+
+    def get_bgm_offset(self):
+        """背景音乐的起始位置（秒）"""
+        if self.timeline is not None:
+            return self.timeline['bgm']['offset']
+        return 0.0
+
+    def get_endboard_path(self):
+        """返回尾板视频路径，文件不存在时返回 None"""
+        if self.timeline is not None:
+            return self.timeline['endboard']
+        endboard_path = os.path.join(os.getcwd(), DEFAULT_ENDBOARD_PATH)
+        if not os.path.exists(endboard_path):
+            logger.warning(f"尾板视频不存在: {endboard_path}，跳过尾板添加")
+            return None
+        return endboard_path
+
+    def rendition_outputs(self, output_path):
+        """为每个输出规格分配文件路径：第一个规格写入 output_path，其余在文件名后加规格名"""
+        root, ext = os.path.splitext(output_path)
+        return [
+            dict(rendition, path=output_path if i == 0 else f"{root}-{rendition['name']}{ext}")
+            for i, rendition in enumerate(self.renditions)
+        ]
+
+    def output_paths(self, output_path):
+        """渲染实际写出的全部文件（每个输出规格一个，未指定规格时只有 output_path）"""
+        if not self.renditions:
+            return [output_path]
+        return [rendition['path'] for rendition in self.rendition_outputs(output_path)]
+
+    def render_master(self, render, video_paths, narration_path, output_path):
+        """分段和流式渲染：先用 render 写出合成好的母版，有输出规格时再一次解码、在同一次编码中分发到各规格"""
+        if not self.renditions:
+            return render(video_paths, narration_path, output_path)
+        master_path = f"{os.path.splitext(output_path)[0]}.master.mp4"
+        try:
+            render(video_paths, narration_path, master_path)
+            ffmpeg_backend.run_ffmpeg(ffmpeg_backend.build_rendition_command(
+                master_path, ffmpeg_parse_infos(master_path)['video_size'],
+                self.rendition_outputs(output_path), threads=self.threads
+            ))
+        finally:
+            if os.path.exists(master_path):
+                os.remove(master_path)
+        return output_path
+
+    def append_endboard(self, main_path, endboard_path, output_path):
+        """按主体视频的尺寸取预编码尾板，流复制拼接成最终视频"""
+        try:
+            video_size = ffmpeg_parse_infos(main_path)['video_size']
+            segment_path = self.endboard_cache.get(endboard_path, video_size)
+            append_segment(main_path, segment_path, output_path)
+            logger.info(f"已追加尾板: {segment_path}")
+            return output_path
+        except Exception as e:
+            logger.error(f"追加尾板失败: {str(e)}")
+            raise
 
-            # 合并音频
-            final_audio = CompositeAudioClip([narration, bgm])
+    def render_options(self):
+        """返回在其他进程中重建同样配置的生成器所需的参数"""
+        return {
+            'video_library_path': self.video_library_path,
+            'bgm_path': self.bgm_path,
+            'subtitle_length': self.subtitle_length,
+            'font': self.font,
+            'media_index': self.media_index,
+            'render_engine': self.render_engine,
+            'subtitle_mode': self.subtitle_mode,
+            'threads': self.threads,
+            'bgm_gain': self.bgm_gain,
+            'stream_threshold': self.stream_threshold,
+            'stream_window': self.stream_window,
+            'timeline': self.timeline,
+            'output_size': self.output_size,
+            'renditions': self.renditions,
+        }
+
+    def segment_bounds(self, duration):
+        """把时间线按段数切分，每段起点都落在 GOP 边界上"""
+        return self.window_bounds(duration, duration / self.segments)
+
+    def window_bounds(self, duration, length):
+        """把时间线切成约 length 秒的区间，长度向上取整到 GOP，保证每段起点都是关键帧"""
+        gop_seconds = GOP_SIZE / OUTPUT_FPS
+        segment_length = max(gop_seconds, math.ceil(length / gop_seconds) * gop_seconds)
+        bounds = []
+        start = 0.0
+        while start < duration:
+            end = min(start + segment_length, duration)
+            bounds.append((start, end))
+            start = end
+        return bounds
+
+    def concat_segments(self, segment_paths, audio_path, output_path, workdir):
+        """用 concat 分离器流复制拼接各段画面，同时编码封装混音后的音轨"""
+        list_path = os.path.join(workdir, "segments.txt")
+        with open(list_path, 'w', encoding='utf-8') as f:
+            for path in segment_paths:
+                f.write(f"file '{os.path.abspath(path)}'\n")
+
+        ffmpeg_backend.run_ffmpeg([
+            ffmpeg_backend.ffmpeg_binary(), '-y', '-hide_banner', '-loglevel', 'error',
+            '-f', 'concat', '-safe', '0', '-i', list_path,
+            '-i', audio_path,
+            '-map', '0:v', '-map', '1:a',
+            '-c:v', 'copy',
+            *ffmpeg_backend.AUDIO_ENCODE_ARGS,
+            '-movflags', '+faststart',
+            output_path
+        ])
+
+    def render_segmented(self, video_paths, narration_path, output_path):
+        """分段并行渲染：每段在独立进程中编码（不含音频），最后用 concat 分离器流复制拼接并封装音频"""
+        try:
+            narration_duration = self.get_narration_duration(narration_path)
+            bounds = self.segment_bounds(narration_duration)
+            logger.info(f"分段渲染: 总时长 {narration_duration}秒，共 {len(bounds)} 段")
 
-            # 创建字幕剪辑
-            subtitle_clips = []
-            for timing in self.subtitle_timings:
-                subtitle_clip = self.create_subtitle_clip(
-                    timing["text"],
-                    timing["start"],
-                    timing["end"],
-                    final_video.size
-                )
-                subtitle_clips.append(subtitle_clip)
+            options = dict(self.render_options(), threads=max(1, self.threads // len(bounds)))
+            workdir = tempfile.mkdtemp(prefix='segments_', dir=os.path.dirname(os.path.abspath(output_path)))
+            mixed_track = None
+            try:
+                segment_paths = [os.path.join(workdir, f"segment_{i:04d}.mp4") for i in range(len(bounds))]
+                with ProcessPoolExecutor(max_workers=len(bounds),
+                                         mp_context=multiprocessing.get_context('spawn')) as pool:
+                    futures = [
+                        pool.submit(render_segment, options, self.subtitle_timings, video_paths,
+                                    narration_path, start, end, path)
+                        for (start, end), path in zip(bounds, segment_paths)
+                    ]
+
+                    # 子进程渲染画面的同时，在本进程混音
+                    mixed_track = self.mix_audio(narration_path)
+
+                    for future in futures:
+                        future.result()
+
+                self.concat_segments(segment_paths, mixed_track.path, output_path, workdir)
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+                if mixed_track is not None:
+                    mixed_track.close()
+
+            logger.info(f"分段渲染完成: {output_path}")
+            return output_path
+        except Exception as e:
+            logger.error(f"分段渲染失败: {str(e)}")
+            raise
 
-            logger.info(f"创建了 {len(subtitle_clips)} 个字幕剪辑")
+    def plan_timeline(self, video_paths, duration):
+        """返回 (目标尺寸, 时间线片段列表)
+
+        设置了渲染计划的时间线时直接使用；否则按素材顺序循环排布到 duration 秒，
+        目标尺寸为指定的输出分辨率或第一个素材的尺寸。只读取元数据，不打开视频。
+        """
+        if self.timeline is not None:
+            return tuple(self.timeline['size']), self.timeline['segments']
+        clip_infos = [self.get_clip_info(path) for path in video_paths]
+        clips = [
+            {'id': path, 'path': path, 'duration': clip_duration}
+            for path, (_, clip_duration) in zip(video_paths, clip_infos)
+        ]
+        return self.output_size or tuple(clip_infos[0][0]), layout_clips(clips, duration)
+
+    def window_subtitle_timings(self, start, end):
+        """取与 [start, end) 相交的字幕，时间平移到窗口内并截断到窗口边界"""
+        return [
+            {
+                "text": timing["text"],
+                "start": max(timing["start"], start) - start,
+                "end": min(timing["end"], end) - start
+            }
+            for timing in self.subtitle_timings
+            if timing["end"] > start and timing["start"] < end
+        ]
+
+    def compose_base(self, segments, target_size, start, end):
+        """只打开 [start, end) 窗口内用到的素材，拼接该窗口的底层画面，返回 (剪辑, 需要关闭的资源)"""
+        sources = {}
+        pieces = []
+        try:
+            for segment in segments:
+                if segment['end'] <= start or segment['start'] >= end:
+                    continue
+                path = segment['path']
+                if path not in sources:
+                    # 音轨单独混音，素材只需解码画面；缩放和帧率转换在 ffmpeg 解码时完成
+                    sources[path] = ScaledVideoClip(path, size=target_size, fps=OUTPUT_FPS)
+                source = sources[path]
+                # 窗口与片段的交集，换算到素材内的时间
+                t_in = segment['in'] + max(start, segment['start']) - segment['start']
+                t_out = min(segment['in'] + min(end, segment['end']) - segment['start'], source.duration)
+                if t_out > t_in:
+                    pieces.append(self.resize_video(source, target_size).subclip(t_in, t_out))
+
+            window = concatenate_videoclips(pieces).set_duration(end - start)
+            return window, list(sources.values())
+        except Exception as e:
+            for clip in sources.values():
+                clip.close()
+            logger.error(f"组装窗口 {start}-{end} 秒失败: {str(e)}")
+            raise
 
-            # 创建字幕层，使用交叉淡入淡出效果
-            subtitle_layer = CompositeVideoClip(subtitle_clips, use_bgclip=False)
-            logger.info(f"字幕层创建成功，尺寸: {subtitle_layer.size}")
+    def write_window(self, segments, target_size, start, end, output_path, audio_path=None, renditions=None):
+        """用解码、合成、编码三级流水线渲染 [start, end) 窗口的画面，audio_path 为要封装的音轨
 
-            # 加载水印图片
-            watermark_path = os.path.join(os.getcwd(), 'uploads', 'watermarks', '20250317-181646.png')
-            if not os.path.exists(watermark_path):
-                logger.warning(f"水印文件不存在: {watermark_path}，跳过水印添加")
-                # 不添加水印，直接使用原视频
-                main_video = CompositeVideoClip([final_video, subtitle_layer])
-            else:
-                watermark = ImageClip(watermark_path)
-                watermark = watermark.set_duration(narration_duration)  # 设置水印持续时间
-                watermark = watermark.resize(final_video.size)  # 设置水印尺寸与视频一致
-                watermark = watermark.set_position(('center', 'center'))  # 设置水印位置居中
-                # 将视频、字幕层和水印层组合，确保字幕在最上层
-                main_video = CompositeVideoClip([final_video, watermark, subtitle_layer])
+        renditions: 输出规格列表（含 path），提供时在同一次编码中写出每个规格，不写 output_path
+        """
+        base, resources = self.compose_base(segments, target_size, start, end)
+        try:
+            # 水印预乘 alpha 后按输出尺寸缓存，水印和字幕只混合不透明的包围盒
+            watermark_path = self.get_watermark_path()
+            compositor = Compositor(
+                target_size,
+                watermark=default_watermark_cache.load(watermark_path, target_size) if watermark_path else None,
+                subtitles=self.create_subtitle_layer(target_size, end - start, self.window_subtitle_timings(start, end))
+            )
+            pipeline = FramePipeline(base, compositor.composite)
+            return pipeline.write(output_path, audiofile=audio_path, threads=self.threads, renditions=renditions,
+                                  **VIDEO_WRITE_OPTIONS)
+        finally:
+            base.close()
+            for clip in resources:
+                clip.close()
 
-            # 加载尾板视频
-            endboard_path = os.path.join(os.getcwd(), 'uploads', 'endboards', '1.mp4')
-            if not os.path.exists(endboard_path):
-                logger.warning(f"尾板视频不存在: {endboard_path}，跳过尾板添加")
-                final_video = main_video
-                final_audio = final_audio
-            else:
-                endboard = VideoFileClip(endboard_path)
-                endboard = endboard.resize(final_video.size)  # 设置尾板尺寸与视频一致
-                endboard_duration = endboard.duration
-                logger.info(f"尾板视频时长: {endboard_duration}秒")
+    def render_streaming(self, video_paths, narration_path, output_path):
+        """窗口流式渲染：逐个窗口打开所需素材、编码画面并立即释放，最后流复制拼接并封装音频
 
-                # 将主视频和尾板视频连接
-                final_video = concatenate_videoclips([main_video, endboard])
+        每个时刻只持有一个窗口的解码器和字幕，峰值内存只取决于窗口长度。
+        """
+        try:
+            narration_duration = self.get_narration_duration(narration_path)
+            target_size, segments = self.plan_timeline(video_paths, narration_duration)
+            bounds = self.window_bounds(narration_duration, self.stream_window)
+            logger.info(f"流式渲染: 总时长 {narration_duration}秒，共 {len(bounds)} 个窗口，目标尺寸: {target_size}")
 
-                # 创建尾板音频
-                endboard_audio = endboard.audio
+            workdir = tempfile.mkdtemp(prefix='windows_', dir=os.path.dirname(os.path.abspath(output_path)))
+            mixed_track = None
+            try:
+                window_paths = []
+                for i, (start, end) in enumerate(bounds):
+                    window_path = os.path.join(workdir, f"window_{i:04d}.mp4")
+                    try:
+                        self.write_window(segments, target_size, start, end, window_path)
+                    finally:
+                        # moviepy 剪辑之间存在循环引用，及时回收上一窗口缓存的帧，避免内存逐窗口累积
+                        gc.collect()
+                    window_paths.append(window_path)
+                    logger.info(f"窗口 {i + 1}/{len(bounds)} 渲染完成")
+
+                mixed_track = self.mix_audio(narration_path)
+                self.concat_segments(window_paths, mixed_track.path, output_path, workdir)
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+                if mixed_track is not None:
+                    mixed_track.close()
+
+            logger.info(f"流式渲染完成: {output_path}")
+            return output_path
+        except Exception as e:
+            logger.error(f"流式渲染失败: {str(e)}")
+            raise
 
-                # 更新音频时长并合并音频
-                final_audio = final_audio.set_duration(main_video.duration)
-                final_audio = CompositeAudioClip([final_audio, endboard_audio.set_start(main_video.duration)])
+    async def create_final_video_with_existing_audio(self, video_paths, narration_path, output_path):
+        """使用已存在的语音和字幕时间戳创建最终视频"""
+        try:
+            # 验证参数
+            if not video_paths or len(video_paths) == 0:
+                raise ValueError("未提供视频文件路径")
 
-            # 设置音频
-            final_video = final_video.set_audio(final_audio)
+            if not os.path.exists(narration_path):
+                raise ValueError(f"语音文件不存在: {narration_path}")
 
-            logger.info(f"最终视频尺寸: {final_video.size}")
+            if not os.path.exists(self.bgm_path):
+                raise ValueError(f"背景音乐文件不存在: {self.bgm_path}")
 
-            # 写入最终视频
-            final_video.write_videofile(
-                output_path,
-                codec='libx264',
-                audio_codec='aac',
-                fps=25,
-                preset='ultrafast',
-                threads=8,
-                bitrate='3000k',
-                ffmpeg_params=[
-                    '-tune', 'zerolatency',
-                    '-movflags', '+faststart',
-                    '-bf', '0',
-                    '-g', '25',
-                    '-sc_threshold', '0'
-                ]
-            )
+            # 有尾板时先渲染主体部分，再流复制追加预编码的尾板
+            endboard_path = self.get_endboard_path()
+            main_path = output_path
+            if endboard_path is not None:
+                main_path = f"{os.path.splitext(output_path)[0]}.main.mp4"
 
-            # 关闭所有剪辑
-            for clip in video_clips:
-                clip.close()
-            narration.close()
-            bgm.close()
-            endboard.close()
-            final_video.close()
+            try:
+                if self.render_engine == 'ffmpeg' or self.subtitle_mode == 'ass':
+                    # 使用 ffmpeg 滤镜图渲染，画面不经过 Python（ASS 字幕烧录同样走 ffmpeg）
+                    self.render_with_ffmpeg(video_paths, narration_path, main_path)
+                elif self.segments > 1:
+                    # 长视频按 GOP 边界切段，多进程并行渲染后无损拼接
+                    self.render_master(self.render_segmented, video_paths, narration_path, main_path)
+                elif self.get_narration_duration(narration_path) > self.stream_threshold:
+                    # 长语音按窗口流式渲染，内存占用不随时长增长
+                    self.render_master(self.render_streaming, video_paths, narration_path, main_path)
+                else:
+                    narration_duration = self.get_narration_duration(narration_path)
+                    target_size, segments = self.plan_timeline(video_paths, narration_duration)
+                    logger.info(f"语音时长: {narration_duration}秒，目标视频尺寸: {target_size}")
+                    mixed_track = self.mix_audio(narration_path)
+                    try:
+                        # 写入主体视频，混音后的 WAV 由 ffmpeg 直接封装
+                        self.write_window(segments, target_size, 0, narration_duration, main_path,
+                                          audio_path=mixed_track.path,
+                                          renditions=self.rendition_outputs(main_path) if self.renditions else None)
+                    finally:
+                        mixed_track.close()
+
+                if endboard_path is not None:
+                    # 每个输出规格按各自的尺寸追加尾板
+                    for main, final in zip(self.output_paths(main_path), self.output_paths(output_path)):
+                        self.append_endboard(main, endboard_path, final)
+            finally:
+                for main, final in zip(self.output_paths(main_path), self.output_paths(output_path)):
+                    if main != final and os.path.exists(main):
+                        os.remove(main)
 
             return output_path
         except Exception as e:
             logger.error(f"创建最终视频失败: {str(e)}")
             raise
 
+def render_segment(options, subtitle_timings, video_paths, narration_path, start, end, output_path):
+    """在子进程中重建时间线，只编码 [start, end) 区间的画面"""
+    generator = VideoGenerator(**options)
+    generator.subtitle_timings = subtitle_timings
+    narration_duration = generator.get_narration_duration(narration_path)
+    target_size, segments = generator.plan_timeline(video_paths, narration_duration)
+    generator.write_window(segments, target_size, start, end, output_path)
+    return output_path
+
+def render_variant(options):
+    """渲染一个视频变体并导出字幕文件（可在进程池的子进程中调用）
+
+    options 中的素材、背景音乐和字幕时间戳都由调用方准备好，多个变体共享同一份语音和字幕；
+    提供 timeline（渲染计划的时间线）时，素材区间、背景音乐、字幕、水印和尾板都以时间线为准。
+    返回 (成品路径, 字幕路径列表, {规格名: 文件路径})，未指定输出规格时最后一项为空字典。
+    """
+    timeline = options.get('timeline')
+    if timeline is not None:
+        options = dict(options,
+                       bgm_path=timeline['bgm']['path'],
+                       bgm_gain=timeline['bgm']['gain'],
+                       subtitle_timings=timeline['subtitles'])
+    generator = VideoGenerator(
+        options['video_library_path'],
+        options['bgm_path'],
+        subtitle_length=options.get('subtitle_length', 12),
+        font=options.get('font', 'STHeiti'),
+        media_index=options.get('media_index'),
+        render_engine=options.get('render_engine', 'moviepy'),
+        subtitle_mode=options.get('subtitle_mode', 'sprite'),
+        threads=options.get('threads', 8),
+        segments=options.get('segments', 1),
+        bgm_gain=options.get('bgm_gain', 0.3),
+        stream_threshold=options.get('stream_threshold', STREAM_THRESHOLD),
+        stream_window=options.get('stream_window', STREAM_WINDOW),
+        timeline=options.get('timeline'),
+        output_size=options.get('output_size'),
+        renditions=options.get('renditions')
+    )
+    generator.subtitle_timings = options['subtitle_timings']
+    asyncio.run(generator.create_final_video_with_existing_audio(
+        options['video_paths'],
+        options['narration_path'],
+        options['output_path']
+    ))
+    subtitle_paths = generator.export_subtitles(options['output_path'])
+    renditions = {}
+    if generator.renditions:
+        renditions = {
+            rendition['name']: rendition['path']
+            for rendition in generator.rendition_outputs(options['output_path'])
+        }
+    return options['output_path'], subtitle_paths, renditions
+
 async def main():
     parser = argparse.ArgumentParser(description='视频生成工具')
     parser.add_argument('text_file', help='包含小说文本的文件路径')
@@ -0,0 +1,76 @@
+import os
+import subprocess as sp
+
+from moviepy.config import get_setting
+from moviepy.video.VideoClip import VideoClip
+from moviepy.video.io.ffmpeg_reader import FFMPEG_VideoReader
+
+
+class ScaledVideoReader(FFMPEG_VideoReader):
+    """在 ffmpeg 解码时完成缩放和帧率转换的读取器
+
+    size: 输出尺寸 (宽, 高)；fps: 输出帧率。管道中传输的已是目标尺寸和帧率的画面，
+    Python 端不再逐帧缩放，也不再读取并丢弃多余的帧。
+    """
+
+    def __init__(self, filename, size=None, fps=None, pix_fmt="rgb24", resize_algo='bicubic'):
+        self.target_fps = fps
+        FFMPEG_VideoReader.__init__(
+            self, filename, pix_fmt=pix_fmt, resize_algo=resize_algo,
+            target_resolution=(size[1], size[0]) if size else None
+        )
+
+    def initialize(self, starttime=0):
+        """打开文件并启动解码管道（fps 和 scale 滤镜在 ffmpeg 中完成）"""
+        self.close()
+
+        if self.target_fps and self.fps != self.target_fps:
+            self.fps = self.target_fps
+            self.nframes = int(self.duration * self.fps)
+
+        if starttime != 0:
+            offset = min(1, starttime)
+            i_arg = ['-ss', "%.06f" % (starttime - offset),
+                     '-i', self.filename,
+                     '-ss', "%.06f" % offset]
+        else:
+            i_arg = ['-i', self.filename]
+
+        filters = 'scale=%d:%d' % tuple(self.size)
+        if self.target_fps:
+            # 先转换帧率再缩放，被丢弃的帧不参与缩放
+            filters = f'fps={self.target_fps},{filters}'
+
+        cmd = ([get_setting("FFMPEG_BINARY")] + i_arg +
+               ['-loglevel', 'error',
+                '-f', 'image2pipe',
+                '-vf', filters,
+                '-sws_flags', self.resize_algo,
+                '-pix_fmt', self.pix_fmt,
+                '-vcodec', 'rawvideo', '-'])
+        popen_params = {"bufsize": self.bufsize,
+                        "stdout": sp.PIPE,
+                        "stderr": sp.PIPE,
+                        "stdin": sp.DEVNULL}
+        if os.name == "nt":
+            popen_params["creationflags"] = 0x08000000  # CREATE_NO_WINDOW
+        self.proc = sp.Popen(cmd, **popen_params)
+
+
+class ScaledVideoClip(VideoClip):
+    """只含画面的视频素材剪辑，解码时直接输出目标尺寸和帧率（代替 VideoFileClip + resize）"""
+
+    def __init__(self, filename, size=None, fps=None):
+        VideoClip.__init__(self)
+        self.reader = ScaledVideoReader(filename, size=size, fps=fps)
+        self.filename = filename
+        self.duration = self.reader.duration
+        self.end = self.reader.duration
+        self.fps = self.reader.fps
+        self.size = self.reader.size
+        self.make_frame = lambda t: self.reader.get_frame(t)
+
+    def close(self):
+        if self.reader:
+            self.reader.close()
+            self.reader = None
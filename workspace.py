@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import shutil
+import logging
+import threading
+
+from jobs import is_valid_job_id
+
+logger = logging.getLogger(__name__)
+
+
+class JobWorkspace:
+    """单个生成任务的工作目录：保存各阶段的中间产物和清单，失败后重试可从最后完成的阶段继续
+
+    清单（manifest.json）记录任务参数和已完成阶段的结果，每完成一个阶段立即原子写入；
+    阶段结果引用的文件都放在工作目录内（成品视频除外），恢复时会检查文件是否仍然存在。
+    """
+
+    def __init__(self, root, job_id):
+        if not is_valid_job_id(job_id):
+            # 任务 ID 直接用作目录名，拒绝 ".." 等可能指向工作目录之外的值
+            raise ValueError(f"无效的任务 ID: {job_id}")
+        self.job_id = job_id
+        self.dir = os.path.join(root, job_id)
+        self.manifest_path = os.path.join(self.dir, 'manifest.json')
+        self._lock = threading.Lock()
+        self._manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'job_id': self.job_id, 'params': None, 'stages': {}}
+
+    def _save_manifest(self):
+        os.makedirs(self.dir, exist_ok=True)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def exists(self):
+        return os.path.exists(self.manifest_path)
+
+    def path(self, name):
+        """返回工作目录内的文件路径"""
+        os.makedirs(self.dir, exist_ok=True)
+        return os.path.join(self.dir, name)
+
+    @property
+    def params(self):
+        return self._manifest.get('params')
+
+    def save_params(self, params):
+        """记录任务参数，进程重启后仍可按原参数重试"""
+        with self._lock:
+            self._manifest['params'] = params
+            self._save_manifest()
+
+    def stage(self, name, files=()):
+        """返回已完成阶段的结果；阶段未完成或 files 中有文件丢失时返回 None"""
+        with self._lock:
+            entry = self._manifest['stages'].get(name)
+        if entry is None:
+            return None
+        missing = [path for path in files if not os.path.exists(path)]
+        if missing:
+            logger.warning(f"任务 {self.job_id} 阶段 {name} 的产物已丢失，重新执行: {missing}")
+            return None
+        return entry['result']
+
+    def complete(self, name, result):
+        """标记阶段完成并保存其结果（需可 JSON 序列化）"""
+        with self._lock:
+            self._manifest['stages'][name] = {'result': result, 'completed_at': time.time()}
+            self._save_manifest()
+        logger.info(f"任务 {self.job_id} 阶段完成: {name}")
+
+    def cleanup(self):
+        """任务成功后删除工作目录"""
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def prune_workspaces(root, max_age):
+    """删除超过 max_age 秒未更新的工作目录（失败后长期未重试的任务）"""
+    if not os.path.isdir(root):
+        return
+    now = time.time()
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        manifest_path = os.path.join(path, 'manifest.json')
+        try:
+            updated = os.path.getmtime(manifest_path if os.path.exists(manifest_path) else path)
+        except OSError:
+            continue
+        if now - updated > max_age:
+            shutil.rmtree(path, ignore_errors=True)
+            logger.info(f"已清理过期任务工作目录: {path}")